@@ -0,0 +1,110 @@
+# benchmarks/bench_categories.py
+# Сравнение CategoryMatcher (поиск подстрок по подготовленным правилам и автомат
+# Ахо-Корасик) с прежними вложенными циклами по ключевым словам.
+# Запуск из корня проекта: python benchmarks/bench_categories.py
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import categories
+from categories import CATEGORIES, CategoryMatcher
+
+LETTERS = 'абвгдежзийклмнопрстуфхцчшщыэюя'
+DESCRIPTIONS = 500
+REPEATS = 5
+
+
+def loop_detect_category(user_categories, description):
+    """Прежний алгоритм: проверка каждого слова подстрокой"""
+    description_lower = description.lower()
+
+    for category, keywords in user_categories.items():
+        for keyword in keywords:
+            if keyword.strip().lower() in description_lower:
+                return category
+
+    for category, keywords in CATEGORIES.items():
+        for keyword in keywords:
+            if keyword in description_lower:
+                return category
+
+    return 'другое'
+
+
+def random_word(rng, min_length=4, max_length=10):
+    return ''.join(rng.choice(LETTERS) for _ in range(rng.randint(min_length, max_length)))
+
+
+def make_user_categories(rng, keyword_count):
+    """Персональные категории по 10 ключевых слов в каждой"""
+    categories = {}
+    for i in range(0, keyword_count, 10):
+        categories[f'категория{i // 10}'] = [random_word(rng) for _ in range(min(10, keyword_count - i))]
+    return categories
+
+
+def make_descriptions(rng, user_categories, words):
+    """Описания из случайных слов; в части из них встречается ключевое слово"""
+    all_keywords = [kw for kws in user_categories.values() for kw in kws]
+    all_keywords += [kw for kws in CATEGORIES.values() for kw in kws]
+
+    descriptions = []
+    for _ in range(DESCRIPTIONS):
+        parts = [random_word(rng) for _ in range(words)]
+        if rng.random() < 0.5:
+            parts[rng.randrange(words)] = rng.choice(all_keywords)
+        descriptions.append(' '.join(parts))
+    return descriptions
+
+
+def build_matcher(user_categories, use_automaton):
+    """CategoryMatcher с принудительно выбранным способом поиска"""
+    threshold = categories.AUTOMATON_MIN_RULES
+    categories.AUTOMATON_MIN_RULES = 0 if use_automaton else float('inf')
+    try:
+        return CategoryMatcher(user_categories)
+    finally:
+        categories.AUTOMATON_MIN_RULES = threshold
+
+
+def bench(func, descriptions):
+    """Лучшее среднее время на одно описание, мкс"""
+    timer = timeit.Timer(lambda: [func(d) for d in descriptions])
+    return min(timer.repeat(repeat=REPEATS, number=1)) / len(descriptions) * 1e6
+
+
+def main():
+    rng = random.Random(42)
+    print("Время на одно описание, мкс")
+    print(f"{'слов':>6} {'длина':>6} {'циклы':>9} {'подстроки':>10} {'автомат':>9} {'выбран':>10} {'ускорение':>10}")
+
+    for keyword_count in (0, 50, 100, 200, 1000, 5000):
+        user_categories = make_user_categories(rng, keyword_count)
+        scan_matcher = build_matcher(user_categories, use_automaton=False)
+        automaton_matcher = build_matcher(user_categories, use_automaton=True)
+        matcher = CategoryMatcher(user_categories)
+
+        for words in (3, 20):
+            descriptions = make_descriptions(rng, user_categories, words)
+
+            # Результаты всех алгоритмов обязаны совпадать
+            for description in descriptions:
+                expected = loop_detect_category(user_categories, description)
+                assert scan_matcher.match(description) == expected
+                assert automaton_matcher.match(description) == expected
+
+            loop_time = bench(lambda d: loop_detect_category(user_categories, d), descriptions)
+            scan_time = bench(scan_matcher.match, descriptions)
+            automaton_time = bench(automaton_matcher.match, descriptions)
+            chosen_time = automaton_time if matcher.use_automaton else scan_time
+            chosen = 'автомат' if matcher.use_automaton else 'подстроки'
+            average_length = sum(map(len, descriptions)) // len(descriptions)
+            print(f"{len(matcher.rules):>6} {average_length:>6} {loop_time:>9.2f} {scan_time:>10.2f} "
+                  f"{automaton_time:>9.2f} {chosen:>10} {loop_time / chosen_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
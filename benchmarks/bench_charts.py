@@ -0,0 +1,71 @@
+# benchmarks/bench_charts.py
+# Сравнение отрисовки графиков через matplotlib (charts.py) и Pillow (charts_fast.py):
+# время импорта модуля, время одного графика и размер PNG.
+# Запуск из корня проекта: python benchmarks/bench_charts.py
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import charts
+import charts_fast
+
+BACKENDS = (('matplotlib', charts), ('pillow', charts_fast))
+REPEATS = 5
+CATEGORY_NAMES = ['продукты', 'транспорт', 'кафе', 'развлечения', 'здоровье', 'одежда',
+                  'жилье', 'связь', 'образование', 'подарки', 'другое', 'спорт']
+
+
+def import_time(module_name):
+    """Время холодного импорта модуля в отдельном интерпретаторе, мс"""
+    code = f"import time; t = time.perf_counter(); import {module_name}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1]) * 1000
+
+
+def make_expenses(count):
+    return {CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + ('' if i < len(CATEGORY_NAMES) else str(i)): 1000 + 337 * i
+            for i in range(count)}
+
+
+def make_monthly(count):
+    data = {}
+    for i in range(count):
+        year, month = divmod(2026 * 12 + 9 - i, 12)
+        data[f"{month + 1:02d}.{year}"] = {'income': 40000 + 1500 * (i % 7), 'expenses': 25000 + 2100 * (i % 5)}
+    return data
+
+
+def bench(func, data):
+    """Лучшее время одного графика (мс) и размер PNG (КБ)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        size = len(func(data, None).getvalue())
+        best = min(timeit.Timer(lambda: func(data, None)).repeat(repeat=REPEATS, number=1))
+    return best * 1000, size / 1024
+
+
+def main():
+    print("Импорт модуля, мс")
+    for name, module in BACKENDS:
+        print(f"  {name:<12} {import_time(module.__name__):>8.1f}")
+
+    cases = [('круговая', 'create_expenses_chart', make_expenses(n), f"{n} кат.") for n in (3, 8, 20)]
+    cases += [('столбцы', 'create_monthly_stats_chart', make_monthly(n), f"{n} мес.") for n in (6, 12, 60)]
+
+    print()
+    print(f"{'график':<10} {'данные':>8} {'mpl, мс':>9} {'pil, мс':>9} {'ускорение':>10} {'mpl, КБ':>9} {'pil, КБ':>9}")
+    for chart_name, function_name, data, label in cases:
+        (slow_time, slow_size), (fast_time, fast_size) = [
+            bench(getattr(module, function_name), data) for _, module in BACKENDS
+        ]
+        print(f"{chart_name:<10} {label:>8} {slow_time:>9.1f} {fast_time:>9.1f} {slow_time / fast_time:>9.1f}x "
+              f"{slow_size:>9.1f} {fast_size:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
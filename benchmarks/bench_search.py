@@ -0,0 +1,100 @@
+# benchmarks/bench_search.py
+# Поиск по описаниям операций: индекс FTS5 (Database.search_operations)
+# против LIKE '%...%' на временной базе с большим числом операций.
+# Запуск из корня проекта: python benchmarks/bench_search.py [--operations 1000000]
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlite_database import Database
+
+USERS = 2000
+HEAVY_USER_SHARE = 0.1  # Доля операций пользователя 1 - у него долгая история
+QUERIES = ('пятерочка', 'такси', 'кофе', 'аптека ригла', 'бенз')
+DESCRIPTIONS = (
+    'Пятёрочка продукты', 'Яндекс Такси', 'кофе с собой', 'аптека Ригла', 'бензин Лукойл',
+    'Перекресток', 'обед в столовой', 'кино', 'подарок маме', 'спортзал', 'интернет', 'связь МТС',
+)
+REPEATS = 20
+
+
+def fill(db, count):
+    """Заполняет базу случайными операциями пользователей"""
+    random.seed(1)
+    now = int(time.time())
+    batch = []
+    with db.connection() as conn:
+        for i in range(count):
+            description = f"{random.choice(DESCRIPTIONS)} {random.randint(1, 999)}"
+            user_id = 1 if random.random() < HEAVY_USER_SHARE else random.randint(2, USERS)
+            batch.append((user_id, random.randint(50, 5000), description,
+                          'expense', 'другое', now - random.randint(0, 3 * 365 * 86400)))
+            if len(batch) == 50000:
+                conn.executemany('''
+                INSERT INTO operations (user_id, amount, description, type, category, ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', batch)
+                batch = []
+        if batch:
+            conn.executemany('''
+            INSERT INTO operations (user_id, amount, description, type, category, ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', batch)
+    # Запись в обход методов Database: поисковый индекс строим одним проходом
+    db.rebuild_search_index()
+
+
+def timed(func):
+    """Медиана и максимум времени вызова, мс"""
+    times = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return times[len(times) // 2], times[-1]
+
+
+def like_search(db, user_id, text):
+    with db.connection() as conn:
+        return conn.execute('''
+        SELECT * FROM operations
+        WHERE user_id = ? AND description LIKE ?
+        ORDER BY ts DESC, id DESC
+        LIMIT 11
+        ''', (user_id, f'%{text}%')).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--operations', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'))
+        started = time.perf_counter()
+        fill(db, args.operations)
+        print(f"Операций: {args.operations:,}, пользователей: {USERS}, "
+              f"заполнение {time.perf_counter() - started:.1f} с")
+
+        for user_id in (1, 2):
+            operations = db.get_user_statistics(user_id)['total_operations']
+            print(f"\nПользователь {user_id}, операций: {operations:,}")
+            print(f"{'запрос':<14} {'найдено':>8} {'fts, мс':>9} {'итоги, мс':>10} {'like, мс':>9}")
+            for text in QUERIES:
+                found = db.search_totals(user_id, text)['count']
+                page_time, _ = timed(lambda: db.search_operations(user_id, text))
+                totals_time, _ = timed(lambda: db.search_totals(user_id, text))
+                like_time, _ = timed(lambda: like_search(db, user_id, text.split()[0]))
+                print(f"{text:<14} {found:>8} {page_time:>9.2f} {totals_time:>10.2f} {like_time:>9.2f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# callback_router.py
+# Маршрутизация нажатий inline-кнопок по callback_data: точные ключи ищутся
+# в словаре, префиксы - в префиксном дереве (выбирается самый длинный префикс)
+import threading
+import time
+
+
+class CallbackPayloadError(ValueError):
+    """callback_data не соответствует формату маршрута (например, устаревшая кнопка)"""
+
+
+class CallbackRoute:
+    """Маршрут: обработчик и типы полей в данных после префикса
+
+    Поля разделяются "_", последнее поле получает остаток строки целиком,
+    поэтому в нем может быть и сам разделитель (например, название категории).
+    """
+
+    def __init__(self, name, handler, types=None):
+        self.name = name
+        self.handler = handler
+        self.types = types
+
+    def parse(self, payload):
+        """Разбирает данные после префикса в кортеж аргументов обработчика"""
+        if self.types is None:
+            return (payload,) if payload else ()
+        if not self.types:
+            return ()
+
+        parts = payload.split('_', len(self.types) - 1)
+        if len(parts) != len(self.types):
+            raise CallbackPayloadError(f"{self.name}: ожидалось полей {len(self.types)}, получено {len(parts)}")
+        try:
+            return tuple(field_type(part) for field_type, part in zip(self.types, parts))
+        except ValueError as e:
+            raise CallbackPayloadError(f"{self.name}: {e}")
+
+
+class _TrieNode:
+    __slots__ = ('children', 'route')
+
+    def __init__(self):
+        self.children = {}
+        self.route = None
+
+
+class CallbackRouter:
+    """Таблица обработчиков callback_data с замером времени по маршрутам
+
+    Обработчик точного ключа вызывается как handler(call), обработчик префикса -
+    handler(call, *поля), где поля приведены к типам, указанным при регистрации.
+    """
+
+    def __init__(self, slow_threshold=None):
+        self.slow_threshold = slow_threshold
+        self._exact = {}
+        self._root = _TrieNode()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def route(self, key):
+        """Декоратор: обработчик для callback_data, равной key"""
+        def decorator(handler):
+            if key in self._exact:
+                raise ValueError(f"Маршрут {key} уже зарегистрирован")
+            self._exact[key] = CallbackRoute(key, handler, types=())
+            return handler
+        return decorator
+
+    def prefix(self, prefix, *types):
+        """Декоратор: обработчик для callback_data, начинающейся с prefix
+
+        Без types обработчик получает остаток строки как есть.
+        """
+        def decorator(handler):
+            node = self._root
+            for char in prefix:
+                node = node.children.setdefault(char, _TrieNode())
+            if node.route is not None:
+                raise ValueError(f"Префикс {prefix} уже зарегистрирован")
+            node.route = CallbackRoute(f"{prefix}*", handler, types=types or None)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """Возвращает (маршрут, данные после префикса) или (None, None)"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, ''
+
+        node = self._root
+        found, found_length = None, 0
+        for length, char in enumerate(data, 1):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.route is not None:
+                found, found_length = node.route, length
+
+        if found is None:
+            return None, None
+        return found, data[found_length:]
+
+    def dispatch(self, call):
+        """Вызывает обработчик для call.data; False, если маршрут не найден
+
+        Ошибки разбора данных (CallbackPayloadError) и обработчика пробрасываются.
+        """
+        route, payload = self.resolve(call.data or '')
+        if route is None:
+            return False
+
+        args = route.parse(payload)
+        started = time.perf_counter()
+        failed = True
+        try:
+            route.handler(call, *args)
+            failed = False
+        finally:
+            self._record(route.name, time.perf_counter() - started, failed)
+        return True
+
+    def _record(self, name, elapsed, failed):
+        with self._stats_lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0}
+            stats['count'] += 1
+            stats['errors'] += failed
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            print(f"🐢 Медленная кнопка {name}: {elapsed:.2f} с")
+
+    def stats(self):
+        """Статистика по маршрутам, самые медленные (в среднем) первыми"""
+        with self._stats_lock:
+            rows = [
+                dict(route=name, average=stats['total'] / stats['count'], **stats)
+                for name, stats in self._stats.items()
+            ]
+        return sorted(rows, key=lambda row: row['average'], reverse=True)
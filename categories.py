@@ -1,4 +1,5 @@
 # categories.py
+from collections import deque
 
 # Словарь для автоматического определения категорий по ключевым словам
 CATEGORIES = {
@@ -12,13 +13,111 @@ CATEGORIES = {
     'другое': ['другое', 'прочее']
 }
 
+DEFAULT_CATEGORY = 'другое'  # Категория по умолчанию
+
+# С какого числа ключевых слов автомат быстрее поиска подстрок в цикле
+# (см. benchmarks/bench_categories.py)
+AUTOMATON_MIN_RULES = 150
+
+
+class CategoryMatcher:
+    """Подготовленный набор правил: сначала персональные категории, затем стандартные
+
+    Большие наборы ключевых слов компилируются в автомат Ахо-Корасик, и описание
+    просматривается за один проход независимо от числа слов; на маленьких наборах
+    быстрее обычный поиск подстрок. В обоих случаях побеждает правило, стоящее
+    раньше в списке (персональные категории в порядке добавления, затем CATEGORIES),
+    а не то, что раньше встречается в тексте.
+    """
+
+    def __init__(self, user_categories=None):
+        self.rules = []
+        for category, keywords in (user_categories or {}).items():
+            for keyword in keywords:
+                keyword = keyword.strip().lower()
+                # Пустое слово (например, из "а,,б") совпало бы с любым описанием
+                if keyword:
+                    self.rules.append((keyword, category))
+
+        for category, keywords in CATEGORIES.items():
+            for keyword in keywords:
+                self.rules.append((keyword, category))
+
+        self.use_automaton = len(self.rules) >= AUTOMATON_MIN_RULES
+        if self.use_automaton:
+            self._build_automaton()
+
+    def _build_automaton(self):
+        """Строит бор ключевых слов и суффиксные ссылки автомата"""
+        no_match = len(self.rules)
+        goto = [{}]
+        # best[state] - номер самого приоритетного правила, которое заканчивается
+        # в этом состоянии или в любом его суффиксе
+        best = [no_match]
+
+        for priority, (keyword, _) in enumerate(self.rules):
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    best.append(no_match)
+                state = next_state
+            best[state] = min(best[state], priority)
+
+        # Обход в ширину: суффиксная ссылка ребенка строится по ссылке родителя
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                link = fail[state]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                fail[next_state] = goto[link].get(char, 0)
+                best[next_state] = min(best[next_state], best[fail[next_state]])
+
+        self._goto = goto
+        self._fail = fail
+        self._best = best
+        self._no_match = no_match
+
+    def match(self, description):
+        """Возвращает категорию самого приоритетного подошедшего правила"""
+        if not self.use_automaton:
+            description_lower = description.lower()
+            for keyword, category in self.rules:
+                if keyword in description_lower:
+                    return category
+            return DEFAULT_CATEGORY
+
+        goto = self._goto
+        fail = self._fail
+        best = self._best
+        found = self._no_match
+        state = 0
+
+        for char in description.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            if best[state] < found:
+                found = best[state]
+                if found == 0:
+                    break  # Лучше первого правила ничего нет
+
+        if found == self._no_match:
+            return DEFAULT_CATEGORY
+        return self.rules[found][1]
+
+
+# Набор правил только со стандартными категориями
+_standard_matcher = CategoryMatcher()
+
 def detect_category(description):
     """Определяет категорию по описанию операции"""
-    description_lower = description.lower()
-    
-    for category, keywords in CATEGORIES.items():
-        for keyword in keywords:
-            if keyword in description_lower:
-                return category
-    
-    return 'другое'  # Категория по умолчанию
\ No newline at end of file
+    return _standard_matcher.match(description)
\ No newline at end of file
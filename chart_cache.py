@@ -0,0 +1,149 @@
+# chart_cache.py
+# Кеш готовых графиков по хешу входных данных (см. chart_service.chart_key):
+# PNG в памяти с вытеснением на диск и file_id, которые вернул Telegram
+import os
+import threading
+from collections import OrderedDict
+
+CHART_CACHE_MAX_BYTES = int(os.getenv('CHART_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+CHART_CACHE_DIR = os.getenv('CHART_CACHE_DIR')  # Не задан - кеш только в памяти
+CHART_CACHE_DISK_MAX_BYTES = int(os.getenv('CHART_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024)))
+CHART_CACHE_MAX_FILE_IDS = int(os.getenv('CHART_CACHE_MAX_FILE_IDS', '10000'))
+
+
+class ChartCache:
+    """LRU-кеш PNG ограниченного размера с необязательным хранением на диске
+
+    Вытесненные из памяти графики сохраняются в disk_dir и поднимаются обратно
+    при следующем обращении. Отдельно хранится file_id загруженного в Telegram
+    фото, чтобы повторно отправлять график без рендеринга и без загрузки.
+    """
+
+    def __init__(self, max_bytes=CHART_CACHE_MAX_BYTES, disk_dir=CHART_CACHE_DIR,
+                 disk_max_bytes=CHART_CACHE_DISK_MAX_BYTES, max_file_ids=CHART_CACHE_MAX_FILE_IDS):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.max_file_ids = max_file_ids
+        self._images = OrderedDict()
+        self._images_size = 0
+        self._file_ids = OrderedDict()
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            # Старые файлы с прошлого запуска: самые давние вытесняются первыми
+            files = []
+            for name in os.listdir(disk_dir):
+                if name.endswith('.png'):
+                    stat = os.stat(os.path.join(disk_dir, name))
+                    files.append((stat.st_mtime, name[:-4], stat.st_size))
+            for _, key, size in sorted(files):
+                self._disk[key] = size
+                self._disk_size += size
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def get_image(self, key):
+        """Возвращает PNG по ключу или None"""
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                return image
+            on_disk = key in self._disk
+
+        if not on_disk:
+            return None
+
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                image = f.read()
+        except OSError:
+            with self._lock:
+                self._disk_size -= self._disk.pop(key, 0)
+            return None
+
+        self.put_image(key, image)
+        return image
+
+    def put_image(self, key, image):
+        """Сохраняет PNG в памяти, вытесняя давно не использованные графики"""
+        if len(image) > self.max_bytes:
+            self._spill([(key, image)])
+            return
+
+        with self._lock:
+            previous = self._images.pop(key, None)
+            if previous is not None:
+                self._images_size -= len(previous)
+            self._images[key] = image
+            self._images_size += len(image)
+
+            evicted = []
+            while self._images_size > self.max_bytes:
+                old_key, old_image = self._images.popitem(last=False)
+                self._images_size -= len(old_image)
+                evicted.append((old_key, old_image))
+
+        self._spill(evicted)
+
+    def _spill(self, items):
+        """Переносит вытесненные графики на диск, если он включен"""
+        if not self.disk_dir:
+            return
+
+        for key, image in items:
+            with self._lock:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                    continue
+            try:
+                with open(self._disk_path(key), 'wb') as f:
+                    f.write(image)
+            except OSError as e:
+                print(f"Не удалось сохранить график на диск: {e}")
+                continue
+
+            with self._lock:
+                self._disk[key] = len(image)
+                self._disk_size += len(image)
+                removed = []
+                while self._disk_size > self.disk_max_bytes and self._disk:
+                    old_key, old_size = self._disk.popitem(last=False)
+                    self._disk_size -= old_size
+                    removed.append(old_key)
+
+            for old_key in removed:
+                try:
+                    os.remove(self._disk_path(old_key))
+                except OSError:
+                    pass
+
+    def get_file_id(self, key):
+        """Возвращает file_id ранее отправленного графика"""
+        with self._lock:
+            file_id = self._file_ids.get(key)
+            if file_id is not None:
+                self._file_ids.move_to_end(key)
+            return file_id
+
+    def set_file_id(self, key, file_id):
+        """Запоминает file_id, который Telegram вернул после send_photo"""
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._file_ids.move_to_end(key)
+            while len(self._file_ids) > self.max_file_ids:
+                self._file_ids.popitem(last=False)
+
+    def forget_file_id(self, key):
+        """Удаляет file_id, который Telegram больше не принимает"""
+        with self._lock:
+            self._file_ids.pop(key, None)
+
+
+# Глобальный кеш графиков бота
+chart_cache = ChartCache()
@@ -0,0 +1,278 @@
+# chart_service.py
+# Рендеринг графиков в отдельных процессах, чтобы matplotlib не занимал
+# потоки бота и GIL, пока рисуется диаграмма
+import concurrent.futures
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+
+from chart_cache import chart_cache
+
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+CHART_QUEUE_LIMIT = int(os.getenv('CHART_QUEUE_LIMIT', '16'))  # Максимум задач в работе и в очереди
+CHART_TIMEOUT = float(os.getenv('CHART_TIMEOUT', '20'))  # Секунд на одну задачу
+CHART_DELIVERY_THREADS = int(os.getenv('CHART_DELIVERY_THREADS', '4'))
+CHART_WARMUP = os.getenv('CHART_WARMUP', '0') == '1'  # Запускать пул графиков сразу при старте бота
+
+# Модуль отрисовки: matplotlib (charts.py) или быстрый Pillow (charts_fast.py)
+CHART_BACKENDS = {
+    'matplotlib': 'charts',
+    'pillow': 'charts_fast',
+}
+CHART_BACKEND = os.getenv('CHART_BACKEND', 'matplotlib')
+if CHART_BACKEND not in CHART_BACKENDS:
+    raise ValueError(f"Неизвестный CHART_BACKEND: {CHART_BACKEND}")
+
+# Тип графика -> функция модуля отрисовки
+CHART_RENDERERS = {
+    'expenses': 'create_expenses_chart',
+    'monthly': 'create_monthly_stats_chart',
+    'comparison': 'create_comparison_chart',
+}
+
+
+class ChartServiceError(Exception):
+    """Базовая ошибка сервиса графиков"""
+
+
+class ChartQueueFullError(ChartServiceError):
+    """Очередь рендеринга переполнена"""
+
+
+class ChartTimeoutError(ChartServiceError):
+    """График не успел отрисоваться за отведенное время"""
+
+
+def chart_key(kind, data):
+    """Ключ графика: хеш типа, модуля отрисовки и входных данных (порядок элементов важен)"""
+    payload = json.dumps([CHART_BACKEND, kind, list(data.items())], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Сработал ли таймер текущей задачи в процессе пула
+_timed_out = False
+
+
+def _raise_timeout(signum, frame):
+    global _timed_out
+    _timed_out = True
+    raise ChartTimeoutError("Превышено время отрисовки графика")
+
+
+def _render_chart(kind, data, timeout):
+    """Рисует график в процессе пула и возвращает PNG в байтах"""
+    global _timed_out
+    charts = importlib.import_module(CHART_BACKENDS[CHART_BACKEND])
+
+    # Ограничиваем время внутри процесса, чтобы зависшая задача освободила воркер
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    if use_alarm:
+        _timed_out = False
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        buffer = getattr(charts, CHART_RENDERERS[kind])(data, None)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    # Функции отрисовки ловят все исключения и возвращают None - в том числе
+    # ChartTimeoutError из обработчика сигнала, поэтому проверяем таймер сами
+    if use_alarm and _timed_out:
+        raise ChartTimeoutError("Превышено время отрисовки графика")
+    return buffer.getvalue() if buffer else None
+
+
+def _warm_up_worker():
+    """Загружает модуль отрисовки в процессе пула заранее"""
+    importlib.import_module(CHART_BACKENDS[CHART_BACKEND])
+    return os.getpid()
+
+
+class ChartService:
+    """Очередь рендеринга графиков поверх ограниченного пула процессов
+
+    Одинаковые запросы, пришедшие пока график рисуется, получают один и тот же
+    результат. Обработчики результата выполняются в отдельном пуле потоков,
+    чтобы отправка фото не задерживала выдачу других готовых графиков.
+    Если передан cache, уже отрисованные графики берутся из него без рендеринга.
+    """
+
+    def __init__(self, workers=CHART_WORKERS, queue_limit=CHART_QUEUE_LIMIT, timeout=CHART_TIMEOUT, cache=None):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.cache = cache
+        self._executor = None
+        self._delivery = concurrent.futures.ThreadPoolExecutor(
+            max_workers=CHART_DELIVERY_THREADS, thread_name_prefix='chart-delivery'
+        )
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Создает пул процессов при первом графике"""
+        if self._executor is None:
+            # forkserver не копирует потоки и блокировки работающего бота
+            methods = multiprocessing.get_all_start_methods()
+            method = 'forkserver' if 'forkserver' in methods else 'spawn'
+            context = multiprocessing.get_context(method)
+            if method == 'forkserver':
+                # Сервер процессов заранее загружает модуль отрисовки, и каждый новый
+                # воркер получает уже импортированный matplotlib/Pillow.
+                # Главный скрипт воркер все равно выполняет как __mp_main__ (так
+                # устроен multiprocessing), поэтому импорт telegram_bot ничего не запускает
+                context.set_forkserver_preload([__name__, CHART_BACKENDS[CHART_BACKEND]])
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context
+            )
+        return self._executor
+
+    def submit(self, kind, data):
+        """Ставит график в очередь и возвращает Future с PNG в байтах (или None)"""
+        if kind not in CHART_RENDERERS:
+            raise ValueError(f"Неизвестный тип графика: {kind}")
+
+        key = chart_key(kind, data)
+
+        if self.cache is not None:
+            image = self.cache.get_image(key)
+            if image is not None:
+                future = concurrent.futures.Future()
+                future.set_result(image)
+                return future
+
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+
+            if len(self._pending) >= self.queue_limit:
+                raise ChartQueueFullError("Слишком много графиков в очереди")
+
+            future = concurrent.futures.Future()
+            try:
+                job = self._get_executor().submit(_render_chart, kind, data, self.timeout)
+            except BrokenProcessPool:
+                # Процесс пула упал - создаем пул заново
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                job = self._get_executor().submit(_render_chart, kind, data, self.timeout)
+            self._pending[key] = future
+
+        # Запасной таймаут на случай, если процесс не ответил даже по сигналу
+        timer = threading.Timer(self.timeout + 5, self._expire, args=(key, future))
+        timer.daemon = True
+        timer.start()
+
+        def on_job_done(job):
+            timer.cancel()
+            self._forget(key, future)
+            try:
+                image = job.result()
+                if image and self.cache is not None:
+                    self.cache.put_image(key, image)
+                self._set_result(future, image)
+            except BrokenProcessPool as e:
+                self._reset_executor()
+                self._set_exception(future, e)
+            except Exception as e:
+                self._set_exception(future, e)
+
+        job.add_done_callback(on_job_done)
+        return future
+
+    def warm_up(self):
+        """Запускает процессы пула и загружает модуль отрисовки в фоновом потоке"""
+        def run():
+            started = time.perf_counter()
+            try:
+                with self._lock:
+                    executor = self._get_executor()
+                jobs = [executor.submit(_warm_up_worker) for _ in range(self.workers)]
+                concurrent.futures.wait(jobs, timeout=self.timeout)
+                errors = {str(job.exception()) for job in jobs if job.done() and job.exception()}
+                if errors:
+                    print(f"⚠️ Не удалось прогреть графики: {'; '.join(errors)}")
+                    return
+                pids = {job.result() for job in jobs if job.done()}
+                print(f"✅ Графики прогреты за {time.perf_counter() - started:.2f} с (процессов: {len(pids)})")
+            except Exception as e:
+                print(f"⚠️ Не удалось прогреть графики: {e}")
+
+        thread = threading.Thread(target=run, name='chart-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def render(self, kind, data, on_done):
+        """Ставит график в очередь; on_done(png_bytes, error) вызывается по готовности"""
+        future = self.submit(kind, data)
+
+        def deliver(done_future):
+            try:
+                on_done(done_future.result(), None)
+            except Exception as e:
+                on_done(None, e)
+
+        def schedule(done_future):
+            try:
+                self._delivery.submit(self._run_callback, deliver, done_future)
+            except RuntimeError:
+                print("⚠️ График готов после остановки сервиса, не отправлен")
+
+        future.add_done_callback(schedule)
+        return future
+
+    def _run_callback(self, callback, future):
+        try:
+            callback(future)
+        except Exception as e:
+            print(f"❌ Ошибка в обработчике готового графика: {e}")
+            traceback.print_exc()
+
+    def _reset_executor(self):
+        """Отбрасывает сломанный пул, следующий график создаст новый"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _expire(self, key, future):
+        self._forget(key, future)
+        self._set_exception(future, ChartTimeoutError("Превышено время отрисовки графика"))
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    @staticmethod
+    def _set_result(future, result):
+        try:
+            future.set_result(result)
+        except concurrent.futures.InvalidStateError:
+            pass  # Уже завершен по таймауту
+
+    @staticmethod
+    def _set_exception(future, error):
+        try:
+            future.set_exception(error)
+        except concurrent.futures.InvalidStateError:
+            pass
+
+    def shutdown(self):
+        """Останавливает пул процессов и потоки доставки"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._delivery.shutdown(wait=False)
+
+
+# Глобальный сервис графиков бота
+chart_service = ChartService(cache=chart_cache)
@@ -0,0 +1,315 @@
+# charts_fast.py
+# Быстрая отрисовка тех же графиков, что и в charts.py, напрямую на растре Pillow:
+# без импорта matplotlib, подбора bbox_inches='tight' и tight_layout()
+import io
+import math
+import os
+import importlib.util
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Круг диаграммы рисуем в увеличенном масштабе и уменьшаем - так сглаживаются края
+# секторов. Текст Pillow сглаживает сам, а столбцы не нуждаются в сглаживании.
+SUPERSAMPLE = 2
+
+# Палитра Set3 из matplotlib, чтобы диаграммы выглядели как раньше
+SET3_COLORS = [
+    (141, 211, 199), (255, 255, 179), (190, 186, 218), (251, 128, 114),
+    (128, 177, 211), (253, 180, 98), (179, 222, 105), (252, 205, 229),
+    (217, 217, 217), (188, 128, 189), (204, 235, 197), (255, 237, 111),
+]
+INCOME_COLOR = (77, 166, 77)    # green с alpha=0.7 на белом
+EXPENSE_COLOR = (255, 77, 77)   # red с alpha=0.7 на белом
+PREVIOUS_COLOR = (179, 179, 179)  # gray с alpha=0.7 на белом - период для сравнения
+TEXT_COLOR = (0, 0, 0)
+GRID_COLOR = (230, 230, 230)
+AXIS_COLOR = (0, 0, 0)
+# На графиках мало цветов: PNG с палитрой кодируется быстрее и весит в разы меньше RGB
+PNG_COLORS = 256
+
+FONT_FILES = {False: 'DejaVuSans.ttf', True: 'DejaVuSans-Bold.ttf'}
+
+_fonts = {}
+
+
+def _font_dir():
+    """Каталог со шрифтами DejaVu (кириллица): CHART_FONT_DIR или шрифты matplotlib"""
+    font_dir = os.getenv('CHART_FONT_DIR')
+    if font_dir:
+        return font_dir
+    # Берем путь к пакету без его импорта
+    spec = importlib.util.find_spec('matplotlib')
+    if spec and spec.origin:
+        return os.path.join(os.path.dirname(spec.origin), 'mpl-data', 'fonts', 'ttf')
+    return None
+
+
+def _font(size, bold=False):
+    """Шрифт нужного размера, загруженный один раз"""
+    key = (size, bold)
+    font = _fonts.get(key)
+    if font is None:
+        name = FONT_FILES[bold]
+        font_dir = _font_dir()
+        # Сначала каталог DejaVu, затем системные каталоги шрифтов.
+        # Встроенный шрифт Pillow не подходит: в нем нет кириллицы.
+        paths = [os.path.join(font_dir, name), name] if font_dir else [name]
+        for path in paths:
+            try:
+                font = ImageFont.truetype(path, size)
+                break
+            except OSError:
+                continue
+        else:
+            # ImportError: без шрифтов модуль отрисовки не загружается, а свой класс
+            # исключения из незагруженного модуля нельзя передать из процесса пула
+            raise ImportError(
+                f"Не найден шрифт {name}: установите matplotlib (в нем есть DejaVu) "
+                f"или укажите каталог со шрифтами в CHART_FONT_DIR"
+            )
+        _fonts[key] = font
+    return font
+
+
+def _save_image(image):
+    """Сохраняет изображение в PNG-буфер"""
+    buffer = io.BytesIO()
+    image = image.quantize(PNG_COLORS, method=Image.Quantize.FASTOCTREE)
+    image.save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def _format_number(value):
+    return f"{value:,.0f}".replace(',', ' ') if value == int(value) else f"{value:,.1f}".replace(',', ' ')
+
+
+def _nice_ticks(max_value, count=5):
+    """Круглые значения делений оси от 0 до max_value"""
+    if max_value <= 0:
+        return [0, 1]
+    raw_step = max_value / count
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    for multiplier in (1, 2, 2.5, 5, 10):
+        step = multiplier * magnitude
+        if step >= raw_step:
+            break
+    ticks = [0]
+    while ticks[-1] < max_value:
+        ticks.append(ticks[-1] + step)
+    return ticks
+
+
+def _draw_rotated_text(image, xy, text, font, angle, anchor_right=True):
+    """Рисует повернутый текст: правый (или нижний) край подписи в точке xy"""
+    left, top, right, bottom = font.getbbox(text)
+    label = Image.new('L', (right - left + 2, bottom - top + 2), 0)
+    ImageDraw.Draw(label).text((-left + 1, -top + 1), text, font=font, fill=255)
+    label = label.rotate(angle, expand=True, resample=Image.BICUBIC)
+    x, y = xy
+    if anchor_right:
+        position = (int(x - label.width), int(y))
+    else:
+        position = (int(x - label.width / 2), int(y - label.height / 2))
+    image.paste(TEXT_COLOR, position, label)
+
+
+def create_expenses_chart(expenses_by_category, user_id):
+    """Создает круговую диаграмму расходов по категориям"""
+    try:
+        if not expenses_by_category:
+            print("❌ Нет данных для диаграммы")
+            return None
+
+        print(f"📊 Создаем диаграмму для {len(expenses_by_category)} категорий")
+
+        categories = list(expenses_by_category.keys())
+        amounts = list(expenses_by_category.values())
+        total = float(sum(amounts))
+        if total <= 0:
+            print("❌ Нет положительных сумм для диаграммы")
+            return None
+
+        width, height = 900, 680
+        image = Image.new('RGB', (width, height), 'white')
+        draw = ImageDraw.Draw(image)
+
+        title_font = _font(16, bold=True)
+        label_font = _font(12)
+        percent_font = _font(11, bold=True)
+
+        draw.text((width / 2, 30), 'Расходы по категориям', font=title_font, fill=TEXT_COLOR, anchor='mt')
+
+        radius = 260
+        cx, cy = width / 2, height / 2 + 20
+
+        # Как в matplotlib (startangle=90): от 12 часов против часовой стрелки.
+        # Углы Pillow отсчитываются от 3 часов по часовой стрелке.
+        wedges = []
+        start = 0.0
+        for amount in amounts:
+            sweep = 360.0 * amount / total
+            wedges.append((start, max(sweep, 0.0)))
+            start += max(sweep, 0.0)
+
+        size = 2 * radius * SUPERSAMPLE
+        disk = Image.new('RGB', (size, size), 'white')
+        disk_draw = ImageDraw.Draw(disk)
+        for i, (start, sweep) in enumerate(wedges):
+            color = SET3_COLORS[i % len(SET3_COLORS)]
+            if sweep >= 360.0:
+                disk_draw.ellipse([0, 0, size - 1, size - 1], fill=color)
+            elif sweep > 0:
+                disk_draw.pieslice([0, 0, size - 1, size - 1], -90 - start - sweep, -90 - start, fill=color)
+        image.paste(disk.reduce(SUPERSAMPLE), (int(cx - radius), int(cy - radius)))
+
+        # Подписи поверх круга: проценты внутри секторов, категории снаружи
+        for category, amount, (start, sweep) in zip(categories, amounts, wedges):
+            if sweep <= 0:
+                continue
+            middle = math.radians(90 + start + sweep / 2)
+            dx, dy = math.cos(middle), -math.sin(middle)
+
+            percent = f"{100.0 * amount / total:.1f}%"
+            draw.text((cx + dx * radius * 0.6, cy + dy * radius * 0.6), percent,
+                      font=percent_font, fill='white', anchor='mm',
+                      stroke_width=1, stroke_fill=(90, 90, 90))
+
+            label_anchor = 'lm' if dx >= 0 else 'rm'
+            draw.text((cx + dx * radius * 1.1, cy + dy * radius * 1.1), str(category),
+                      font=label_font, fill=TEXT_COLOR, anchor=label_anchor)
+
+        buffer = _save_image(image)
+
+        print("✅ Диаграмма создана успешно")
+        return buffer
+
+    except Exception as e:
+        print(f"❌ Ошибка в create_expenses_chart: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def _grouped_bar_chart(title, x_label, labels, series):
+    """Рисует столбцы нескольких серий по группам; series - [(название, цвет, значения)]"""
+    width, height = 1200, 600
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+
+    title_font = _font(14, bold=True)
+    axis_font = _font(11)
+    tick_font = _font(10)
+
+    ticks = _nice_ticks(max([value for _, _, values in series for value in values] + [0]))
+    tick_labels = [_format_number(tick) for tick in ticks]
+    tick_width = max(draw.textlength(label, font=tick_font) for label in tick_labels)
+
+    # Область построения
+    left = int(50 + tick_width)
+    right = width - 20
+    top = 50
+    bottom = height - 110
+    scale = (bottom - top) / ticks[-1]
+
+    draw.text(((left + right) / 2, 20), title, font=title_font, fill=TEXT_COLOR, anchor='mt')
+
+    # Сетка и подписи оси Y
+    for tick, label in zip(ticks, tick_labels):
+        y = bottom - tick * scale
+        draw.line([(left, y), (right, y)], fill=GRID_COLOR, width=1)
+        draw.text((left - 6, y), label, font=tick_font, fill=TEXT_COLOR, anchor='rm')
+
+    # Столбцы: ширина группы - 70% шага, как bar_width=0.35 на две серии
+    step = (right - left) / len(labels)
+    bar_width = step * 0.7 / len(series)
+    for i, label in enumerate(labels):
+        center = left + step * (i + 0.5)
+        x = center - bar_width * len(series) / 2
+        for _, color, values in series:
+            if values[i] > 0:
+                draw.rectangle([x, bottom - values[i] * scale, x + bar_width, bottom], fill=color)
+            x += bar_width
+        draw.line([(center, bottom), (center, bottom + 4)], fill=AXIS_COLOR, width=1)
+        _draw_rotated_text(image, (center + 4, bottom + 8), str(label), tick_font, 45)
+
+    draw.rectangle([left, top, right, bottom], outline=AXIS_COLOR, width=1)
+
+    # Подписи осей
+    draw.text(((left + right) / 2, height - 12), x_label, font=axis_font, fill=TEXT_COLOR, anchor='md')
+    _draw_rotated_text(image, (16, (top + bottom) / 2), 'Сумма (руб)', axis_font, 90, anchor_right=False)
+
+    # Легенда по ширине самой длинной подписи
+    legend_width = 60 + max(draw.textlength(name, font=axis_font) for name, _, _ in series)
+    legend_x, legend_y = right - 10 - legend_width, top + 10
+    draw.rectangle([legend_x, legend_y, right - 10, legend_y + 8 + 22 * len(series)],
+                   fill='white', outline=GRID_COLOR, width=1)
+    for row, (name, color, _) in enumerate(series):
+        y = legend_y + 16 + row * 22
+        draw.rectangle([legend_x + 10, y - 6, legend_x + 34, y + 6], fill=color)
+        draw.text((legend_x + 42, y), name, font=axis_font, fill=TEXT_COLOR, anchor='lm')
+
+    return _save_image(image)
+
+
+def create_monthly_stats_chart(monthly_data, user_id):
+    """Создает график доходов/расходов по месяцам"""
+    try:
+        if not monthly_data:
+            print("❌ Нет данных для графика истории")
+            return None
+
+        print(f"📈 Создаем график истории для {len(monthly_data)} месяцев")
+
+        months = list(monthly_data.keys())[::-1]  # Переворачиваем чтобы шло от старых к новым
+        incomes = [monthly_data[month]['income'] for month in months]
+        expenses = [monthly_data[month]['expenses'] for month in months]
+
+        buffer = _grouped_bar_chart(
+            'Динамика доходов и расходов по месяцам', 'Месяцы', months,
+            [('Доходы', INCOME_COLOR, incomes), ('Расходы', EXPENSE_COLOR, expenses)]
+        )
+
+        print("✅ График истории создан успешно")
+        return buffer
+
+    except Exception as e:
+        print(f"❌ Ошибка в create_monthly_stats_chart: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def create_comparison_chart(comparison_data, user_id):
+    """Создает график расходов по категориям за два периода"""
+    try:
+        if not comparison_data['categories']:
+            print("❌ Нет данных для графика сравнения")
+            return None
+
+        print(f"📊 Создаем график сравнения для {len(comparison_data['categories'])} категорий")
+
+        current_label, previous_label = comparison_data['periods']
+        categories = [category for category, _, _ in comparison_data['categories']]
+        current = [amount for _, amount, _ in comparison_data['categories']]
+        previous = [amount for _, _, amount in comparison_data['categories']]
+
+        buffer = _grouped_bar_chart(
+            'Расходы по категориям: сравнение периодов', 'Категории', categories,
+            [(previous_label, PREVIOUS_COLOR, previous), (current_label, EXPENSE_COLOR, current)]
+        )
+
+        print("✅ График сравнения создан успешно")
+        return buffer
+
+    except Exception as e:
+        print(f"❌ Ошибка в create_comparison_chart: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+# Шрифты проверяем при импорте, а не на первом графике: ошибка видна сразу
+# при прогреве пула, а не как молча не созданная диаграмма
+for _bold in FONT_FILES:
+    _font(12, _bold)
@@ -0,0 +1,212 @@
+# csv_import.py
+# Потоковый разбор CSV-файлов для /import: файл читается построчно прямо из
+# ответа Telegram, каждая строка превращается в операцию (сумма, описание, тип, ts).
+# Столбцы находятся по заголовку или указываются в параметрах команды.
+import calendar
+import codecs
+import csv
+import io
+import shlex
+import time
+from datetime import datetime
+
+IMPORT_MAX_ERROR_SAMPLES = 10  # Сколько ошибочных строк запоминать для ответа
+DATE_CACHE_SIZE = 4096  # Сколько разобранных дат помнить при импорте
+ENCODING_PROBE_SIZE = 64 * 1024  # По скольким первым байтам определять кодировку
+
+# Названия столбцов, которые узнаем без параметров (в нижнем регистре)
+COLUMN_ALIASES = {
+    'date': ('date', 'дата', 'дата операции', 'дата платежа', 'время операции'),
+    'amount': ('amount', 'сумма', 'сумма операции', 'сумма платежа'),
+    'description': ('description', 'описание', 'комментарий', 'назначение', 'назначение платежа'),
+    'type': ('type', 'тип', 'тип операции'),
+}
+INCOME_TYPES = {'income', 'доход', '+', 'пополнение', 'зачисление', 'поступление'}
+DATE_FORMATS = (
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+    '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y', '%d.%m.%y', '%d/%m/%Y',
+)
+DELIMITERS = (';', ',', '\t')
+OPTION_KEYS = ('date', 'amount', 'description', 'type', 'delimiter', 'encoding', 'positive')
+
+
+class CsvImportError(ValueError):
+    """Файл или параметры импорта не подходят (сообщение показывается пользователю)"""
+
+
+def parse_options(text):
+    """Разбирает параметры /import вида: amount="Сумма операции" delimiter=; positive=income"""
+    try:
+        tokens = shlex.split(text or '')
+    except ValueError as e:
+        raise CsvImportError(f"Не удалось разобрать параметры: {e}")
+
+    options = {}
+    for token in tokens:
+        key, separator, value = token.partition('=')
+        if not separator or key not in OPTION_KEYS or not value:
+            raise CsvImportError(f"Неизвестный параметр: {token}")
+        options[key] = value
+
+    if options.get('delimiter') == 'tab':
+        options['delimiter'] = '\t'
+    if len(options.get('delimiter', ',')) != 1:
+        raise CsvImportError("Разделитель должен быть одним символом (или tab)")
+    if options.get('positive', 'expense') not in ('income', 'expense'):
+        raise CsvImportError("positive может быть income или expense")
+    if 'encoding' in options:
+        try:
+            codecs.lookup(options['encoding'])
+        except LookupError:
+            raise CsvImportError(f"Неизвестная кодировка: {options['encoding']}")
+    return options
+
+
+def open_text(binary_stream, encoding=None):
+    """Оборачивает бинарный поток в текстовый; кодировка - UTF-8 или, если не подходит, cp1251"""
+    buffered = io.BufferedReader(binary_stream, ENCODING_PROBE_SIZE)
+    if encoding is None:
+        probe = buffered.peek(ENCODING_PROBE_SIZE)
+        try:
+            # final=False: последний символ в пробе может быть обрезан
+            codecs.getincrementaldecoder('utf-8')().decode(probe, final=False)
+            encoding = 'utf-8-sig'
+        except UnicodeDecodeError:
+            # Выгрузки российских банков и Excel часто в Windows-1251
+            encoding = 'cp1251'
+    return io.TextIOWrapper(buffered, encoding=encoding, newline='')
+
+
+def parse_amount(text):
+    """'1 234,50' -> 1234.5; знак сохраняется"""
+    value = text.strip().replace('\xa0', '').replace(' ', '').replace(',', '.')
+    if not value:
+        raise ValueError("пустая сумма")
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"не удалось распознать сумму «{text.strip()}»")
+
+
+class CsvImporter:
+    """Превращает строки CSV в операции и считает ошибочные строки
+
+    read(stream) - генератор (amount, description, operation_type, ts). Строки с ошибками
+    пропускаются: их число в errors, первые из них - в error_samples (номер строки, причина).
+    Даты без часового пояса в файле считаются временем tz (по умолчанию UTC).
+    """
+
+    def __init__(self, options=None, clock=time.time, tz=None):
+        self.options = options or {}
+        self.clock = clock
+        self.tz = tz
+        self.rows = 0
+        self.errors = 0
+        self.error_samples = []
+        self._date_format = None
+        self._dates = {}  # Текст даты -> epoch: в выписках много строк за один день
+
+    def read(self, stream):
+        header_line = stream.readline()
+        if not header_line.strip():
+            raise CsvImportError("Файл пустой")
+        delimiter = self.options.get('delimiter') or self._detect_delimiter(header_line)
+        header = next(csv.reader([header_line], delimiter=delimiter))
+        columns = self._resolve_columns(header)
+
+        amount_column = columns['amount']
+        date_column = columns.get('date')
+        description_column = columns.get('description')
+        type_column = columns.get('type')
+        positive_income = self.options.get('positive') == 'income'
+        now = int(self.clock())
+
+        for line_number, row in enumerate(csv.reader(stream, delimiter=delimiter), 2):
+            if not any(field.strip() for field in row):
+                continue
+            self.rows += 1
+            try:
+                raw_amount = row[amount_column]
+                value = parse_amount(raw_amount)
+                if type_column is not None and row[type_column].strip():
+                    is_income = row[type_column].strip().lower() in INCOME_TYPES
+                else:
+                    is_income = raw_amount.strip().startswith('+') or (positive_income and value > 0)
+                amount = int(round(abs(value)))
+                if amount == 0:
+                    raise ValueError("нулевая сумма")
+
+                description = row[description_column].strip() if description_column is not None else ''
+                ts = self._parse_date(row[date_column]) if date_column is not None else now
+            except (ValueError, IndexError, OverflowError) as e:
+                self._error(line_number, e)
+                continue
+
+            yield amount, description or "без категории", 'income' if is_income else 'expense', ts
+
+    def _detect_delimiter(self, header_line):
+        """Разделитель, который чаще всего встречается в заголовке"""
+        counts = [(header_line.count(delimiter), delimiter) for delimiter in DELIMITERS]
+        count, delimiter = max(counts)
+        return delimiter if count else ','
+
+    def _resolve_columns(self, header):
+        """Номера нужных столбцов: из параметров (название или номер с 1) или по известным названиям"""
+        names = [name.strip().lstrip('\ufeff').lower() for name in header]
+        columns = {}
+        for key, aliases in COLUMN_ALIASES.items():
+            requested = self.options.get(key)
+            if requested is not None:
+                if requested.isdigit() and 1 <= int(requested) <= len(names):
+                    columns[key] = int(requested) - 1
+                elif requested.lower() in names:
+                    columns[key] = names.index(requested.lower())
+                else:
+                    raise CsvImportError(f"В файле нет столбца «{requested}»")
+                continue
+            for alias in aliases:
+                if alias in names:
+                    columns[key] = names.index(alias)
+                    break
+
+        if 'amount' not in columns:
+            raise CsvImportError(
+                "Не найден столбец с суммой. Укажите его в подписи: /import amount=\"Название столбца\""
+            )
+        return columns
+
+    def _parse_date(self, text):
+        """Дата строки в epoch UTC; формат запоминается по первой удачной строке"""
+        text = text.strip()
+        ts = self._dates.get(text)
+        if ts is None:
+            ts = self._parse_new_date(text)
+            if len(self._dates) >= DATE_CACHE_SIZE:
+                self._dates.clear()
+            self._dates[text] = ts
+        return ts
+
+    def _parse_new_date(self, text):
+        if self._date_format is not None:
+            try:
+                return self._timestamp(datetime.strptime(text, self._date_format))
+            except ValueError:
+                pass
+        for date_format in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+            self._date_format = date_format
+            return self._timestamp(parsed)
+        raise ValueError(f"не удалось распознать дату «{text}»")
+
+    def _timestamp(self, parsed):
+        if self.tz is None:
+            return calendar.timegm(parsed.timetuple())
+        return int(parsed.replace(tzinfo=self.tz).timestamp())
+
+    def _error(self, line_number, error):
+        self.errors += 1
+        if len(self.error_samples) < IMPORT_MAX_ERROR_SAMPLES:
+            self.error_samples.append((line_number, str(error)))
@@ -0,0 +1,191 @@
+# dispatcher.py
+# Распределение входящих обновлений Telegram по потокам: обновления одного
+# пользователя обрабатываются строго по очереди, разных пользователей - параллельно.
+# Медленные запросы (графики, экспорт) идут в отдельную полосу со своими потоками,
+# чтобы быстрые текстовые ответы других пользователей не ждали их в очереди.
+import concurrent.futures
+import os
+import threading
+import time
+import traceback
+from collections import deque
+
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '8'))
+DISPATCH_SLOW_WORKERS = int(os.getenv('DISPATCH_SLOW_WORKERS', '2'))
+DISPATCH_BATCH = 16           # Сколько обновлений пользователя обработать подряд, прежде чем уступить поток
+DISPATCH_WAIT_SAMPLES = 1000  # По скольким последним обновлениям считать время ожидания
+
+FAST_LANE = 'fast'
+SLOW_LANE = 'slow'
+
+# Поля Update, в которых может прийти пользователь
+UPDATE_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+    'chat_join_request', 'channel_post', 'edited_channel_post',
+)
+
+
+def update_user_id(update):
+    """user_id автора обновления (или id чата, если автора нет)"""
+    for field in UPDATE_FIELDS:
+        event = getattr(update, field, None)
+        if event is None:
+            continue
+        user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(event, 'chat', None)
+        if chat is not None:
+            return chat.id
+    return None
+
+
+class KeyedLane:
+    """Пул потоков, в котором задачи с одинаковым ключом выполняются по порядку
+
+    У каждого ключа своя очередь. Пока в ней есть задачи, ее обрабатывает ровно
+    один поток пула; после DISPATCH_BATCH задач поток уступает место другим ключам.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f'dispatch-{name}'
+        )
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._max_pending = 0
+        self._processed = 0
+        self._errors = 0
+        self._waits = deque(maxlen=DISPATCH_WAIT_SAMPLES)
+
+    def submit(self, key, task):
+        """Ставит task() в очередь ключа key"""
+        item = (time.perf_counter(), task)
+        with self._lock:
+            self._pending += 1
+            self._max_pending = max(self._max_pending, self._pending)
+            queue = self._queues.get(key)
+            if queue is not None:
+                # Очередь ключа уже обрабатывается - задача выполнится после предыдущих
+                queue.append(item)
+                return
+            self._queues[key] = deque([item])
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        for _ in range(DISPATCH_BATCH):
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                enqueued, task = queue.popleft()
+
+            started = time.perf_counter()
+            failed = False
+            try:
+                task()
+            except Exception as e:
+                failed = True
+                print(f"❌ Ошибка при обработке обновления: {e}")
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self._processed += 1
+                    self._errors += failed
+                    self._waits.append(started - enqueued)
+
+        # Даем поработать другим пользователям, остаток очереди - следующей задачей пула
+        try:
+            self._executor.submit(self._drain, key)
+        except RuntimeError:
+            # Пул уже останавливается - дорабатываем очередь в текущем потоке
+            self._drain(key)
+
+    def pending(self):
+        """Сколько задач принято, но еще не выполнено"""
+        with self._lock:
+            return self._pending
+
+    def metrics(self):
+        """Глубина очереди и время ожидания обновлений в полосе"""
+        with self._lock:
+            waits = sorted(self._waits)
+            metrics = {
+                'workers': self.workers,
+                'pending': self._pending,
+                'max_pending': self._max_pending,
+                'active_users': len(self._queues),
+                'processed': self._processed,
+                'errors': self._errors,
+            }
+        metrics['wait_avg'] = sum(waits) / len(waits) if waits else 0.0
+        metrics['wait_p95'] = waits[int(len(waits) * 0.95)] if waits else 0.0
+        metrics['wait_max'] = waits[-1] if waits else 0.0
+        return metrics
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class UpdateDispatcher:
+    """Распределяет обновления по полосам с порядком внутри пользователя
+
+    handle(update) обрабатывает одно обновление, is_slow(update) решает,
+    отправить ли его в медленную полосу. Порядок гарантируется для всех обновлений
+    одного пользователя: пока в какой-то полосе есть его необработанные обновления,
+    следующие идут в ту же полосу, даже если is_slow выбрал бы другую. Иначе
+    "500 еда" после /chart или /list после /import могли бы обогнать предыдущее.
+    """
+
+    def __init__(self, handle, is_slow=None, workers=DISPATCH_WORKERS, slow_workers=DISPATCH_SLOW_WORKERS):
+        self.handle = handle
+        self.is_slow = is_slow
+        self.lanes = {
+            FAST_LANE: KeyedLane(FAST_LANE, workers),
+            SLOW_LANE: KeyedLane(SLOW_LANE, slow_workers),
+        }
+        # user_id -> [полоса, сколько его обновлений принято и еще не обработано]
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def submit(self, update):
+        """Ставит обновление в очередь его пользователя"""
+        lane = SLOW_LANE if self.is_slow is not None and self.is_slow(update) else FAST_LANE
+        user_id = update_user_id(update)
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = [lane, 0]
+            user[1] += 1
+            lane = user[0]
+        self.lanes[lane].submit(user_id, lambda: self._handle(user_id, update))
+
+    def _handle(self, user_id, update):
+        try:
+            self.handle(update)
+        finally:
+            with self._lock:
+                user = self._users[user_id]
+                user[1] -= 1
+                if not user[1]:
+                    # Очередь пользователя пуста - следующее обновление выберет полосу заново
+                    del self._users[user_id]
+
+    def pending(self):
+        """Сколько обновлений принято, но еще не обработано (во всех полосах)"""
+        return sum(lane.pending() for lane in self.lanes.values())
+
+    def metrics(self):
+        """Метрики по полосам: {'fast': {...}, 'slow': {...}}"""
+        return {name: lane.metrics() for name, lane in self.lanes.items()}
+
+    def shutdown(self, wait=True):
+        """Дожидается обработки принятых обновлений и останавливает потоки"""
+        for lane in self.lanes.values():
+            lane.shutdown(wait=wait)
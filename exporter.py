@@ -0,0 +1,100 @@
+# exporter.py
+# Выгрузка операций в CSV или XLSX для /export. Строки берутся из генератора
+# Database.iter_operations и сразу пишутся в SpooledTemporaryFile: небольшой файл
+# остается в памяти, большой уходит на диск, поэтому память не растет с историей.
+import csv
+import gzip
+import importlib.util
+import io
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+EXPORT_SPOOL_SIZE = 1024 * 1024  # До этого размера файл держится в памяти
+# CSV больше этого размера отправляется сжатым (.csv.gz)
+EXPORT_GZIP_THRESHOLD = int(os.getenv('EXPORT_GZIP_THRESHOLD', str(5 * 1024 * 1024)))
+EXPORT_FORMATS = ('csv', 'xlsx')
+EXPORT_COLUMNS = ('Дата', 'Тип', 'Сумма', 'Категория', 'Описание')
+# Разделитель, который русский Excel понимает без настройки; /import его тоже читает
+CSV_DELIMITER = ';'
+
+TYPE_NAMES = {'income': 'доход', 'expense': 'расход'}
+
+
+class ExportError(ValueError):
+    """Выгрузка невозможна (сообщение показывается пользователю)"""
+
+
+def xlsx_available():
+    # openpyxl (XLSX - необязательная возможность) загружается только при выгрузке в XLSX
+    return importlib.util.find_spec('openpyxl') is not None
+
+
+def export_operations(rows, export_format='csv', tz=None):
+    """Пишет операции в файл; возвращает (файл, имя-суффикс, число строк)
+
+    rows - итератор строк Database.iter_operations, время пишется в часовом поясе tz
+    (по умолчанию UTC). Файл - SpooledTemporaryFile, перемотанный в начало;
+    закрывать его должен вызывающий.
+    """
+    tz = tz or timezone.utc
+    if export_format == 'xlsx':
+        if not xlsx_available():
+            raise ExportError("XLSX недоступен на сервере (нет openpyxl), выгрузите в CSV")
+        return _write_xlsx(rows, tz)
+    if export_format == 'csv':
+        return _write_csv(rows, tz)
+    raise ExportError(f"Неизвестный формат {export_format}, доступны: {', '.join(EXPORT_FORMATS)}")
+
+
+def _write_csv(rows, tz):
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    # utf-8-sig: Excel открывает кириллицу без выбора кодировки
+    text = io.TextIOWrapper(spool, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text, delimiter=CSV_DELIMITER)
+    writer.writerow(EXPORT_COLUMNS)
+
+    count = 0
+    for row in rows:
+        created = datetime.fromtimestamp(row['ts'], tz).strftime('%Y-%m-%d %H:%M:%S')
+        writer.writerow((created, TYPE_NAMES.get(row['type'], row['type']),
+                         row['amount'], row['category'], row['description']))
+        count += 1
+    text.flush()
+    text.detach()
+
+    if spool.tell() <= EXPORT_GZIP_THRESHOLD:
+        spool.seek(0)
+        return spool, 'csv', count
+
+    # Большой CSV хорошо сжимается: пережимаем потоком во второй временный файл
+    compressed = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    spool.seek(0)
+    with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=6) as archive:
+        shutil.copyfileobj(spool, archive)
+    spool.close()
+    compressed.seek(0)
+    return compressed, 'csv.gz', count
+
+
+def _write_xlsx(rows, tz):
+    import openpyxl
+
+    # write_only: openpyxl не держит лист в памяти, строки сразу сериализуются
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Операции')
+    sheet.append(EXPORT_COLUMNS)
+
+    count = 0
+    for row in rows:
+        created = datetime.fromtimestamp(row['ts'], tz).replace(tzinfo=None)
+        sheet.append((created, TYPE_NAMES.get(row['type'], row['type']),
+                      row['amount'], row['category'], row['description']))
+        count += 1
+
+    # XLSX - это уже zip, дополнительно не сжимаем
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    workbook.save(spool)
+    spool.seek(0)
+    return spool, 'xlsx', count
@@ -0,0 +1,134 @@
+# filters.py
+# Фильтры для /list, /stats и /chart: "/list cat:транспорт >5000 2025-Q3",
+# сравнение периодов: "/stats месяц vs" или "/stats 2025-03 vs 2024-03".
+# Разбор текста в OperationFilter; условия SQL из него собирает Database
+# (параметрами запроса, по составным индексам (user_id, ...)).
+import shlex
+from collections import namedtuple
+
+from periods import parse_period, previous_period, PeriodError
+
+FILTER_HELP = (
+    "Фильтры: <code>cat:транспорт</code> - категория, <code>расходы</code> или <code>доходы</code> - тип, "
+    "<code>&gt;5000</code>, <code>&lt;=100</code>, <code>1000..5000</code> - сумма, "
+    "и период (например, <code>2025-Q3</code>)\n"
+    "Пример: <code>/list cat:транспорт &gt;5000 2025-Q3</code>\n"
+    "Сравнение с прошлым периодом: <code>/stats месяц vs</code>, с другим: <code>/stats 2025-03 vs 2024-03</code>"
+)
+
+CATEGORY_KEYS = ('cat', 'category', 'кат', 'категория')
+TYPE_WORDS = {
+    'расход': 'expense', 'расходы': 'expense', 'expense': 'expense', 'expenses': 'expense',
+    'доход': 'income', 'доходы': 'income', 'income': 'income',
+}
+TYPE_LABELS = {'expense': 'расходы', 'income': 'доходы'}
+COMPARE_WORDS = ('vs', 'против', 'сравнить')
+# Оператор перед суммой -> (граница, поправка для целых сумм)
+AMOUNT_OPERATORS = (
+    ('>=', 'min_amount', 0), ('<=', 'max_amount', 0),
+    ('>', 'min_amount', 1), ('<', 'max_amount', -1),
+)
+
+
+class FilterError(ValueError):
+    """Фильтр не распознан (сообщение показывается пользователю)"""
+
+
+class OperationFilter(namedtuple('OperationFilter', 'period operation_type category min_amount max_amount compare')):
+    """Разобранный фильтр: период (periods.Period), условия на операции
+    и период для сравнения (compare, Period или None)"""
+
+    __slots__ = ()
+
+    @property
+    def conditions(self):
+        """Условия для методов Database (параметр filters), без периода"""
+        return {
+            'operation_type': self.operation_type,
+            'category': self.category,
+            'min_amount': self.min_amount,
+            'max_amount': self.max_amount,
+        }
+
+    @property
+    def empty(self):
+        """Фильтр ничего не ограничивает"""
+        return self.period.start is None and self.period.end is None and self.compare is None and \
+            not any(value is not None for value in self.conditions.values())
+
+    @property
+    def label(self):
+        parts = []
+        if self.operation_type:
+            parts.append(TYPE_LABELS[self.operation_type])
+        if self.category:
+            parts.append(self.category)
+        if self.min_amount is not None and self.max_amount is not None:
+            parts.append(f"{self.min_amount}..{self.max_amount} руб.")
+        elif self.min_amount is not None:
+            parts.append(f"от {self.min_amount} руб.")
+        elif self.max_amount is not None:
+            parts.append(f"до {self.max_amount} руб.")
+        parts.append(self.period.label)
+        return ', '.join(parts)
+
+
+def _parse_amount(text):
+    if not text.isdigit():
+        raise FilterError(f"Сумма должна быть целым числом: «{text}»")
+    return int(text)
+
+
+def parse_filter(text, now=None, tz=None):
+    """OperationFilter из аргументов команды; tz - часовой пояс пользователя. Бросает FilterError"""
+    try:
+        words = shlex.split(text or '')
+    except ValueError:
+        raise FilterError("Не закрыта кавычка")
+
+    found = {'operation_type': None, 'category': None, 'min_amount': None, 'max_amount': None}
+    period_words = []
+    compare_words = None  # После "vs" - слова второго периода
+    for word in words:
+        lowered = word.lower()
+        # Категория сравнивается в базе точно: "Еда" и "еда" - разные категории
+        key, separator, value = word.partition(':')
+
+        if separator and key.lower() in CATEGORY_KEYS:
+            if not value:
+                raise FilterError("Укажите категорию: cat:транспорт")
+            found['category'] = value
+        elif lowered in TYPE_WORDS:
+            found['operation_type'] = TYPE_WORDS[lowered]
+        elif lowered[:1] in '<>':
+            for operator, bound, shift in AMOUNT_OPERATORS:
+                if lowered.startswith(operator):
+                    found[bound] = _parse_amount(lowered[len(operator):].strip()) + shift
+                    break
+        elif '..' in lowered and lowered.replace('..', '', 1).isdigit():
+            low, high = lowered.split('..')
+            found['min_amount'], found['max_amount'] = _parse_amount(low), _parse_amount(high)
+        elif lowered in COMPARE_WORDS:
+            if compare_words is not None:
+                raise FilterError("Сравнить можно только два периода")
+            compare_words = []
+        elif compare_words is not None:
+            compare_words.append(word)
+        else:
+            period_words.append(word)
+
+    if found['min_amount'] is not None and found['max_amount'] is not None \
+            and found['min_amount'] > found['max_amount']:
+        raise FilterError("Нижняя граница суммы больше верхней")
+
+    try:
+        period = parse_period(' '.join(period_words), now, tz)
+        compare = None
+        if compare_words:
+            compare = parse_period(' '.join(compare_words), now, tz)
+        elif compare_words is not None:
+            compare = previous_period(period, now)
+    except PeriodError as e:
+        raise FilterError(str(e))
+
+    return OperationFilter(period, compare=compare, **found)
@@ -0,0 +1,279 @@
+# outbound.py
+# Очередь исходящих сообщений Telegram: обработчики ставят ответ в очередь и сразу
+# освобождают поток, а отправка идет в фоне с учетом лимитов Telegram - на каждый чат
+# и на бота в целом - и с повтором после 429 Too Many Requests.
+# Если несколько правок одного сообщения ждут отправки, уходит только последняя.
+import concurrent.futures
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '4'))
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))  # Сообщений в секунду от бота
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))       # Сообщений в секунду в один чат
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', '5'))       # Сколько можно отправить в чат подряд без пауз
+OUTBOUND_MAX_RETRIES = 5       # Сколько раз повторять запрос после 429
+OUTBOUND_PRUNE_EVERY = 1000    # Раз в сколько отправок удалять лимиты неактивных чатов
+
+
+class TokenBucket:
+    """Корзина токенов: пополняется на rate токенов в секунду, вмещает не больше capacity
+
+    Не потокобезопасна - Outbox обращается к ней под своей блокировкой.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Через сколько секунд появится токен (0, если есть сейчас)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Забирает токен, при необходимости в долг; возвращает, сколько ждать до его появления"""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def full(self):
+        """Корзина полна - ее можно удалить, ничего не потеряв"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class OutboundRequest:
+    __slots__ = ('chat_id', 'func', 'args', 'kwargs', 'futures', 'edit_key', 'retries')
+
+    def __init__(self, chat_id, func, args, kwargs, future, edit_key=None):
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = [future]
+        self.edit_key = edit_key
+        self.retries = 0
+
+
+class Outbox:
+    """Фоновая отправка сообщений с порядком внутри чата и лимитами Telegram
+
+    Методы повторяют одноименные методы telebot.TeleBot, но возвращают
+    concurrent.futures.Future с результатом (сообщением Telegram). Запросы одного
+    чата отправляются строго по очереди, разных чатов - параллельно в workers потоках,
+    которые запускаются при первом запросе.
+    """
+
+    def __init__(self, bot, workers=OUTBOUND_WORKERS, global_rate=OUTBOUND_GLOBAL_RATE,
+                 chat_rate=OUTBOUND_CHAT_RATE, chat_burst=OUTBOUND_CHAT_BURST):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}     # chat_id -> TokenBucket
+        self._chats = {}       # chat_id -> deque запросов; чат есть, пока у него есть запросы
+        self._busy = set()     # Чаты, запрос которых сейчас отправляется
+        self._ready = []       # Куча (когда можно отправлять, порядковый номер, chat_id)
+        self._edits = {}       # (chat_id, message_id) -> правка, ждущая отправки
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._stats = {'sent': 0, 'merged': 0, 'retried': 0, 'failed': 0}
+        self.workers = workers
+        self._threads = []  # Запускаются при первой отправке
+
+    # Методы в стиле TeleBot
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self.submit(chat_id, self.bot.send_message, (chat_id, text), kwargs)
+
+    def reply_to(self, message, text, **kwargs):
+        kwargs['reply_to_message_id'] = message.message_id
+        return self.send_message(message.chat.id, text, **kwargs)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        return self.submit(chat_id, self.bot.send_photo, (chat_id, photo), kwargs)
+
+    def send_document(self, chat_id, document, **kwargs):
+        return self.submit(chat_id, self.bot.send_document, (chat_id, document), kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        """Правка сообщения; еще не отправленная правка того же сообщения заменяется этой"""
+        kwargs.update(chat_id=chat_id, message_id=message_id)
+        return self.submit(chat_id, self.bot.edit_message_text, (text,), kwargs, edit_key=(chat_id, message_id))
+
+    # Очередь
+
+    def submit(self, chat_id, func, args=(), kwargs=None, edit_key=None):
+        """Ставит func(*args, **kwargs) в очередь чата chat_id; возвращает Future"""
+        future = concurrent.futures.Future()
+        kwargs = kwargs or {}
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("Очередь отправки остановлена")
+            if not self._threads:
+                self._start()
+
+            if edit_key is not None:
+                pending = self._edits.get(edit_key)
+                if pending is not None:
+                    # Предыдущая правка еще не ушла - отправим вместо нее новый текст
+                    pending.args, pending.kwargs = args, kwargs
+                    pending.futures.append(future)
+                    self._stats['merged'] += 1
+                    return future
+
+            request = OutboundRequest(chat_id, func, args, kwargs, future, edit_key)
+            if edit_key is not None:
+                self._edits[edit_key] = request
+            queue = self._chats.get(chat_id)
+            if queue is None:
+                queue = self._chats[chat_id] = deque()
+            queue.append(request)
+            if len(queue) == 1 and chat_id not in self._busy:
+                self._schedule(chat_id)
+        return future
+
+    def _start(self):
+        """Запускает потоки отправки (под блокировкой)"""
+        self._threads = [
+            threading.Thread(target=self._work, name=f'outbound-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _schedule(self, chat_id, delay=None):
+        """Ставит чат в очередь готовности (под блокировкой)"""
+        if delay is None:
+            delay = self._bucket(chat_id).delay()
+        heapq.heappush(self._ready, (time.monotonic() + delay, next(self._order), chat_id))
+        self._wakeup.notify()
+
+    def _next_request(self):
+        """Ждет чат, которому уже можно отправлять; None - очередь остановлена и пуста"""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                if self._ready and self._ready[0][0] <= now:
+                    break
+                if self._stopping and not self._chats:
+                    return None, 0.0
+                self._wakeup.wait(self._ready[0][0] - now if self._ready else None)
+
+            chat_id = heapq.heappop(self._ready)[2]
+            request = self._chats[chat_id].popleft()
+            if request.edit_key is not None:
+                # Правки, пришедшие после этого момента, отправятся отдельно
+                self._edits.pop(request.edit_key, None)
+            self._busy.add(chat_id)
+            self._bucket(chat_id).take()
+            return request, self._global.take()
+
+    def _work(self):
+        sent = 0
+        while True:
+            request, wait = self._next_request()
+            if request is None:
+                return
+            if wait:
+                time.sleep(wait)
+
+            retry_after = self._send(request)
+
+            with self._lock:
+                chat_id = request.chat_id
+                self._busy.discard(chat_id)
+                queue = self._chats[chat_id]
+                if retry_after is not None:
+                    queue.appendleft(request)
+                    self._schedule(chat_id, retry_after)
+                elif queue:
+                    self._schedule(chat_id)
+                else:
+                    del self._chats[chat_id]
+                    if self._stopping and not self._chats:
+                        self._wakeup.notify_all()
+
+                sent += 1
+                if sent % OUTBOUND_PRUNE_EVERY == 0:
+                    for idle in [key for key, bucket in self._buckets.items()
+                                 if key not in self._chats and bucket.full()]:
+                        del self._buckets[idle]
+
+    def _send(self, request):
+        """Выполняет запрос; возвращает паузу перед повтором или None, если запрос завершен"""
+        # Файлы (BytesIO с графиком) при повторе нужно читать с начала
+        for value in itertools.chain(request.args, request.kwargs.values()):
+            if hasattr(value, 'seek'):
+                value.seek(0)
+
+        try:
+            result = request.func(*request.args, **request.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and request.retries < OUTBOUND_MAX_RETRIES:
+                request.retries += 1
+                retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                with self._lock:
+                    self._stats['retried'] += 1
+                print(f"⏳ Telegram ограничил отправку в чат {request.chat_id}, повтор через {retry_after} с")
+                return retry_after
+            if 'message is not modified' in str(e.description):
+                # Текст уже такой же (например, повторное нажатие той же кнопки)
+                return self._finish(request, result=None)
+            print(f"❌ Не удалось отправить сообщение в чат {request.chat_id}: {e}")
+            return self._finish(request, error=e)
+        except Exception as e:
+            print(f"❌ Не удалось отправить сообщение в чат {request.chat_id}: {e}")
+            traceback.print_exc()
+            return self._finish(request, error=e)
+        return self._finish(request, result=result)
+
+    def _finish(self, request, result=None, error=None):
+        with self._lock:
+            self._stats['failed' if error is not None else 'sent'] += 1
+        for future in request.futures:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        return None
+
+    def metrics(self):
+        """Очередь и счетчики: отправлено, слито правок, повторов после 429, ошибок"""
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics['pending'] = sum(len(queue) for queue in self._chats.values()) + len(self._busy)
+            metrics['chats'] = len(self._chats)
+        return metrics
+
+    def shutdown(self, wait=True):
+        """Отправляет все, что уже в очереди, и останавливает потоки"""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,286 @@
+# periods.py
+# Разбор периодов из аргументов команд: "неделя", "месяц", "2024", "2024-03", "2024-Q3",
+# "01.01.2024-31.03.2024" и т.п., предыдущий период для сравнения и часовые пояса.
+# Границы считаются в часовом поясе пользователя (tz) и передаются в Database как
+# datetime с tzinfo - там они становятся Unix-временем UTC (конец периода не включается).
+# Без tz границы наивные и означают UTC.
+import os
+import re
+import zoneinfo
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from sqlite_database import month_range
+
+Period = namedtuple('Period', 'start end label')
+
+ALL_TIME_WORDS = ('', 'all', 'все', 'всё')
+WEEK_WORDS = ('week', 'неделя')
+MONTH_WORDS = ('month', 'месяц')
+YEAR_WORDS = ('year', 'год')
+
+PERIOD_HELP = (
+    "Период: <code>неделя</code>, <code>месяц</code>, <code>год</code>, <code>2024</code>, <code>2024-03</code> "
+    "(или <code>03.2024</code>), квартал <code>2024-Q3</code>, неделя <code>2024-W10</code>, "
+    "диапазон <code>01.01.2024-31.03.2024</code>"
+)
+
+_YEAR = re.compile(r'^(\d{4})$')
+_MONTH = re.compile(r'^(\d{4})-(\d{1,2})$|^(\d{1,2})\.(\d{4})$')
+_QUARTER = re.compile(r'^(\d{4})-?q([1-4])$|^q([1-4])-?(\d{4})$')
+_WEEK = re.compile(r'^(\d{4})-?w(\d{1,2})$')
+_DAY_FORMATS = ('%d.%m.%Y', '%Y-%m-%d')
+# Годы, которые можно указать в периоде: конец периода (1 января следующего года)
+# должен помещаться в datetime
+MIN_YEAR, MAX_YEAR = 1, 9998
+
+# Часовой пояс пользователей, которые его не выбрали (/timezone)
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'UTC')
+TIMEZONE_ALIASES = {'мск': 'Europe/Moscow', 'msk': 'Europe/Moscow', 'utc': 'UTC', 'gmt': 'UTC'}
+_UTC_OFFSET = re.compile(r'^(?:utc|gmt)?\s*([+-])(\d{1,2})(?::?(\d{2}))?$')
+_timezone_names = None  # Имена IANA в нижнем регистре -> имя, заполняется при первом поиске
+
+
+class PeriodError(ValueError):
+    """Период не распознан (сообщение показывается пользователю)"""
+
+
+class TimezoneError(ValueError):
+    """Часовой пояс не распознан (сообщение показывается пользователю)"""
+
+
+def parse_timezone(text):
+    """Каноническое имя часового пояса: "Europe/Moscow", "мск", "+3", "UTC-05:30"
+
+    Смещение без правил перехода на летнее время хранится как "UTC+03:00".
+    """
+    global _timezone_names
+    text = (text or '').strip()
+    lowered = text.lower()
+    if lowered in TIMEZONE_ALIASES:
+        return TIMEZONE_ALIASES[lowered]
+
+    match = _UTC_OFFSET.match(lowered)
+    if match:
+        sign, hours, minutes = match.group(1), int(match.group(2)), int(match.group(3) or 0)
+        if hours > 14 or minutes >= 60:
+            raise TimezoneError(f"Нет такого смещения: {text}")
+        if not hours and not minutes:
+            return 'UTC'
+        return f"UTC{sign}{hours:02d}:{minutes:02d}"
+
+    if _timezone_names is None:
+        _timezone_names = {name.lower(): name for name in zoneinfo.available_timezones()}
+    name = _timezone_names.get(lowered)
+    if name is None:
+        raise TimezoneError(f"Не знаю часовой пояс «{text}»")
+    return name
+
+
+def get_timezone(name=None):
+    """tzinfo по имени из parse_timezone (None - DEFAULT_TIMEZONE)"""
+    name = name or DEFAULT_TIMEZONE
+    if name.startswith('UTC') and len(name) > 3:
+        hours, minutes = name[4:].split(':')
+        offset = timedelta(hours=int(hours), minutes=int(minutes))
+        return timezone(-offset if name[3] == '-' else offset, name)
+    return zoneinfo.ZoneInfo(name)
+
+
+def localize(period, tz):
+    """Period с границами в часовом поясе tz (наивные границы считаются местным временем)"""
+    if tz is None or period.start is None and period.end is None:
+        return period
+    start = period.start.replace(tzinfo=tz) if period.start is not None else None
+    end = period.end.replace(tzinfo=tz) if period.end is not None else None
+    return Period(start, end, period.label)
+
+
+def _local_now(now, tz):
+    """Текущее местное время без tzinfo - в нем считаются календарные границы"""
+    if now is None:
+        now = datetime.now(tz or timezone.utc)
+    return now.astimezone(tz).replace(tzinfo=None) if now.tzinfo is not None else now
+
+
+def _parse_day(text):
+    for day_format in _DAY_FORMATS:
+        try:
+            return datetime.strptime(text, day_format)
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_range(text):
+    """(первый день, последний день) из "01.01.2024-31.03.2024" или "2024-01-01..2024-03-31" """
+    for separator in ('..', '—', ' - '):
+        if separator in text:
+            candidates = [text.split(separator, 1)]
+            break
+    else:
+        # В ISO-датах тоже есть "-", поэтому пробуем каждый дефис как границу
+        candidates = [(text[:i], text[i + 1:]) for i, char in enumerate(text) if char == '-']
+
+    for first, last in candidates:
+        first, last = _parse_day(first.strip()), _parse_day(last.strip())
+        if first is not None and last is not None:
+            return first, last
+    return None
+
+
+def _check_year(year):
+    if not MIN_YEAR <= year <= MAX_YEAR:
+        raise PeriodError(f"Год должен быть от {MIN_YEAR} до {MAX_YEAR}")
+    return year
+
+
+def _month_period(year, month):
+    _check_year(year)
+    if not 1 <= month <= 12:
+        raise PeriodError(f"Нет такого месяца: {month}")
+    start, end = month_range(year, month)
+    return Period(start, end, f"{month:02d}.{year}")
+
+
+def _quarter_period(year, quarter):
+    _check_year(year)
+    start, _ = month_range(year, quarter * 3 - 2)
+    _, end = month_range(year, quarter * 3)
+    return Period(start, end, f"{quarter} кв. {year}")
+
+
+def _week_period(monday):
+    return Period(monday, monday + timedelta(days=7), f"неделя с {monday.strftime('%d.%m.%Y')}")
+
+
+def _add_months(moment, months):
+    index = moment.year * 12 + moment.month - 1 + months
+    return moment.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _whole_months(start, end):
+    """Сколько календарных месяцев ровно занимает [start, end), или 0"""
+    if start.day != 1 or end.day != 1 or start.time() != datetime.min.time() or end.time() != datetime.min.time():
+        return 0
+    return (end.year - start.year) * 12 + end.month - start.month
+
+
+def describe_period(start, end):
+    """Подпись периода в том же виде, что дает parse_period"""
+    months = _whole_months(start, end)
+    if months == 1:
+        return f"{start.month:02d}.{start.year}"
+    if months == 3 and start.month % 3 == 1:
+        return f"{(start.month + 2) // 3} кв. {start.year}"
+    if months == 12 and start.month == 1:
+        return str(start.year)
+    last_day = end - timedelta(days=1)
+    if end - start == timedelta(days=1):
+        return start.strftime('%d.%m.%Y')
+    if end - start == timedelta(days=7) and start.weekday() == 0:
+        return _week_period(start).label
+    return f"{start.strftime('%d.%m.%Y')} - {last_day.strftime('%d.%m.%Y')}"
+
+
+def previous_period(period, now=None):
+    """Период той же длины непосредственно перед period - для сравнения
+
+    Календарные месяцы, кварталы и годы сдвигаются на целые месяцы. Если period
+    еще идет (now внутри него), предыдущий период обрезается до той же длины:
+    первые 10 дней месяца сравниваются с первыми 10 днями прошлого месяца.
+    Результат в том же часовом поясе, что и period.
+    """
+    if period.start is None or period.end is None:
+        raise PeriodError("Для сравнения укажите период, например: месяц vs")
+
+    # Календарь считаем в местном времени, часовой пояс вернем в конце
+    tz = period.start.tzinfo
+    period_start, period_end = period.start.replace(tzinfo=None), period.end.replace(tzinfo=None)
+
+    months = _whole_months(period_start, period_end)
+    try:
+        if months:
+            start = _add_months(period_start, -months)
+        else:
+            start = period_start - (period_end - period_start)
+    except (ValueError, OverflowError):
+        # Период начинается в первом году - раньше datetime не считает
+        raise PeriodError(f"Нет периода раньше {describe_period(period_start, period_end)}")
+    end = period_start
+
+    now = _local_now(now, tz)
+    # Прошлый период бывает короче (февраль перед 31 марта) - тогда берем его целиком
+    if period_start < now < period_end and start + (now - period_start) < end:
+        cut = start + (now - period_start)
+        if cut - start < timedelta(days=1):
+            return localize(Period(start, cut, f"{describe_period(start, end)} до {cut.strftime('%H:%M')}"), tz)
+        return localize(Period(start, cut, f"{describe_period(start, end)} по {cut.strftime('%d.%m')}"), tz)
+    return localize(Period(start, end, describe_period(start, end)), tz)
+
+
+def parse_period(text, now=None, tz=None):
+    """Period(start, end, label) по тексту; start и end равны None для всего времени
+
+    tz - часовой пояс пользователя: "месяц" и "2024-03" начинаются в его полночь.
+    """
+    return localize(_parse_period(text, _local_now(now, tz)), tz)
+
+
+def _parse_period(text, now):
+    text = (text or '').strip().lower()
+
+    if text in ALL_TIME_WORDS:
+        return Period(None, None, "все время")
+    if text in WEEK_WORDS:
+        today = datetime(now.year, now.month, now.day)
+        return _week_period(today - timedelta(days=today.weekday()))
+    if text in MONTH_WORDS:
+        return _month_period(now.year, now.month)
+    if text in YEAR_WORDS:
+        return Period(datetime(now.year, 1, 1), datetime(now.year + 1, 1, 1), str(now.year))
+
+    match = _YEAR.match(text)
+    if match:
+        year = _check_year(int(match.group(1)))
+        return Period(datetime(year, 1, 1), datetime(year + 1, 1, 1), str(year))
+
+    match = _MONTH.match(text)
+    if match:
+        if match.group(1):
+            return _month_period(int(match.group(1)), int(match.group(2)))
+        return _month_period(int(match.group(4)), int(match.group(3)))
+
+    match = _QUARTER.match(text.replace('к', 'q'))
+    if match:
+        if match.group(1):
+            return _quarter_period(int(match.group(1)), int(match.group(2)))
+        return _quarter_period(int(match.group(4)), int(match.group(3)))
+
+    match = _WEEK.match(text)
+    if match:
+        _check_year(int(match.group(1)))
+        try:
+            monday = datetime.strptime(f"{match.group(1)}-W{int(match.group(2)):02d}-1", '%G-W%V-%u')
+        except ValueError:
+            raise PeriodError(f"Нет такой недели: {text}")
+        if monday.isocalendar()[1] != int(match.group(2)):
+            raise PeriodError(f"Нет такой недели: {text}")
+        return _week_period(monday)
+
+    # Один день или диапазон дней включительно: 01.01.2024-31.03.2024
+    day = _parse_day(text)
+    if day is not None:
+        _check_year(day.year)
+        return Period(day, day + timedelta(days=1), day.strftime('%d.%m.%Y'))
+    days = _parse_range(text)
+    if days is not None:
+        first, last = days
+        _check_year(first.year)
+        _check_year(last.year)
+        if last < first:
+            raise PeriodError("Конец периода раньше начала")
+        return Period(first, last + timedelta(days=1),
+                      f"{first.strftime('%d.%m.%Y')} - {last.strftime('%d.%m.%Y')}")
+
+    raise PeriodError(f"Не понимаю период «{text}»")
@@ -1,155 +1,933 @@
 # sqlite_database.py
 import sqlite3
 import os
-from datetime import datetime
-from categories import detect_category as detect_standard_category
+import calendar
+import itertools
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from categories import CategoryMatcher
 
-class Database:
-    def __init__(self, db_name='finance_bot.db'):
+# Настройки пула соединений (можно переопределить переменными окружения)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Сколько подготовленных наборов категорий пользователей держать в памяти
+CATEGORY_CACHE_SIZE = int(os.getenv('CATEGORY_CACHE_SIZE', '1024'))
+# Размер порции при массовом пересчете категорий (одна транзакция на порцию)
+RECATEGORIZE_CHUNK_SIZE = int(os.getenv('RECATEGORIZE_CHUNK_SIZE', '2000'))
+# Размер порции при импорте операций из файла (одна транзакция на порцию)
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '5000'))
+# Сколько операций читать одним запросом при выгрузке
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
+# PRAGMA, которые применяются к каждому новому соединению.
+# WAL позволяет читателям не блокировать писателя, а synchronous=NORMAL
+# в режиме WAL делает fsync только при checkpoint, а не на каждый коммит.
+CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',      # ~16 МБ страничного кеша на соединение
+    'PRAGMA mmap_size = 268435456',    # 256 МБ memory-mapped I/O
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Версия схемы хранится в PRAGMA user_version и растет с каждой миграцией
+SCHEMA_VERSION = 9
+# Сколько строк обновлять за одну транзакцию при заполнении новых колонок
+MIGRATION_BATCH_SIZE = 5000
+# Полнотекстовый поиск: каждое слово описания попадает в индекс FTS5 с префиксом
+# владельца (u<user_id>x), поэтому поиск читает только записи одного пользователя
+SEARCH_OWNER_PREFIX = 'u'
+SEARCH_MAX_TERMS = 8  # Больше слов из запроса не берем
+# Длина суток в секундах: операции сворачиваются в daily_rollups по дням UTC
+SECONDS_PER_DAY = 86400
+
+
+class ConnectionPool:
+    """Ограниченный пул постоянных соединений с SQLite"""
+
+    def __init__(self, db_name, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
         self.db_name = db_name
-        self.init_database()
-    
-    def get_connection(self):
-        """Создает соединение с базой данных"""
-        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        # Каждое соединение к :memory: - это отдельная база, поэтому держим одно
+        self.size = 1 if db_name == ':memory:' else max(1, size)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create_connection(self):
+        """Открывает новое соединение и настраивает его"""
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, check_same_thread=False)
         conn.row_factory = sqlite3.Row  # Чтобы получать данные как словарь
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        # Используется триггерами поискового индекса
+        conn.create_function('search_terms', 2, search_terms, deterministic=True)
         return conn
-    
+
+    def acquire(self):
+        """Берет свободное соединение из пула или создает новое, пока не достигнут лимит"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Пул соединений закрыт")
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._create_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Нет свободных соединений с базой данных")
+
+    def release(self, conn):
+        """Возвращает соединение в пул"""
+        with self._lock:
+            if self._closed:
+                self._created -= 1
+                conn.close()
+                return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Выдает соединение на время транзакции: commit при успехе, rollback при ошибке"""
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Закрывает пул: переносит WAL в основной файл и закрывает соединения"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        checkpointed = False
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if not checkpointed:
+                    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                    checkpointed = True
+            except sqlite3.Error as e:
+                print(f"Ошибка при checkpoint WAL: {e}")
+            finally:
+                with self._lock:
+                    self._created -= 1
+                conn.close()
+
+
+def month_range(year, month, tz=None):
+    """Возвращает границы месяца [начало, начало следующего месяца)
+
+    tz - часовой пояс, в полночь которого начинается месяц (по умолчанию UTC).
+    """
+    start = datetime(year, month, 1, tzinfo=tz)
+    if month == 12:
+        end = datetime(year + 1, 1, 1, tzinfo=tz)
+    else:
+        end = datetime(year, month + 1, 1, tzinfo=tz)
+    return start, end
+
+
+def to_timestamp(value):
+    """Переводит datetime в Unix-время (наивные datetime считаются UTC)"""
+    if value.tzinfo is None:
+        return calendar.timegm(value.timetuple())
+    return int(value.timestamp())
+
+
+def search_words(text):
+    """Слова текста для поиска: нижний регистр, ё как е"""
+    return re.findall(r'[^\W_]+', (text or '').lower().replace('ё', 'е'))
+
+
+def search_terms(user_id, description):
+    """Содержимое поискового индекса для операции: "u7xкофе u7xс u7xсобой"
+
+    Индекс ведут методы записи Database (функция зарегистрирована в каждом соединении пула),
+    а не триггеры: запись в operations в обход Database индекс не обновляет.
+    Если функцию изменить или писать в operations напрямую, индекс нужно построить
+    заново: rebuild_search_index() или python sqlite_database.py --rebuild-search.
+    """
+    return ' '.join(f'{SEARCH_OWNER_PREFIX}{user_id}x{word}' for word in search_words(description))
+
+
+def search_match(user_id, text):
+    """Запрос FTS5: все слова из text как начала слов пользователя; None, если слов нет
+
+    Слова заключаются в кавычки, поэтому операторы FTS5 из текста пользователя не действуют.
+    """
+    words = search_words(text)[:SEARCH_MAX_TERMS]
+    if not words:
+        return None
+    return ' AND '.join(f'"{SEARCH_OWNER_PREFIX}{user_id}x{word}"*' for word in words)
+
+
+class Database:
+    def __init__(self, db_name='finance_bot.db', initialize=True):
+        self.db_name = db_name
+        self.pool = ConnectionPool(db_name)
+        # LRU-кеш CategoryMatcher по user_id, сбрасывается при изменении категорий
+        self._matchers = OrderedDict()
+        self._matchers_lock = threading.Lock()
+        self._matchers_generation = 0
+        # Схему можно создать позже (initialize=False) - тогда это сделает
+        # явный вызов init_database() при запуске или первое обращение к базе
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        if initialize:
+            self.init_database()
+
+    def connection(self):
+        """Возвращает соединение из пула (используется как контекстный менеджер)"""
+        if not self._initialized:
+            self.init_database()
+        return self.pool.connection()
+
+    def close(self):
+        """Корректно закрывает базу данных при остановке бота"""
+        self.pool.close()
+        print("✅ База данных закрыта")
+
     def init_database(self):
-        """Инициализирует базу данных и создает таблицы"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Таблица операций
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS operations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        """Инициализирует базу данных и создает таблицы (выполняется один раз)"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            self._create_schema()
+            self._initialized = True
+
+        print("✅ База данных инициализирована")
+
+    def _create_schema(self):
+        """Создает таблицы и применяет миграции"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+
+            # Режим WAL сохраняется в файле базы, достаточно включить один раз
+            cursor.execute('PRAGMA journal_mode = WAL')
+
+            # Таблица операций
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS operations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                description TEXT NOT NULL,
+                type TEXT NOT NULL,
+                category TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                ts INTEGER
+            )
+            ''')
+
+            # НОВАЯ ТАБЛИЦА для персональных категорий
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_categories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                category_name TEXT NOT NULL,
+                keywords TEXT NOT NULL,
+                UNIQUE(user_id, category_name)
+            )
+            ''')
+
+            # Индексы для быстрого поиска
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_categories ON user_categories (user_id)')
+
+            self.migrate(conn)
+
+    def migrate(self, conn):
+        """Доводит схему существующей базы до SCHEMA_VERSION"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+        if version < 1:
+            self._migrate_operations_ts(conn)
+        if version < 2:
+            self._migrate_daily_rollups(conn)
+        if version < 3:
+            self._migrate_edit_states(conn)
+        if version < 4:
+            self._migrate_operations_search(conn)
+        if version < 5:
+            self._migrate_filter_indexes(conn)
+        if version < 6:
+            self._migrate_user_settings(conn)
+        if version < 7:
+            self._migrate_bulk_load_triggers(conn)
+        if version < 8:
+            self._migrate_bulk_load_table(conn)
+        if version < 9:
+            self._migrate_search_triggers(conn)
+
+        if version != SCHEMA_VERSION:
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def _migrate_operations_ts(self, conn):
+        """Миграция 1: колонка ts (Unix-время UTC) и составной индекс (user_id, ts)"""
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(operations)')]
+        if 'ts' not in columns:
+            conn.execute('ALTER TABLE operations ADD COLUMN ts INTEGER')
+
+        # Заполняем ts порциями, чтобы не держать блокировку записи на всю таблицу
+        max_id = conn.execute('SELECT MAX(id) FROM operations').fetchone()[0] or 0
+        filled = 0
+        for first_id in range(0, max_id, MIGRATION_BATCH_SIZE):
+            cursor = conn.execute('''
+            UPDATE operations
+            SET ts = CAST(strftime('%s', created_at) AS INTEGER)
+            WHERE id > ? AND id <= ? AND ts IS NULL
+            ''', (first_id, first_id + MIGRATION_BATCH_SIZE))
+            filled += cursor.rowcount
+            conn.commit()
+        if filled:
+            print(f"🔄 Заполнено время операций: {filled}")
+
+        # Операции, добавленные без ts (например, вручную), получают его из created_at
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS operations_fill_ts
+        AFTER INSERT ON operations
+        WHEN NEW.ts IS NULL
+        BEGIN
+            UPDATE operations
+            SET ts = CAST(strftime('%s', NEW.created_at) AS INTEGER)
+            WHERE id = NEW.id;
+        END
+        ''')
+
+        # Составной индекс покрывает и выборку по пользователю, и диапазоны по времени,
+        # поэтому отдельные индексы по user_id и created_at больше не нужны
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_operations_user_ts ON operations (user_id, ts)')
+        conn.execute('DROP INDEX IF EXISTS idx_user_id')
+        conn.execute('DROP INDEX IF EXISTS idx_created_at')
+
+    def _migrate_daily_rollups(self, conn):
+        """Миграция 2: таблица дневных итогов, которую поддерживают триггеры
+
+        Тела триггеров должны оставаться чистым SQL, без функций, зарегистрированных
+        в пуле (search_terms и т. п.): в базу пишут и в обход Database - sqlite3, скрипты,
+        и такая запись должна проходить и сохранять итоги верными.
+        """
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollups (
             user_id INTEGER NOT NULL,
-            amount INTEGER NOT NULL,
-            description TEXT NOT NULL,
+            day INTEGER NOT NULL,
             type TEXT NOT NULL,
             category TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            total INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, type, category)
+        ) WITHOUT ROWID
+        ''')
+
+        # Триггеры держат итоги точными при любой записи в operations,
+        # в той же транзакции, что и сама запись
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS daily_rollups_insert
+        AFTER INSERT ON operations
+        WHEN NEW.ts IS NOT NULL
+        BEGIN
+            INSERT INTO daily_rollups (user_id, day, type, category, total, count)
+            VALUES (NEW.user_id, NEW.ts / {SECONDS_PER_DAY}, NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT (user_id, day, type, category)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS daily_rollups_delete
+        AFTER DELETE ON operations
+        WHEN OLD.ts IS NOT NULL
+        BEGIN
+            UPDATE daily_rollups
+            SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = OLD.ts / {SECONDS_PER_DAY}
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM daily_rollups
+            WHERE user_id = OLD.user_id AND day = OLD.ts / {SECONDS_PER_DAY}
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS daily_rollups_update
+        AFTER UPDATE OF user_id, amount, type, category, ts ON operations
+        BEGIN
+            UPDATE daily_rollups
+            SET total = total - OLD.amount, count = count - 1
+            WHERE OLD.ts IS NOT NULL
+              AND user_id = OLD.user_id AND day = OLD.ts / {SECONDS_PER_DAY}
+              AND type = OLD.type AND category = OLD.category;
+            DELETE FROM daily_rollups
+            WHERE OLD.ts IS NOT NULL
+              AND user_id = OLD.user_id AND day = OLD.ts / {SECONDS_PER_DAY}
+              AND type = OLD.type AND category = OLD.category AND count <= 0;
+            INSERT INTO daily_rollups (user_id, day, type, category, total, count)
+            SELECT NEW.user_id, NEW.ts / {SECONDS_PER_DAY}, NEW.type, NEW.category, NEW.amount, 1
+            WHERE NEW.ts IS NOT NULL
+            ON CONFLICT (user_id, day, type, category)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+        ''')
+
+        self._rebuild_rollups(conn)
+
+    def _migrate_edit_states(self, conn):
+        """Миграция 3: незавершенные редактирования операций переживают перезапуск бота"""
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS edit_states (
+            user_id INTEGER PRIMARY KEY,
+            action TEXT NOT NULL,
+            operation_id INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
         )
         ''')
-        
-        # НОВАЯ ТАБЛИЦА для персональных категорий
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            category_name TEXT NOT NULL,
-            keywords TEXT NOT NULL,
-            UNIQUE(user_id, category_name)
+
+    def _migrate_operations_search(self, conn):
+        """Миграция 4: полнотекстовый индекс FTS5 по описаниям операций
+
+        Таблица без собственного содержимого (content=''): хранит только индекс,
+        rowid совпадает с operations.id, а сами строки читаются из operations.
+        Слова индексируются вместе с владельцем (см. search_terms), поэтому
+        частое слово у других пользователей не замедляет поиск.
+        """
+        conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS operations_fts USING fts5(
+            terms,
+            content='',
+            tokenize='unicode61 remove_diacritics 2'
         )
         ''')
-        
-        # Индексы для быстрого поиска
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON operations (user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON operations (created_at)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_categories ON user_categories (user_id)')
-        
-        conn.commit()
-        conn.close()
-        print("✅ База данных инициализирована")
-    
+
+        # Индекс без содержимого удаляет запись только по ее исходным словам - берем их из OLD
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS operations_fts_insert
+        AFTER INSERT ON operations
+        BEGIN
+            INSERT INTO operations_fts (rowid, terms)
+            VALUES (NEW.id, search_terms(NEW.user_id, NEW.description));
+        END
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS operations_fts_delete
+        AFTER DELETE ON operations
+        BEGIN
+            INSERT INTO operations_fts (operations_fts, rowid, terms)
+            VALUES ('delete', OLD.id, search_terms(OLD.user_id, OLD.description));
+        END
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS operations_fts_update
+        AFTER UPDATE OF user_id, description ON operations
+        BEGIN
+            INSERT INTO operations_fts (operations_fts, rowid, terms)
+            VALUES ('delete', OLD.id, search_terms(OLD.user_id, OLD.description));
+            INSERT INTO operations_fts (rowid, terms)
+            VALUES (NEW.id, search_terms(NEW.user_id, NEW.description));
+        END
+        ''')
+
+        # Индексируем уже записанные операции порциями, как при заполнении ts
+        max_id = conn.execute('SELECT MAX(id) FROM operations').fetchone()[0] or 0
+        for first_id in range(0, max_id, MIGRATION_BATCH_SIZE):
+            conn.execute('''
+            INSERT INTO operations_fts (rowid, terms)
+            SELECT id, search_terms(user_id, description) FROM operations
+            WHERE id > ? AND id <= ?
+            ''', (first_id, first_id + MIGRATION_BATCH_SIZE))
+            conn.commit()
+
+        if max_id:
+            print("✅ Поисковый индекс по описаниям операций построен")
+
+    def _migrate_filter_indexes(self, conn):
+        """Миграция 5: составные индексы для фильтров /list и /stats по категории и типу
+
+        ts в конце индекса дает и диапазон по периоду, и порядок ORDER BY ts, id без сортировки.
+        """
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_operations_user_category_ts ON operations (user_id, category, ts)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_operations_user_type_ts ON operations (user_id, type, ts)')
+
+    def _migrate_user_settings(self, conn):
+        """Миграция 6: настройки пользователя (часовой пояс для границ дней и месяцев)"""
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            timezone TEXT
+        )
+        ''')
+
+    def _migrate_bulk_load_triggers(self, conn):
+        """Миграция 7: триггеры вставки не срабатывали при массовой загрузке
+
+        Флаг загрузки читался функцией bulk_load_active() из Python, поэтому запись
+        в operations без функций бота (sqlite3, скрипты) падала. Миграция 8 заменяет
+        эти триггеры, поэтому здесь ничего не делаем.
+        """
+
+    def _migrate_bulk_load_table(self, conn):
+        """Миграция 8: флаг массовой загрузки - строка в таблице bulk_load
+
+        import_operations вставляет строку в bulk_load в начале транзакции порции и
+        удаляет ее перед commit. Строку видит только эта транзакция, а писатель в SQLite
+        один, поэтому другие записи (в том числе из sqlite3 и скриптов) идут через
+        триггеры как обычно. Тела триггеров - чистый SQL, без функций бота.
+        """
+        conn.execute('CREATE TABLE IF NOT EXISTS bulk_load (active INTEGER NOT NULL)')
+        conn.execute('DELETE FROM bulk_load')
+        conn.execute('DROP TRIGGER IF EXISTS daily_rollups_insert')
+        conn.execute(f'''
+        CREATE TRIGGER daily_rollups_insert
+        AFTER INSERT ON operations
+        WHEN NEW.ts IS NOT NULL AND NOT EXISTS (SELECT 1 FROM bulk_load)
+        BEGIN
+            INSERT INTO daily_rollups (user_id, day, type, category, total, count)
+            VALUES (NEW.user_id, NEW.ts / {SECONDS_PER_DAY}, NEW.type, NEW.category, NEW.amount, 1)
+            ON CONFLICT (user_id, day, type, category)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+        ''')
+        conn.execute('DROP TRIGGER IF EXISTS operations_fts_insert')
+        conn.execute('''
+        CREATE TRIGGER operations_fts_insert
+        AFTER INSERT ON operations
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_load)
+        BEGIN
+            INSERT INTO operations_fts (rowid, terms)
+            VALUES (NEW.id, search_terms(NEW.user_id, NEW.description));
+        END
+        ''')
+
+    def _migrate_search_triggers(self, conn):
+        """Миграция 9: поисковый индекс ведут методы записи Database, а не триггеры
+
+        Триггеры operations_fts_* вызывали search_terms() из Python, поэтому запись
+        в operations без функций бота (sqlite3, скрипты) падала с "no such function".
+        Теперь все тела триггеров - чистый SQL, а слова в индекс добавляют и удаляют
+        add_operations, import_operations, update_operation, delete_operation и
+        clear_operations в той же транзакции, что и саму запись.
+        """
+        conn.execute('DROP TRIGGER IF EXISTS operations_fts_insert')
+        conn.execute('DROP TRIGGER IF EXISTS operations_fts_delete')
+        conn.execute('DROP TRIGGER IF EXISTS operations_fts_update')
+
+    def rebuild_rollups(self, user_id=None):
+        """Пересчитывает дневные итоги из operations (для всех или одного пользователя)"""
+        with self.connection() as conn:
+            rows = self._rebuild_rollups(conn, user_id)
+        print(f"✅ Дневные итоги пересчитаны: {rows} записей")
+        return rows
+
+    def rebuild_search_index(self):
+        """Строит поисковый индекс заново по всем операциям
+
+        Нужен после записи в operations в обход Database и после изменения search_terms.
+        """
+        with self.connection() as conn:
+            # Индекс без содержимого очищается целиком только командой delete-all
+            conn.execute("INSERT INTO operations_fts (operations_fts) VALUES ('delete-all')")
+            max_id = conn.execute('SELECT MAX(id) FROM operations').fetchone()[0] or 0
+            self._index_search(conn, 0, max_id)
+            rows = conn.execute('SELECT COUNT(*) FROM operations').fetchone()[0]
+        print(f"✅ Поисковый индекс построен заново: {rows} операций")
+        return rows
+
+    def _rebuild_rollups(self, conn, user_id=None):
+        """Заполняет daily_rollups заново в рамках переданной транзакции"""
+        if user_id is None:
+            where, params = 'ts IS NOT NULL', []
+            conn.execute('DELETE FROM daily_rollups')
+        else:
+            where, params = 'user_id = ? AND ts IS NOT NULL', [user_id]
+            conn.execute('DELETE FROM daily_rollups WHERE user_id = ?', (user_id,))
+
+        cursor = conn.execute(f'''
+        INSERT INTO daily_rollups (user_id, day, type, category, total, count)
+        SELECT user_id, ts / {SECONDS_PER_DAY}, type, category, SUM(amount), COUNT(*)
+        FROM operations
+        WHERE {where}
+        GROUP BY user_id, ts / {SECONDS_PER_DAY}, type, category
+        ''', params)
+        return cursor.rowcount
+
     def add_operation(self, user_id, amount, description, operation_type='expense'):
-        """Добавляет операцию в базу данных"""
-        # Используем новую функцию определения категории с учетом персональных категорий
-        category = self.detect_category(user_id, description) if operation_type == 'expense' else 'доход'
-        
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        INSERT INTO operations (user_id, amount, description, type, category)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, amount, description, operation_type, category))
-        
-        conn.commit()
-        conn.close()
-    
+        """Добавляет операцию в базу данных и возвращает присвоенную категорию"""
+        return self.add_operations(user_id, [(amount, description, operation_type)])[0]
+
+    def add_operations(self, user_id, operations):
+        """Добавляет несколько операций одной транзакцией
+
+        operations - список (amount, description, operation_type).
+        Возвращает список категорий в том же порядке.
+        """
+        # Категории расходов определяются одним сопоставителем с учетом персональных категорий
+        matcher = self.get_category_matcher(user_id)
+        categories = [
+            matcher.match(description) if operation_type == 'expense' else 'доход'
+            for amount, description, operation_type in operations
+        ]
+
+        # created_at и ts берем из одного момента времени
+        ts = int(time.time())
+        created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+        with self.connection() as conn:
+            conn.executemany('''
+            INSERT INTO operations (user_id, amount, description, type, category, created_at, ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (user_id, amount, description, operation_type, category, created_at, ts)
+                for (amount, description, operation_type), category in zip(operations, categories)
+            ])
+            # Транзакция держит запись с первой вставки, поэтому id операций идут подряд
+            last_id = conn.execute('SELECT MAX(id) FROM operations').fetchone()[0]
+            self._index_search(conn, last_id - len(operations), last_id)
+
+        return categories
+
+    def import_operations(self, user_id, operations, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+        """Загружает операции из итератора порциями
+
+        operations - итератор (amount, description, operation_type, ts), например строки
+        файла, читаемого потоком. Каждая порция категоризируется и записывается отдельной
+        транзакцией через executemany, поэтому в памяти держится только одна порция.
+        Триггер дневных итогов для порции не срабатывает: итоги и поисковый индекс
+        дополняются в той же транзакции двумя запросами на всю порцию.
+        progress(загружено) вызывается после каждой порции. Возвращает число операций.
+        """
+        matcher = self.get_category_matcher(user_id)
+        operations = iter(operations)
+        imported = 0
+
+        while True:
+            chunk = list(itertools.islice(operations, chunk_size))
+            if not chunk:
+                return imported
+
+            rows = [
+                (user_id, amount, description, operation_type,
+                 matcher.match(description) if operation_type == 'expense' else 'доход',
+                 time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts)), ts)
+                for amount, description, operation_type, ts in chunk
+            ]
+            with self.connection() as conn:
+                # Флаг для триггера дневных итогов (см. миграцию 8); виден только этой транзакции
+                conn.execute('INSERT INTO bulk_load (active) VALUES (1)')
+                conn.executemany('''
+                INSERT INTO operations (user_id, amount, description, type, category, created_at, ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                # Транзакция держит запись с первой вставки, поэтому id порции идут подряд
+                last_id = conn.execute('SELECT MAX(id) FROM operations').fetchone()[0]
+                self._index_loaded(conn, last_id - len(rows), last_id)
+                conn.execute('DELETE FROM bulk_load')
+
+            imported += len(rows)
+            if progress:
+                progress(imported)
+
+    def _index_search(self, conn, first_id, last_id):
+        """Добавляет в поисковый индекс операции с id в (first_id, last_id]"""
+        conn.execute('''
+        INSERT INTO operations_fts (rowid, terms)
+        SELECT id, search_terms(user_id, description) FROM operations
+        WHERE id > ? AND id <= ?
+        ''', (first_id, last_id))
+
+    def _unindex_search(self, conn, where, params):
+        """Убирает из поискового индекса операции, отобранные условием where
+
+        Индекс без содержимого удаляет запись только по ее исходным словам, поэтому
+        вызывается до изменения или удаления самих строк.
+        """
+        conn.execute(f'''
+        INSERT INTO operations_fts (operations_fts, rowid, terms)
+        SELECT 'delete', id, search_terms(user_id, description) FROM operations
+        WHERE {where}
+        ''', params)
+
+    def _index_loaded(self, conn, first_id, last_id):
+        """Дневные итоги и поисковый индекс для операций с id в (first_id, last_id]"""
+        self._index_search(conn, first_id, last_id)
+        conn.execute(f'''
+        INSERT INTO daily_rollups (user_id, day, type, category, total, count)
+        SELECT user_id, ts / {SECONDS_PER_DAY}, type, category, SUM(amount), COUNT(*)
+        FROM operations
+        WHERE id > ? AND id <= ? AND ts IS NOT NULL
+        GROUP BY user_id, ts / {SECONDS_PER_DAY}, type, category
+        ON CONFLICT (user_id, day, type, category)
+        DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+        ''', (first_id, last_id))
+
     def get_operations(self, user_id, limit=None):
         """Возвращает все операции пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         query = '''
-        SELECT * FROM operations 
-        WHERE user_id = ? 
-        ORDER BY created_at DESC
+        SELECT * FROM operations
+        WHERE user_id = ?
+        ORDER BY ts DESC, id DESC
         '''
-        
-        if limit:
-            query += ' LIMIT ?'
-            cursor.execute(query, (user_id, limit))
+
+        with self.connection() as conn:
+            if limit:
+                query += ' LIMIT ?'
+                cursor = conn.execute(query, (user_id, limit))
+            else:
+                cursor = conn.execute(query, (user_id,))
+
+            return [dict(row) for row in cursor.fetchall()]
+
+    def iter_operations(self, user_id, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE):
+        """Перебирает операции пользователя за период от старых к новым
+
+        Генератор: операции читаются порциями по курсору (ts, id), в памяти
+        только одна порция, а соединение возвращается в пул между порциями.
+        Выдает sqlite3.Row с полями id, ts, created_at, type, amount, category, description.
+        """
+        where, params = self._period_filter(user_id, start, end)
+        cursor_key = ()
+
+        while True:
+            condition = where + ' AND (ts, id) > (?, ?)' if cursor_key else where
+            with self.connection() as conn:
+                rows = conn.execute(f'''
+                SELECT id, ts, created_at, type, amount, category, description FROM operations
+                WHERE {condition}
+                ORDER BY ts, id
+                LIMIT ?
+                ''', [*params, *cursor_key, chunk_size]).fetchall()
+
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            cursor_key = (rows[-1]['ts'], rows[-1]['id'])
+
+    def search_operations(self, user_id, text, start=None, end=None, limit=10, before=None, after=None):
+        """Страница операций, в описании которых есть все слова из text (по началу слова)
+
+        Пагинация и результат такие же, как у get_operations_page.
+        """
+        match = search_match(user_id, text)
+        if match is None:
+            return {'operations': [], 'has_newer': False, 'has_older': False}
+
+        where, params = self._search_filter(match, start, end)
+        if after is not None:
+            where += ' AND (o.ts, o.id) > (?, ?)'
+            params += [after[0], after[1]]
+            order = 'o.ts ASC, o.id ASC'
+        else:
+            if before is not None:
+                where += ' AND (o.ts, o.id) < (?, ?)'
+                params += [before[0], before[1]]
+            order = 'o.ts DESC, o.id DESC'
+
+        with self.connection() as conn:
+            rows = [dict(row) for row in conn.execute(f'''
+            SELECT o.* FROM operations_fts
+            JOIN operations o ON o.id = operations_fts.rowid
+            WHERE {where}
+            ORDER BY {order}
+            LIMIT ?
+            ''', params + [limit + 1]).fetchall()]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after is not None:
+            return {'operations': rows[::-1], 'has_newer': has_more, 'has_older': True}
+        return {'operations': rows, 'has_newer': before is not None, 'has_older': has_more}
+
+    def search_totals(self, user_id, text, start=None, end=None):
+        """Сколько операций нашлось по text и на какие суммы: {'count', 'income', 'expenses'}"""
+        match = search_match(user_id, text)
+        if match is None:
+            return {'count': 0, 'income': 0, 'expenses': 0}
+
+        where, params = self._search_filter(match, start, end)
+        with self.connection() as conn:
+            row = conn.execute(f'''
+            SELECT COUNT(*) AS count,
+                   COALESCE(SUM(CASE WHEN o.type = 'income' THEN o.amount END), 0) AS income,
+                   COALESCE(SUM(CASE WHEN o.type = 'expense' THEN o.amount END), 0) AS expenses
+            FROM operations_fts
+            JOIN operations o ON o.id = operations_fts.rowid
+            WHERE {where}
+            ''', params).fetchone()
+        return dict(row)
+
+    def _search_filter(self, match, start=None, end=None):
+        """Условие WHERE для поиска: совпадение в индексе и период по ts"""
+        conditions = ['operations_fts MATCH ?']
+        params = [match]
+        if start is not None:
+            conditions.append('o.ts >= ?')
+            params.append(to_timestamp(start))
+        if end is not None:
+            conditions.append('o.ts < ?')
+            params.append(to_timestamp(end))
+        return ' AND '.join(conditions), params
+
+    def get_operations_page(self, user_id, limit=10, before=None, after=None, start=None, end=None, filters=None):
+        """Возвращает страницу операций с keyset-пагинацией по курсору (ts, id)
+
+        before - курсор последней операции предыдущей страницы (листаем к старым),
+        after - курсор первой операции следующей страницы (листаем к новым).
+        start/end и filters (см. _period_filter) ограничивают выборку.
+        Результат: {'operations': [...], 'has_newer': bool, 'has_older': bool}
+        """
+        query, params = self._operations_page_query(user_id, limit, before, after, start, end, filters)
+        with self.connection() as conn:
+            rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+
+        if after is not None:
+            # Брали ближайшие более новые операции - разворачиваем в обычный порядок
+            has_newer = len(rows) > limit
+            operations = rows[:limit][::-1]
+            has_older = True
         else:
-            cursor.execute(query, (user_id,))
-        
-        operations = []
-        for row in cursor.fetchall():
-            operations.append(dict(row))
-        
-        conn.close()
-        return operations
-    
-    def get_monthly_operations(self, user_id, year=None, month=None):
-        """Возвращает операции за конкретный месяц"""
+            has_older = len(rows) > limit
+            operations = rows[:limit]
+            has_newer = before is not None
+
+        return {
+            'operations': operations,
+            'has_newer': has_newer,
+            'has_older': has_older
+        }
+
+    def _operations_page_query(self, user_id, limit, before=None, after=None, start=None, end=None, filters=None):
+        """Запрос страницы операций (limit + 1 строка, чтобы узнать, есть ли следующая)"""
+        where, params = self._period_filter(user_id, start, end, filters)
+        if after is not None:
+            where += ' AND (ts, id) > (?, ?)'
+            params += [after[0], after[1]]
+            order = 'ts ASC, id ASC'
+        else:
+            if before is not None:
+                where += ' AND (ts, id) < (?, ?)'
+                params += [before[0], before[1]]
+            order = 'ts DESC, id DESC'
+
+        query = f'''
+        SELECT * FROM operations
+        WHERE {where}
+        ORDER BY {order}
+        LIMIT ?
+        '''
+        return query, params + [limit + 1]
+
+    def get_monthly_operations(self, user_id, year=None, month=None, tz=None):
+        """Возвращает операции за конкретный месяц (в часовом поясе tz)"""
         if year is None or month is None:
-            now = datetime.now()
+            now = datetime.now(tz or timezone.utc)
             year, month = now.year, now.month
-        
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT * FROM operations 
-        WHERE user_id = ? 
-        AND strftime('%Y', created_at) = ? 
-        AND strftime('%m', created_at) = ?
-        ORDER BY created_at DESC
-        ''', (user_id, str(year), str(month).zfill(2)))
-        
-        operations = []
-        for row in cursor.fetchall():
-            operations.append(dict(row))
-        
-        conn.close()
-        return operations
-    
+
+        where, params = self._period_filter(user_id, *month_range(year, month, tz))
+
+        with self.connection() as conn:
+            cursor = conn.execute(f'''
+            SELECT * FROM operations
+            WHERE {where}
+            ORDER BY ts DESC, id DESC
+            ''', params)
+
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_monthly_totals(self, user_id, months=6, tz=None):
+        """Возвращает доходы и расходы по месяцам за последние N месяцев
+
+        Месяцы считаются в часовом поясе tz. Каждый месяц - отдельный диапазон ts:
+        целые сутки UTC из daily_rollups и края месяца (если полночь пользователя
+        не совпадает с полночью UTC) из operations, всё по индексам. Диапазоны
+        всех месяцев объединяются через UNION ALL в один запрос.
+        Результат упорядочен от текущего месяца к старым:
+        {(год, месяц): {'income': ..., 'expenses': ...}}
+        """
+        now = datetime.now(tz or timezone.utc)
+        year, month = now.year, now.month
+
+        # Заполняем все месяцы нулями, чтобы в графике не было пропусков
+        monthly_totals = {}
+        for _ in range(months):
+            monthly_totals[(year, month)] = {'income': 0, 'expenses': 0}
+            month -= 1
+            if month == 0:
+                month = 12
+                year -= 1
+
+        keys = list(monthly_totals)
+        parts = []
+        params = []
+        for index, (year, month) in enumerate(keys):
+            source, source_params = self._rollup_source(user_id, *month_range(year, month, tz))
+            parts.append(f'''
+            SELECT {index} AS month, type, SUM(total) AS total FROM ({source})
+            GROUP BY type
+            ''')
+            params.extend(source_params)
+
+        with self.connection() as conn:
+            rows = conn.execute(' UNION ALL '.join(parts), params).fetchall()
+
+        for row in rows:
+            totals = monthly_totals[keys[row['month']]]
+            if row['type'] == 'income':
+                totals['income'] += row['total']
+            else:
+                totals['expenses'] += row['total']
+
+        return monthly_totals
+
     def clear_operations(self, user_id):
         """Удаляет все операции пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        DELETE FROM operations WHERE user_id = ?
-        ''', (user_id,))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_user_statistics(self, user_id):
-        """Возвращает базовую статистику пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Общее количество операций
-        cursor.execute('SELECT COUNT(*) FROM operations WHERE user_id = ?', (user_id,))
-        total_operations = cursor.fetchone()[0]
-        
-        # Сумма доходов
-        cursor.execute('SELECT SUM(amount) FROM operations WHERE user_id = ? AND type = ?', 
-                      (user_id, 'income'))
-        total_income = cursor.fetchone()[0] or 0
-        
-        # Сумма расходов
-        cursor.execute('SELECT SUM(amount) FROM operations WHERE user_id = ? AND type = ?', 
-                      (user_id, 'expense'))
-        total_expenses = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        
+        with self.connection() as conn:
+            self._unindex_search(conn, 'user_id = ?', (user_id,))
+            conn.execute('''
+            DELETE FROM operations WHERE user_id = ?
+            ''', (user_id,))
+
+    def get_user_statistics(self, user_id, start=None, end=None, filters=None):
+        """Возвращает базовую статистику пользователя (за все время или за период)"""
+        source, params = self._rollup_source(user_id, start, end, filters)
+
+        with self.connection() as conn:
+            # Количество операций и суммы доходов/расходов одним запросом
+            row = conn.execute(f'''
+            SELECT SUM(count),
+                   SUM(CASE WHEN type = 'income' THEN total ELSE 0 END),
+                   SUM(CASE WHEN type = 'expense' THEN total ELSE 0 END)
+            FROM ({source})
+            ''', params).fetchone()
+
+        total_operations = row[0] or 0
+        total_income = row[1] or 0
+        total_expenses = row[2] or 0
+
         return {
             'total_operations': total_operations,
             'total_income': total_income,
@@ -157,98 +935,284 @@ class Database:
             'balance': total_income - total_expenses
         }
 
+    def get_expenses_by_category(self, user_id, start=None, end=None, filters=None):
+        """Возвращает расходы по категориям: {категория: (сумма, количество)}
+
+        start/end - необязательные границы периода (datetime, конец не включается),
+        filters - условия на операции (см. _period_filter)
+        """
+        source, params = self._rollup_source(user_id, start, end, filters)
+
+        with self.connection() as conn:
+            cursor = conn.execute(f'''
+            SELECT category, SUM(total) AS total, SUM(count) AS count
+            FROM ({source})
+            WHERE type = 'expense'
+            GROUP BY category
+            ORDER BY total DESC
+            ''', params)
+
+            return {row['category']: (row['total'], row['count']) for row in cursor.fetchall()}
+
+    def _period_filter(self, user_id, start=None, end=None, filters=None):
+        """Собирает условие WHERE по пользователю, периоду и фильтрам
+
+        filters - словарь с необязательными operation_type, category, min_amount
+        и max_amount (см. filters.OperationFilter.conditions). Тип и категория
+        идут равенствами сразу после user_id, чтобы запрос шел по индексам
+        (user_id, category, ts) и (user_id, type, ts); суммы проверяются на найденных строках.
+        """
+        conditions = ['user_id = ?']
+        params = [user_id]
+
+        filters = filters or {}
+        if filters.get('operation_type') is not None:
+            conditions.append('type = ?')
+            params.append(filters['operation_type'])
+        if filters.get('category') is not None:
+            conditions.append('category = ?')
+            params.append(filters['category'])
+        if filters.get('min_amount') is not None:
+            conditions.append('amount >= ?')
+            params.append(filters['min_amount'])
+        if filters.get('max_amount') is not None:
+            conditions.append('amount <= ?')
+            params.append(filters['max_amount'])
+
+        # Сравниваем с ts, чтобы запрос шел диапазоном по индексу (user_id, ts)
+        if start is not None:
+            conditions.append('ts >= ?')
+            params.append(to_timestamp(start))
+        if end is not None:
+            conditions.append('ts < ?')
+            params.append(to_timestamp(end))
+
+        return ' AND '.join(conditions), params
+
+    def _rollup_source(self, user_id, start=None, end=None, filters=None):
+        """Собирает подзапрос с итогами (day, type, category, total, count) за период
+
+        Целые сутки берутся из daily_rollups, а неполные сутки на краях периода
+        досчитываются по operations - это два коротких диапазона по индексу.
+        В дневных итогах нет отдельных сумм, поэтому с фильтром по сумме
+        итоги считаются по operations целиком (диапазоном по индексу).
+        """
+        filters = filters or {}
+        if filters.get('min_amount') is not None or filters.get('max_amount') is not None:
+            where, params = self._period_filter(user_id, start, end, filters)
+            return f'''
+            SELECT ts / {SECONDS_PER_DAY} AS day, type, category, SUM(amount) AS total, COUNT(*) AS count
+            FROM operations
+            WHERE {where}
+            GROUP BY day, type, category
+            ''', params
+
+        # Тип и категория есть и в daily_rollups, и в operations - добавляем в каждую часть
+        extra_conditions = ''
+        extra_params = []
+        if filters.get('operation_type') is not None:
+            extra_conditions += ' AND type = ?'
+            extra_params.append(filters['operation_type'])
+        if filters.get('category') is not None:
+            extra_conditions += ' AND category = ?'
+            extra_params.append(filters['category'])
+
+        start_ts = to_timestamp(start) if start is not None else None
+        end_ts = to_timestamp(end) if end is not None else None
+
+        # Первые и последние (не включительно) целые сутки периода
+        first_day = -(-start_ts // SECONDS_PER_DAY) if start_ts is not None else None
+        last_day = end_ts // SECONDS_PER_DAY if end_ts is not None else None
+
+        if first_day is not None and last_day is not None and first_day >= last_day:
+            # Период короче суток: считаем только по операциям
+            raw_ranges = [(start_ts, end_ts)]
+            rollup_range = None
+        else:
+            raw_ranges = []
+            if start_ts is not None and start_ts < first_day * SECONDS_PER_DAY:
+                raw_ranges.append((start_ts, first_day * SECONDS_PER_DAY))
+            if end_ts is not None and last_day * SECONDS_PER_DAY < end_ts:
+                raw_ranges.append((last_day * SECONDS_PER_DAY, end_ts))
+            rollup_range = (first_day, last_day)
+
+        parts = []
+        params = []
+
+        if rollup_range is not None:
+            conditions = ['user_id = ?']
+            params.append(user_id)
+            if rollup_range[0] is not None:
+                conditions.append('day >= ?')
+                params.append(rollup_range[0])
+            if rollup_range[1] is not None:
+                conditions.append('day < ?')
+                params.append(rollup_range[1])
+            parts.append(f'''
+            SELECT day, type, category, total, count FROM daily_rollups
+            WHERE {' AND '.join(conditions)}{extra_conditions}
+            ''')
+            params.extend(extra_params)
+
+        for range_start, range_end in raw_ranges:
+            parts.append(f'''
+            SELECT ts / {SECONDS_PER_DAY} AS day, type, category, SUM(amount) AS total, COUNT(*) AS count
+            FROM operations
+            WHERE user_id = ? AND ts >= ? AND ts < ?{extra_conditions}
+            GROUP BY day, type, category
+            ''')
+            params.extend([user_id, range_start, range_end, *extra_params])
+
+        return ' UNION ALL '.join(parts), params
+
     # НОВЫЕ МЕТОДЫ ДЛЯ РАБОТЫ С ПЕРСОНАЛЬНЫМИ КАТЕГОРИЯМИ
 
     def add_user_category(self, user_id, category_name, keywords):
         """Добавляет персональную категорию для пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('''
-            INSERT INTO user_categories (user_id, category_name, keywords)
-            VALUES (?, ?, ?)
-            ''', (user_id, category_name, keywords))
-            conn.commit()
+            with self.connection() as conn:
+                conn.execute('''
+                INSERT INTO user_categories (user_id, category_name, keywords)
+                VALUES (?, ?, ?)
+                ''', (user_id, category_name, keywords))
+            self._invalidate_category_matcher(user_id)
             return True
         except sqlite3.IntegrityError:
             # Категория уже существует
             return False
-        finally:
-            conn.close()
 
     def get_user_categories(self, user_id):
         """Возвращает все категории пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT category_name, keywords FROM user_categories 
-        WHERE user_id = ?
-        ''', (user_id,))
-        
+        with self.connection() as conn:
+            cursor = conn.execute('''
+            SELECT category_name, keywords FROM user_categories
+            WHERE user_id = ?
+            ''', (user_id,))
+            rows = cursor.fetchall()
+
         categories = {}
-        for row in cursor.fetchall():
+        for row in rows:
             # Разделяем ключевые слова по запятой и убираем пробелы
             keywords_list = [kw.strip() for kw in row['keywords'].split(',')]
             categories[row['category_name']] = keywords_list
-        
-        conn.close()
+
         return categories
 
     def delete_user_category(self, user_id, category_name):
         """Удаляет категорию пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        DELETE FROM user_categories 
-        WHERE user_id = ? AND category_name = ?
-        ''', (user_id, category_name))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            conn.execute('''
+            DELETE FROM user_categories
+            WHERE user_id = ? AND category_name = ?
+            ''', (user_id, category_name))
+        self._invalidate_category_matcher(user_id)
         return True
 
     def detect_category(self, user_id, description):
         """Определяет категорию с учетом персональных категорий пользователя"""
-        description_lower = description.lower()
-        
-        # Сначала проверяем персональные категории пользователя
-        user_categories = self.get_user_categories(user_id)
-        for category, keywords in user_categories.items():
-            for keyword in keywords:
-                if keyword.strip().lower() in description_lower:
-                    return category
-        
-        # Если не нашли в персональных, проверяем стандартные категории
-        return detect_standard_category(description)
+        # Персональные категории проверяются раньше стандартных
+        return self.get_category_matcher(user_id).match(description)
+
+    def recategorize_operations(self, user_id, chunk_size=RECATEGORIZE_CHUNK_SIZE, progress=None):
+        """Заново определяет категории всех расходов пользователя по текущим правилам
+
+        Расходы читаются порциями по курсору (ts, id), изменившиеся категории
+        записываются через executemany отдельной транзакцией на каждую порцию,
+        поэтому база не блокируется на все время пересчета.
+        progress(обработано, всего, изменено) вызывается после каждой порции.
+        """
+        matcher = self.get_category_matcher(user_id)
+        total = sum(count for total_amount, count in self.get_expenses_by_category(user_id).values())
+
+        processed = 0
+        changed = 0
+        cursor_key = None
+
+        while True:
+            with self.connection() as conn:
+                if cursor_key is None:
+                    rows = conn.execute('''
+                    SELECT id, ts, description, category FROM operations
+                    WHERE user_id = ? AND type = 'expense'
+                    ORDER BY ts, id
+                    LIMIT ?
+                    ''', (user_id, chunk_size)).fetchall()
+                else:
+                    rows = conn.execute('''
+                    SELECT id, ts, description, category FROM operations
+                    WHERE user_id = ? AND type = 'expense' AND (ts, id) > (?, ?)
+                    ORDER BY ts, id
+                    LIMIT ?
+                    ''', (user_id, cursor_key[0], cursor_key[1], chunk_size)).fetchall()
+
+                if not rows:
+                    break
+
+                updates = []
+                for row in rows:
+                    category = matcher.match(row['description'])
+                    if category != row['category']:
+                        updates.append((category, row['id']))
+
+                if updates:
+                    conn.executemany('UPDATE operations SET category = ? WHERE id = ?', updates)
+
+            processed += len(rows)
+            changed += len(updates)
+            cursor_key = (rows[-1]['ts'], rows[-1]['id'])
+
+            if progress is not None:
+                progress(processed, max(total, processed), changed)
+
+        return {'processed': processed, 'changed': changed}
+
+    def get_category_matcher(self, user_id):
+        """Возвращает CategoryMatcher пользователя из кеша или строит его"""
+        with self._matchers_lock:
+            matcher = self._matchers.get(user_id)
+            if matcher is not None:
+                self._matchers.move_to_end(user_id)
+                return matcher
+            generation = self._matchers_generation
+
+        matcher = CategoryMatcher(self.get_user_categories(user_id))
+
+        with self._matchers_lock:
+            # Если категории успели измениться во время построения, не кешируем
+            if generation == self._matchers_generation:
+                self._matchers[user_id] = matcher
+                self._matchers.move_to_end(user_id)
+                while len(self._matchers) > CATEGORY_CACHE_SIZE:
+                    self._matchers.popitem(last=False)
+
+        return matcher
+
+    def _invalidate_category_matcher(self, user_id):
+        """Сбрасывает кеш категорий пользователя после изменения его категорий"""
+        with self._matchers_lock:
+            self._matchers.pop(user_id, None)
+            self._matchers_generation += 1
 
     def get_all_categories(self, user_id):
         """Возвращает все категории пользователя (персональные + стандартные)"""
         # Персональные категории
         personal_categories = self.get_user_categories(user_id)
-        
+
         # Стандартные категории
         from categories import CATEGORIES
         standard_categories = CATEGORIES
-        
+
         # Объединяем (персональные имеют приоритет в отображении)
         all_categories = {**personal_categories, **standard_categories}
         return all_categories
 
     # === ДОБАВЛЕНО: МЕТОДЫ ДЛЯ РЕДАКТИРОВАНИЯ ОПЕРАЦИЙ ===
-    
+
     def get_operation_by_id(self, operation_id):
         """Возвращает операцию по ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM operations WHERE id = ?', (operation_id,))
-        row = cursor.fetchone()
-        
-        conn.close()
-        
+        with self.connection() as conn:
+            row = conn.execute('SELECT * FROM operations WHERE id = ?', (operation_id,)).fetchone()
+
         if row:
             return dict(row)
         else:
@@ -256,12 +1220,9 @@ class Database:
 
     def update_operation(self, operation_id, amount=None, description=None, operation_type=None, category=None):
         """Обновляет операцию"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         updates = []
         params = []
-        
+
         if amount is not None:
             updates.append("amount = ?")
             params.append(amount)
@@ -274,42 +1235,103 @@ class Database:
         if category is not None:
             updates.append("category = ?")
             params.append(category)
-        
+
         if not updates:
-            conn.close()
             return False
-        
+
         params.append(operation_id)
         query = f"UPDATE operations SET {', '.join(updates)} WHERE id = ?"
-        
+
         try:
-            cursor.execute(query, params)
-            conn.commit()
-            success = True
+            with self.connection() as conn:
+                # Слова в индексе зависят только от описания (и владельца)
+                if description is not None:
+                    self._unindex_search(conn, 'id = ?', (operation_id,))
+                conn.execute(query, params)
+                if description is not None:
+                    self._index_search(conn, operation_id - 1, operation_id)
+            return True
         except Exception as e:
             print(f"Ошибка при обновлении операции: {e}")
-            success = False
-        finally:
-            conn.close()
-        
-        return success
+            return False
+
+    def get_user_timezone(self, user_id):
+        """Часовой пояс пользователя (имя из periods.parse_timezone) или None, если не выбран"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT timezone FROM user_settings WHERE user_id = ?', (user_id,)).fetchone()
+        return row['timezone'] if row else None
+
+    def set_user_timezone(self, user_id, timezone_name):
+        """Сохраняет часовой пояс пользователя"""
+        with self.connection() as conn:
+            conn.execute('''
+            INSERT INTO user_settings (user_id, timezone) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET timezone = excluded.timezone
+            ''', (user_id, timezone_name))
+
+    def save_edit_state(self, user_id, state, expires_at):
+        """Сохраняет состояние редактирования пользователя"""
+        with self.connection() as conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO edit_states (user_id, action, operation_id, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, state['action'], state['operation_id'], state['timestamp'], expires_at))
+
+    def delete_edit_states(self, user_ids):
+        """Удаляет состояния редактирования пользователей"""
+        with self.connection() as conn:
+            conn.executemany('DELETE FROM edit_states WHERE user_id = ?', [(user_id,) for user_id in user_ids])
+
+    def load_edit_states(self, now):
+        """Удаляет истекшие состояния и возвращает [(user_id, state, expires_at)] для остальных"""
+        with self.connection() as conn:
+            conn.execute('DELETE FROM edit_states WHERE expires_at <= ?', (now,))
+            rows = conn.execute('''
+            SELECT user_id, action, operation_id, created_at, expires_at FROM edit_states
+            ''').fetchall()
+
+        return [
+            (row['user_id'],
+             {'action': row['action'], 'operation_id': row['operation_id'], 'timestamp': row['created_at']},
+             row['expires_at'])
+            for row in rows
+        ]
 
     def delete_operation(self, operation_id):
         """Удаляет операцию"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('DELETE FROM operations WHERE id = ?', (operation_id,))
-            conn.commit()
-            success = True
+            with self.connection() as conn:
+                self._unindex_search(conn, 'id = ?', (operation_id,))
+                conn.execute('DELETE FROM operations WHERE id = ?', (operation_id,))
+            return True
         except Exception as e:
             print(f"Ошибка при удалении операции: {e}")
-            success = False
-        finally:
-            conn.close()
-        
-        return success
+            return False
+
+# Создаем глобальный экземпляр базы данных. Схема создается при запуске бота
+# (db.init_database()), чтобы импорт модуля не обращался к диску
+db = Database(initialize=False)
+
+# Обслуживание базы из командной строки: python sqlite_database.py --rebuild-rollups
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных финансового бота")
+    parser.add_argument('--db', default=db.db_name, help="путь к файлу базы данных")
+    parser.add_argument('--rebuild-rollups', action='store_true', help="пересчитать дневные итоги")
+    parser.add_argument('--rebuild-search', action='store_true', help="построить заново поисковый индекс")
+    parser.add_argument('--user-id', type=int, help="ограничить действие одним пользователем")
+    args = parser.parse_args()
 
-# Создаем глобальный экземпляр базы данных
-db = Database()
\ No newline at end of file
+    maintenance_db = db if args.db == db.db_name else Database(args.db)
+    try:
+        if args.rebuild_rollups:
+            maintenance_db.rebuild_rollups(args.user_id)
+        if args.rebuild_search:
+            maintenance_db.rebuild_search_index()
+        if not (args.rebuild_rollups or args.rebuild_search):
+            parser.print_help()
+    finally:
+        maintenance_db.close()
+        if maintenance_db is not db:
+            db.close()
\ No newline at end of file
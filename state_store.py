@@ -0,0 +1,114 @@
+# state_store.py
+# Хранилище состояний пользователей с истечением по времени (редактирование операций,
+# ожидание файла /import, страницы поиска и списков с фильтром): поиск по словарю,
+# истекшие записи снимаются с вершины кучи, размер ограничен
+import heapq
+import itertools
+import threading
+import time
+
+STATE_STORE_MAX_USERS = 100000  # Сколько пользователей с состоянием держать одновременно
+
+
+class TTLStateStore:
+    """Состояния по user_id с TTL и ограничением размера
+
+    Каждая запись попадает в кучу по времени истечения. Устаревшие элементы
+    кучи (запись перезаписана или удалена) пропускаются при снятии, поэтому
+    get/set/clear стоят O(1) плюс амортизированное O(log n) на истечение.
+
+    Если передан persist (Database, таблица edit_states), записи сохраняются в SQLite и
+    загружаются при первом обращении после перезапуска. Чтение всегда идет
+    из памяти, в базу пишутся только изменения.
+    """
+
+    def __init__(self, ttl, max_size=STATE_STORE_MAX_USERS, persist=None, clock=time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.persist = persist
+        self.clock = clock
+        self._states = {}   # user_id -> (state, expires_at, version)
+        self._heap = []     # (expires_at, version, user_id)
+        self._versions = itertools.count()
+        self._lock = threading.Lock()
+        self._loaded = persist is None
+
+    def get(self, user_id):
+        """Возвращает состояние пользователя или None, если его нет или оно истекло"""
+        self._ensure_loaded()
+        with self._lock:
+            self._forget(self._expire())
+            entry = self._states.get(user_id)
+            return entry[0] if entry is not None else None
+
+    def set(self, user_id, state):
+        """Сохраняет состояние пользователя на ttl секунд"""
+        self._ensure_loaded()
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            self._put(user_id, state, expires_at)
+            expired = self._expire()
+            # При переполнении вытесняем записи, которые истекут раньше всех
+            while len(self._states) > self.max_size:
+                expired.append(self._pop_earliest())
+            if self.persist is not None:
+                self.persist.save_edit_state(user_id, state, expires_at)
+            self._forget(expired)
+
+    def clear(self, user_id):
+        """Удаляет состояние пользователя"""
+        self._ensure_loaded()
+        with self._lock:
+            if self._states.pop(user_id, None) is not None:
+                self._forget([user_id])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._states)
+
+    def _put(self, user_id, state, expires_at):
+        version = next(self._versions)
+        self._states[user_id] = (state, expires_at, version)
+        heapq.heappush(self._heap, (expires_at, version, user_id))
+
+        # Перезаписанные и удаленные записи остаются в куче; чистим ее, если их стало много
+        if len(self._heap) > 2 * len(self._states) + 64:
+            self._heap = [(entry[1], entry[2], uid) for uid, entry in self._states.items()]
+            heapq.heapify(self._heap)
+
+    def _expire(self):
+        """Снимает с кучи истекшие записи; возвращает user_id удаленных"""
+        now = self.clock()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, version, user_id = heapq.heappop(self._heap)
+            entry = self._states.get(user_id)
+            if entry is not None and entry[2] == version:
+                del self._states[user_id]
+                expired.append(user_id)
+        return expired
+
+    def _pop_earliest(self):
+        """Удаляет запись с ближайшим временем истечения"""
+        while True:
+            expires_at, version, user_id = heapq.heappop(self._heap)
+            entry = self._states.get(user_id)
+            if entry is not None and entry[2] == version:
+                del self._states[user_id]
+                return user_id
+
+    def _forget(self, user_ids):
+        """Удаляет записи из базы (вызывается под блокировкой, чтобы не обогнать set)"""
+        if user_ids and self.persist is not None:
+            self.persist.delete_edit_states(user_ids)
+
+    def _ensure_loaded(self):
+        """Загружает сохраненные состояния при первом обращении"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for user_id, state, expires_at in self.persist.load_edit_states(self.clock()):
+                self._put(user_id, state, expires_at)
+            self._loaded = True
@@ -1,29 +1,100 @@
-from datetime import datetime
-import telebot
 import time
-from sqlite_database import db
-from categories import CATEGORIES, detect_category
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+STARTUP_BEGAN = time.perf_counter()  # Начало импорта - для отчета о времени запуска
 
 import os
 from dotenv import load_dotenv
 
-# Загружаем переменные из .env файла (для локальной разработки)
-load_dotenv()
+# Загружаем переменные из .env файла (для локальной разработки) - до импорта
+# модулей, которые читают настройки из окружения. Только при запуске скрипта:
+# процессы пула графиков заново выполняют этот файл как __mp_main__ (см. chart_service.py),
+# им окружение уже передано, а бот в них не создается
+if __name__ == "__main__":
+    load_dotenv()
 
-# Безопасное получение токена
-API_TOKEN = os.getenv('BOT_TOKEN') or os.environ.get('BOT_TOKEN')
+from datetime import datetime, timedelta
+import telebot
+import threading
+import traceback
+import html
+import requests
+import random
+import secrets
+import signal
+import zoneinfo
+from sqlite_database import db, search_words
+from categories import CATEGORIES, detect_category
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-if not API_TOKEN:
-    raise ValueError("BOT_TOKEN не найден! Проверьте .env файл или переменные окружения на Railway")
+# Безопасное получение токена (наличие проверяет main())
+API_TOKEN = os.getenv('BOT_TOKEN') or os.environ.get('BOT_TOKEN')
 
-import charts  # Для визуальной статистики
+from chart_service import chart_service, chart_key, ChartServiceError, CHART_WARMUP  # Для визуальной статистики
+from chart_cache import chart_cache
+from callback_router import CallbackRouter, CallbackPayloadError
+from dispatcher import UpdateDispatcher
+from state_store import TTLStateStore
+from outbound import Outbox
+from exporter import export_operations, ExportError, EXPORT_FORMATS, xlsx_available
+from periods import (parse_period, PeriodError, PERIOD_HELP,
+                     parse_timezone, get_timezone, TimezoneError, DEFAULT_TIMEZONE)
+from filters import parse_filter, FilterError, FILTER_HELP
+from csv_import import CsvImporter, CsvImportError, open_text, parse_options as parse_import_options
+from webhook_server import WebhookServer, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS
 
 # Отключаем предупреждения matplotlib
 import warnings
 warnings.filterwarnings("ignore")
 
-bot = telebot.TeleBot(API_TOKEN)
+# Способ получения обновлений: polling (по умолчанию) или webhook (см. webhook_server.py)
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+if RUN_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"Неизвестный RUN_MODE={RUN_MODE}, доступны: polling, webhook")
+
+# Паузы между переподключениями polling: растут вдвое от MIN до MAX, с
+POLLING_BACKOFF_MIN = float(os.getenv('POLLING_BACKOFF_MIN', '1'))
+POLLING_BACKOFF_MAX = float(os.getenv('POLLING_BACKOFF_MAX', '300'))
+
+# Свой пул потоков telebot не нужен: обновления раздает диспетчер (см. ниже)
+bot = telebot.TeleBot(API_TOKEN, threaded=False)
+
+# Обработчики inline-кнопок регистрируются декораторами @callbacks.route / @callbacks.prefix
+CALLBACK_SLOW_SECONDS = float(os.getenv('CALLBACK_SLOW_SECONDS', '1'))
+callbacks = CallbackRouter(slow_threshold=CALLBACK_SLOW_SECONDS)
+
+# Команды и кнопки, которые обрабатываются в медленной полосе диспетчера
+SLOW_COMMANDS = {'chart', 'history', 'export'}
+SLOW_CALLBACKS = {'show_chart', 'show_history'}
+
+def is_slow_update(update):
+    """Отправлять ли обновление в медленную полосу (графики, импорт файлов и т.п.)"""
+    message = update.message
+    if message is not None and message.content_type == 'document':
+        return True
+    if message is not None and message.text and message.text.startswith('/'):
+        command = message.text.split()[0][1:].split('@')[0]
+        return command in SLOW_COMMANDS
+    if update.callback_query is not None:
+        return update.callback_query.data in SLOW_CALLBACKS
+    return False
+
+# Обновления обрабатываются в потоках диспетчера: по порядку для каждого
+# пользователя и параллельно для разных пользователей
+process_updates = bot.process_new_updates
+dispatcher = UpdateDispatcher(lambda update: process_updates([update]), is_slow=is_slow_update)
+
+def dispatch_updates(updates):
+    """Принимает пачку обновлений от polling или webhook и раздает их диспетчеру"""
+    for update in updates:
+        # Смещение следующего getUpdates сдвигаем сразу, не дожидаясь обработки
+        if update.update_id > bot.last_update_id:
+            bot.last_update_id = update.update_id
+        dispatcher.submit(update)
+
+bot.process_new_updates = dispatch_updates
+
+# Ответы обработчиков отправляются в фоне с учетом лимитов Telegram (см. outbound.py);
+# подтверждения нажатий (answer_callback_query) отправляются сразу - у них нет лимита на чат
+outbox = Outbox(bot)
 
 # === ДОБАВЛЕНО: Константы для редактирования операций ===
 EDIT_OPERATION_PREFIX = "edit_op_"
@@ -35,34 +106,168 @@ EDIT_TYPE_PREFIX = "edit_type_"
 EDIT_CATEGORY_PREFIX = "edit_category_"
 SET_CATEGORY_PREFIX = "set_category_"
 
+# Пагинация списка операций: курсор (ts, id) передается в callback_data
+LIST_OLDER_PREFIX = "list_older_"
+LIST_NEWER_PREFIX = "list_newer_"
+OPERATIONS_PER_PAGE = 10
+
+# Поиск по описаниям: запрос хранится в search_sessions, в кнопках только курсор
+SEARCH_OLDER_PREFIX = "search_older_"
+SEARCH_NEWER_PREFIX = "search_newer_"
+# Список с фильтрами (/list cat:транспорт >5000): фильтр хранится в list_filters
+FILTER_OLDER_PREFIX = "filter_older_"
+FILTER_NEWER_PREFIX = "filter_newer_"
+
+# Массовый пересчет категорий прошлых расходов
+RECATEGORIZE_CALLBACK = "recategorize"
+PROGRESS_UPDATE_INTERVAL = 2  # Как часто (сек) обновлять сообщение с прогрессом
+recategorize_jobs = set()
+recategorize_jobs_lock = threading.Lock()
+
+# Настройки графика истории
+HISTORY_DEFAULT_MONTHS = 6
+HISTORY_MAX_MONTHS = 120
+CAPTION_LIMIT = 1024  # Максимальная длина подписи к фото в Telegram
+
+# Импорт операций из CSV
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # Bot API отдает боту файлы не больше 20 МБ
+IMPORT_DOWNLOAD_TIMEOUT = 60
+
+# Несколько операций в одном сообщении: по строкам или через ";"
+BATCH_MAX_ENTRIES = 200    # Больше записей в одном сообщении не принимаем
+BATCH_SUMMARY_LINES = 30   # Сколько записей перечислять в ответе
+
+# Тексты, которые показываются и по командам, и по кнопкам
+WELCOME_TEXT = """
+💼 <b>Бот для учета финансов</b>
+
+<b>Добавить трату:</b>
+<code>500 еда</code>
+<code>1500 бензин</code>
+
+<b>Добавить доход:</b>
+<code>+50000 зарплата</code>
+
+<b>Несколько операций сразу</b> - каждая с новой строки или через <code>;</code>:
+<code>500 еда; 300 такси; +1000 кешбэк</code>
+
+<b>📂 Персональные категории:</b>
+<code>/add_category Еда продукты,магазин</code>
+<code>/my_categories</code>
+<code>/delete_category Еда</code>
+<code>/recategorize</code> - применить категории к прошлым расходам
+
+<b>📊 Визуальная статистика:</b>
+<code>/chart</code> - диаграмма расходов (<code>/chart месяц vs</code> - сравнение с прошлым)
+<code>/history</code> - история по месяцам (<code>/history 12</code> - за год)
+
+<b>📈 Команды:</b>
+/list - все операции (<code>/list cat:транспорт &gt;5000 2025-Q3</code>)
+/search - поиск по описанию (<code>/search такси год</code>)
+/balance - баланс  
+/stats - статистика (<code>/stats 2025-Q2</code>, <code>/stats месяц vs</code>)
+/month - за месяц
+/timezone - часовой пояс для дней и месяцев
+/categories - все категории
+/export - выгрузить операции в CSV (<code>/export 2024 xlsx</code>)
+/clear - очистить историю
+"""
+
+TIMEZONE_HELP = (
+    "Дни и месяцы в статистике считаются в вашем часовом поясе. Изменить: "
+    "<code>/timezone Europe/Moscow</code>, <code>/timezone мск</code> или смещением <code>/timezone +3</code>"
+)
+
+ADD_CATEGORY_HELP = """
+<b>Добавление категории</b>
+
+Используйте команду:
+<code>/add_category Название ключевые,слова,через,запятую</code>
+
+<b>Пример:</b>
+<code>/add_category Фриланс заказ,проект,удаленка</code>
+<code>/add_category Еда продукты,магазин,молоко,хлеб</code>
+
+После добавления категории, при вводе траты содержащей ключевые слова, будет автоматически определяться ваша категория.
+"""
+
+DELETE_CATEGORY_HELP = """
+<b>Удаление категории</b>
+
+Используйте команду:
+<code>/delete_category Название_категории</code>
+
+<b>Пример:</b>
+<code>/delete_category Фриланс</code>
+
+Чтобы посмотреть список ваших категорий, нажмите «Мои категории».
+"""
+
+OPERATION_FORMAT_HELP = """Не понимаю формат. Используйте:
+        
+<b>Для расходов:</b> <code>500 еда</code>
+<b>Для доходов:</b> <code>+50000 зарплата</code>
+<b>Несколько сразу:</b> по одной на строку или через <code>;</code>"""
+
+IMPORT_HELP = """
+📥 <b>Импорт операций из CSV</b>
+
+Отправьте файл .csv с подписью <code>/import</code> (или просто файл в течение 5 минут после команды).
+В первой строке должны быть названия столбцов. Без параметров узнаются столбцы
+«Дата», «Сумма», «Описание», «Тип» (и английские date, amount, description, type).
+
+Параметры в подписи или после команды:
+<code>amount="Сумма операции"</code> - столбец по названию или номеру (также date, description, type)
+<code>delimiter=;</code> - разделитель (по умолчанию определяется сам)
+<code>positive=income</code> - положительные суммы считать доходами (для банковских выписок)
+<code>encoding=cp1251</code> - кодировка файла
+
+Без столбца «Тип» расход - обычная сумма, доход - сумма с «+».
+"""
+
+OPERATIONS_LIST_TEXT = "📊 <b>Ваши операции:</b>\n\nНажмите на операцию для редактирования:\n\n"
+
 # === ДОБАВЛЕНО: Система состояний для редактирования ===
-edit_states = {}
 EDIT_STATE_TIMEOUT = 300  # 5 минут
+# sqlite - состояния сохраняются в базе и переживают перезапуск, memory - только в памяти
+EDIT_STATE_STORAGE = os.getenv('EDIT_STATE_STORAGE', 'sqlite')
+edit_states = TTLStateStore(
+    EDIT_STATE_TIMEOUT,
+    persist=db if EDIT_STATE_STORAGE == 'sqlite' else None
+)
 
 def set_edit_state(user_id, action, operation_id):
     """Устанавливает состояние редактирования для пользователя"""
-    edit_states[user_id] = {
+    edit_states.set(user_id, {
         'action': action,
         'operation_id': operation_id,
         'timestamp': time.time()
-    }
+    })
 
 def clear_edit_state(user_id):
     """Очищает состояние редактирования"""
-    if user_id in edit_states:
-        del edit_states[user_id]
+    edit_states.clear(user_id)
 
 def get_edit_state(user_id):
     """Возвращает состояние редактирования пользователя"""
-    # Очищаем устаревшие состояния
-    current_time = time.time()
-    expired_users = [uid for uid, state in edit_states.items() 
-                    if current_time - state['timestamp'] > EDIT_STATE_TIMEOUT]
-    for uid in expired_users:
-        del edit_states[uid]
-    
     return edit_states.get(user_id)
 
+# Часовой пояс пользователя: в нем считаются границы дней и месяцев (/timezone)
+def user_timezone(user_id):
+    try:
+        return get_timezone(db.get_user_timezone(user_id))
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError) as e:
+        # Пояс пропал из системной базы tzdata - считаем по умолчанию
+        print(f"⚠️ Часовой пояс пользователя {user_id} недоступен: {e}")
+        return get_timezone(DEFAULT_TIMEZONE)
+
+def format_operation_time(operation, tz):
+    """Время операции в часовом поясе пользователя tz (user_timezone)"""
+    if operation.get('ts') is None:
+        return operation['created_at']
+    local = datetime.fromtimestamp(operation['ts'], tz)
+    return local.strftime('%Y-%m-%d %H:%M')
+
 # Создаем клавиатуру с кнопками для главного меню
 def create_main_keyboard():
     keyboard = InlineKeyboardMarkup()
@@ -107,6 +312,18 @@ def create_categories_keyboard():
     )
     return keyboard
 
+# Клавиатура после изменения категорий: предлагаем пересчитать прошлые расходы
+def create_recategorize_keyboard():
+    keyboard = InlineKeyboardMarkup()
+    keyboard.row(
+        InlineKeyboardButton("🔄 Применить к прошлым расходам", callback_data=RECATEGORIZE_CALLBACK)
+    )
+    keyboard.row(
+        InlineKeyboardButton("📋 Мои категории", callback_data="my_categories"),
+        InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")
+    )
+    return keyboard
+
 # Клавиатура для статистики и отчетов
 def create_stats_keyboard():
     keyboard = InlineKeyboardMarkup()
@@ -124,17 +341,12 @@ def create_stats_keyboard():
     return keyboard
 
 # === ДОБАВЛЕНО: Клавиатура для списка операций с редактированием ===
-def create_operations_keyboard(operations, page=0, operations_per_page=10):
-    """Создает клавиатуру для списка операций с пагинацией и действиями"""
+def create_operations_keyboard(page, older_prefix=LIST_OLDER_PREFIX, newer_prefix=LIST_NEWER_PREFIX):
+    """Создает клавиатуру для страницы операций (результат db.get_operations_page)"""
     keyboard = InlineKeyboardMarkup()
+    operations = page['operations']
     
-    # Показываем операции для текущей страницы
-    start_idx = page * operations_per_page
-    end_idx = start_idx + operations_per_page
-    current_ops = operations[start_idx:end_idx]
-    
-    for i, op in enumerate(current_ops):
-        op_index = start_idx + i
+    for op in operations:
         op_type_icon = "✅" if op['type'] == 'income' else "🔴"
         category_info = f" [{op['category']}]" if op['type'] == 'expense' else ""
         btn_text = f"{op_type_icon} {op['amount']} руб. - {op['description'][:20]}{category_info}"
@@ -146,13 +358,15 @@ def create_operations_keyboard(operations, page=0, operations_per_page=10):
             )
         )
     
-    # Кнопки пагинации
+    # Кнопки пагинации: курсор - крайняя операция текущей страницы
     pagination_row = []
-    if page > 0:
-        pagination_row.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"list_page_{page-1}"))
+    if page['has_newer'] and operations:
+        first = operations[0]
+        pagination_row.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{newer_prefix}{first['ts']}_{first['id']}"))
     
-    if end_idx < len(operations):
-        pagination_row.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"list_page_{page+1}"))
+    if page['has_older'] and operations:
+        last = operations[-1]
+        pagination_row.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"{older_prefix}{last['ts']}_{last['id']}"))
     
     if pagination_row:
         keyboard.row(*pagination_row)
@@ -185,487 +399,516 @@ def create_edit_operation_keyboard(operation_id):
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
-    welcome_text = """
-💼 <b>Бот для учета финансов</b>
-
-<b>Добавить трату:</b>
-<code>500 еда</code>
-<code>1500 бензин</code>
-
-<b>Добавить доход:</b>
-<code>+50000 зарплата</code>
-
-<b>📂 Персональные категории:</b>
-<code>/add_category Еда продукты,магазин</code>
-<code>/my_categories</code>
-<code>/delete_category Еда</code>
-
-<b>📊 Визуальная статистика:</b>
-<code>/chart</code> - диаграмма расходов
-<code>/history</code> - история по месяцам
-
-<b>📈 Команды:</b>
-/list - все операции
-/balance - баланс  
-/stats - статистика
-/month - за месяц
-/categories - все категории
-/clear - очистить историю
-    """
-    bot.reply_to(message, welcome_text, parse_mode='HTML', reply_markup=create_main_keyboard())
+    outbox.reply_to(message, WELCOME_TEXT, parse_mode='HTML', reply_markup=create_main_keyboard())
+
+# Экраны, общие для команд и кнопок: возвращают (текст, клавиатура)
+# или None, если показывать нечего
+def operations_view(user_id):
+    """Первая страница списка операций"""
+    page = db.get_operations_page(user_id, OPERATIONS_PER_PAGE)
+    if not page['operations']:
+        return None
+    return OPERATIONS_LIST_TEXT, create_operations_keyboard(page)
+
+def stats_view(user_id, operation_filter=None):
+    """Статистика расходов по категориям за все время; с фильтром /stats - итоги за период"""
+    if operation_filter is not None:
+        return period_view(user_id, operation_filter.period, operation_filter.conditions,
+                           operation_filter.compare, operation_filter.label)
+    
+    expenses_by_category = {
+        category: total
+        for category, (total, count) in db.get_expenses_by_category(user_id).items()
+    }
+    
+    if not expenses_by_category:
+        return None
+    
+    sorted_categories = sorted(expenses_by_category.items(), key=lambda x: x[1], reverse=True)
+    
+    stats_text = "📊 <b>Статистика по категориям:</b>\n\n"
+    total_expenses = sum(expenses_by_category.values())
+    
+    for category, amount in sorted_categories:
+        percentage = (amount / total_expenses) * 100 if total_expenses > 0 else 0
+        stats_text += f"• {category}: <b>{amount:,} руб.</b> ({percentage:.1f}%)\n"
+    
+    stats_text += f"\n💵 <b>Всего расходов: {total_expenses:,} руб.</b>"
+    return stats_text, create_stats_keyboard()
 
-# Обработчик нажатий на кнопки
-@bot.callback_query_handler(func=lambda call: True)
-def handle_callback(call):
-    user_id = call.from_user.id
+def balance_view(user_id):
+    """Доходы, расходы и баланс за все время"""
+    stats = db.get_user_statistics(user_id)
     
-    try:
-        if call.data == "list_operations":
-            operations = db.get_operations(user_id)
-            
-            if not operations:
-                bot.answer_callback_query(call.id, "У вас пока нет операций.")
-                return
-            
-            operations_list = "📊 <b>Ваши операции:</b>\n\n"
-            operations_list += "Нажмите на операцию для редактирования:\n\n"
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=operations_list,
-                parse_mode='HTML',
-                reply_markup=create_operations_keyboard(operations)
-            )
-            bot.answer_callback_query(call.id)
-        
-        elif call.data.startswith("list_page_"):
-            # Обработка пагинации
-            page = int(call.data.replace("list_page_", ""))
-            operations = db.get_operations(user_id)
-            
-            operations_list = "📊 <b>Ваши операции:</b>\n\n"
-            operations_list += "Нажмите на операцию для редактирования:\n\n"
-            
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=operations_list,
-                parse_mode='HTML',
-                reply_markup=create_operations_keyboard(operations, page)
-            )
-            bot.answer_callback_query(call.id)
-        
-        # === ДОБАВЛЕНО: Обработчики редактирования операций ===
-        elif call.data.startswith(EDIT_OPERATION_PREFIX):
-            # Редактирование операции - показываем меню действий
-            operation_id = int(call.data.replace(EDIT_OPERATION_PREFIX, ""))
-            operation = db.get_operation_by_id(operation_id)
-            
-            if not operation:
-                bot.answer_callback_query(call.id, "❌ Операция не найдена")
-                return
-            
-            show_operation_edit_menu(call, operation)
-        
-        elif call.data.startswith(EDIT_AMOUNT_PREFIX):
-            # Изменение суммы
-            operation_id = int(call.data.replace(EDIT_AMOUNT_PREFIX, ""))
-            set_edit_state(user_id, 'edit_amount', operation_id)
-            
-            bot.answer_callback_query(call.id)
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text="💵 <b>Введите новую сумму:</b>\n\nПример: <code>1500</code> или <code>+5000</code>",
-                parse_mode='HTML'
-            )
-        
-        elif call.data.startswith(EDIT_DESC_PREFIX):
-            # Изменение описания
-            operation_id = int(call.data.replace(EDIT_DESC_PREFIX, ""))
-            set_edit_state(user_id, 'edit_desc', operation_id)
-            
-            bot.answer_callback_query(call.id)
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text="📝 <b>Введите новое описание:</b>\n\nПример: <code>продукты в Пятерочке</code>",
-                parse_mode='HTML'
-            )
-        
-        elif call.data.startswith(EDIT_TYPE_PREFIX):
-            # Изменение типа операции (доход/расход)
-            operation_id = int(call.data.replace(EDIT_TYPE_PREFIX, ""))
-            operation = db.get_operation_by_id(operation_id)
-            
-            if not operation:
-                bot.answer_callback_query(call.id, "❌ Операция не найдена")
-                return
-            
-            new_type = 'income' if operation['type'] == 'expense' else 'expense'
-            if db.update_operation(operation_id, operation_type=new_type):
-                # Обновляем категорию при смене типа
-                new_category = 'доход' if new_type == 'income' else db.detect_category(user_id, operation['description'])
-                db.update_operation(operation_id, category=new_category)
-                
-                bot.answer_callback_query(call.id, "✅ Тип операции изменен!")
-                
-                # Показываем обновленную операцию
-                updated_op = db.get_operation_by_id(operation_id)
-                show_operation_edit_menu(call, updated_op)
-            else:
-                bot.answer_callback_query(call.id, "❌ Ошибка при изменении типа")
-        
-        elif call.data.startswith(EDIT_CATEGORY_PREFIX):
-            # Изменение категории
-            operation_id = int(call.data.replace(EDIT_CATEGORY_PREFIX, ""))
-            operation = db.get_operation_by_id(operation_id)
-            
-            if not operation or operation['type'] == 'income':
-                bot.answer_callback_query(call.id, "❌ Нельзя изменить категорию для доходов")
-                return
-            
-            # Показываем доступные категории
-            categories = db.get_all_categories(user_id)
-            categories_text = "📂 <b>Выберите новую категорию:</b>\n\n"
-            
-            keyboard = InlineKeyboardMarkup()
-            for category_name in categories.keys():
-                keyboard.row(InlineKeyboardButton(
-                    f"📁 {category_name}", 
-                    callback_data=f"{SET_CATEGORY_PREFIX}{operation_id}_{category_name}"
-                ))
-            
-            keyboard.row(InlineKeyboardButton("↩️ Назад", callback_data=f"{EDIT_OPERATION_PREFIX}{operation_id}"))
-            
-            bot.answer_callback_query(call.id)
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=categories_text,
-                parse_mode='HTML',
-                reply_markup=keyboard
-            )
-        
-        elif call.data.startswith(SET_CATEGORY_PREFIX):
-            # Установка новой категории
-            parts = call.data.replace(SET_CATEGORY_PREFIX, "").split("_")
-            operation_id = int(parts[0])
-            category_name = parts[1]
-            
-            if db.update_operation(operation_id, category=category_name):
-                bot.answer_callback_query(call.id, f"✅ Категория изменена на: {category_name}")
-                
-                # Возвращаем к редактированию операции
-                operation = db.get_operation_by_id(operation_id)
-                show_operation_edit_menu(call, operation)
-            else:
-                bot.answer_callback_query(call.id, "❌ Ошибка при изменении категории")
-        
-        elif call.data.startswith(DELETE_OPERATION_PREFIX):
-            # Подтверждение удаления
-            operation_id = int(call.data.replace(DELETE_OPERATION_PREFIX, ""))
-            operation = db.get_operation_by_id(operation_id)
-            
-            if not operation:
-                bot.answer_callback_query(call.id, "❌ Операция не найдена")
-                return
-            
-            confirm_keyboard = InlineKeyboardMarkup()
-            confirm_keyboard.row(
-                InlineKeyboardButton("✅ Да, удалить", callback_data=f"{CONFIRM_DELETE_PREFIX}{operation_id}"),
-                InlineKeyboardButton("❌ Отмена", callback_data=f"{EDIT_OPERATION_PREFIX}{operation_id}")
-            )
-            
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"🗑 <b>Подтвердите удаление:</b>\n\n{operation['amount']} руб. - {operation['description']}",
-                parse_mode='HTML',
-                reply_markup=confirm_keyboard
-            )
-            bot.answer_callback_query(call.id)
-        
-        elif call.data.startswith(CONFIRM_DELETE_PREFIX):
-            # Удаление операции
-            operation_id = int(call.data.replace(CONFIRM_DELETE_PREFIX, ""))
-            
-            if db.delete_operation(operation_id):
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text="✅ Операция удалена!",
-                    reply_markup=create_main_keyboard()
-                )
-            else:
-                bot.answer_callback_query(call.id, "❌ Ошибка при удалении")
-        
-        # === КОНЕЦ ДОБАВЛЕННЫХ ОБРАБОТЧИКОВ ===
-        
-        elif call.data == "show_stats":
-            operations = db.get_operations(user_id)
-            
-            expenses_by_category = {}
-            for op in operations:
-                if op['type'] == 'expense':
-                    category = op.get('category', 'другое')
-                    amount = op.get('amount', 0)
-                    
-                    if category not in expenses_by_category:
-                        expenses_by_category[category] = 0
-                    expenses_by_category[category] += amount
-            
-            if not expenses_by_category:
-                bot.answer_callback_query(call.id, "У вас пока нет расходов для статистики.")
-                return
-            
-            sorted_categories = sorted(expenses_by_category.items(), key=lambda x: x[1], reverse=True)
-            
-            stats_text = "📊 <b>Статистика по категориям:</b>\n\n"
-            total_expenses = sum(expenses_by_category.values())
-            
-            for category, amount in sorted_categories:
-                percentage = (amount / total_expenses) * 100 if total_expenses > 0 else 0
-                stats_text += f"• {category}: <b>{amount:,} руб.</b> ({percentage:.1f}%)\n"
-            
-            stats_text += f"\n💵 <b>Всего расходов: {total_expenses:,} руб.</b>"
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=stats_text,
-                parse_mode='HTML',
-                reply_markup=create_stats_keyboard()
-            )
-            bot.answer_callback_query(call.id)
-        
-        elif call.data == "show_balance":
-            operations = db.get_operations(user_id)
-            
-            total_income = sum(op['amount'] for op in operations if op['type'] == 'income')
-            total_expenses = sum(op['amount'] for op in operations if op['type'] == 'expense')
-            balance = total_income - total_expenses
-            
-            balance_text = f"""
+    total_income = stats['total_income']
+    total_expenses = stats['total_expenses']
+    balance = stats['balance']
+    
+    balance_text = f"""
 💰 <b>Ваш финансовый баланс</b>
 
 📈 Доходы: <b>+{total_income:,} руб.</b>
 📉 Расходы: <b>-{total_expenses:,} руб.</b>
 ———————————————
 💵 Баланс: <b>{balance:,} руб.</b>
-            """
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=balance_text,
-                parse_mode='HTML',
-                reply_markup=create_main_keyboard()
-            )
-            bot.answer_callback_query(call.id)
+    """
+    return balance_text, create_main_keyboard()
+
+def month_view(user_id):
+    """Статистика за текущий месяц"""
+    return period_view(user_id, parse_period('месяц', tz=user_timezone(user_id)))
+
+def format_change(current, previous):
+    """Изменение к периоду сравнения: "▲ 12%", "▼ 5%", "новое" или пустая строка"""
+    if current == previous:
+        return ""
+    if not previous:
+        return "новое"
+    change = (current - previous) * 100 / previous
+    return f"{'▲' if change > 0 else '▼'} {abs(change):.0f}%"
+
+def expenses_by_category(user_id, period, conditions=None):
+    """{категория: сумма} расходов за период - из дневных итогов, без перебора операций"""
+    totals = db.get_expenses_by_category(user_id, period.start, period.end, conditions)
+    return {category: total for category, (total, count) in totals.items()}
+
+def compared_categories(current, previous):
+    """[(категория, сейчас, раньше)] по всем категориям обоих периодов, крупные сначала"""
+    categories = set(current) | set(previous)
+    return sorted(((category, current.get(category, 0), previous.get(category, 0)) for category in categories),
+                  key=lambda item: (item[1], item[2]), reverse=True)
+
+def period_view(user_id, period, conditions=None, compare=None, label=None):
+    """Доходы, расходы и расходы по категориям за период; с compare - изменение к нему"""
+    stats = db.get_user_statistics(user_id, period.start, period.end, conditions)
+    categories = expenses_by_category(user_id, period, conditions)
+    if compare is not None:
+        previous = db.get_user_statistics(user_id, compare.start, compare.end, conditions)
+        previous_categories = expenses_by_category(user_id, compare, conditions)
+    else:
+        previous = {'total_operations': 0, 'total_income': 0, 'total_expenses': 0, 'balance': 0}
+        previous_categories = {}
+    
+    if not stats['total_operations'] and not previous['total_operations']:
+        return None
+    
+    def change(key):
+        if compare is None:
+            return ""
+        text = format_change(stats[key], previous[key])
+        return f" {text}" if text else ""
+    
+    stats_text = f"📅 <b>Статистика за {html.escape(label or period.label)}:</b>\n"
+    if compare is not None:
+        stats_text += f"<i>в сравнении с {html.escape(compare.label)}</i>\n"
+    stats_text += "\n"
+    stats_text += f"📈 Доходы: <b>+{stats['total_income']:,} руб.</b>{change('total_income')}\n"
+    stats_text += f"📉 Расходы: <b>-{stats['total_expenses']:,} руб.</b>{change('total_expenses')}\n"
+    stats_text += f"💵 Баланс: <b>{stats['balance']:,} руб.</b>\n\n"
+    
+    if categories or previous_categories:
+        stats_text += "<b>Расходы по категориям:</b>\n"
+        total_expenses = stats['total_expenses']
+        for category, amount, previous_amount in compared_categories(categories, previous_categories):
+            percentage = (amount / total_expenses) * 100 if total_expenses > 0 else 0
+            stats_text += f"• {category}: <b>{amount:,} руб.</b> ({percentage:.1f}%)"
+            if compare is not None:
+                difference = format_change(amount, previous_amount)
+                stats_text += f" {difference}" if difference else ""
+            stats_text += "\n"
+    
+    return stats_text, create_stats_keyboard()
+
+def categories_menu_view():
+    """Меню управления категориями"""
+    categories_text = "📂 <b>Управление категориями</b>\n\n"
+    categories_text += "Здесь вы можете настроить свои персональные категории для автоматического определения трат."
+    return categories_text, create_categories_keyboard()
+
+def my_categories_view(user_id):
+    """Персональные категории пользователя"""
+    categories = db.get_user_categories(user_id)
+    
+    if not categories:
+        response = "📂 <b>Ваши персональные категории</b>\n\n"
+        response += "У вас пока нет персональных категорий.\n\n"
+        response += "Добавьте их через меню или командой:\n"
+        response += "<code>/add_category Название ключевые,слова</code>"
+    else:
+        response = "📂 <b>Ваши персональные категории:</b>\n\n"
         
-        elif call.data == "show_month":  
-            monthly_ops = db.get_monthly_operations(user_id)
-            
-            if not monthly_ops:
-                bot.answer_callback_query(call.id, "За текущий месяц операций нет.")
-                return
-            
-            expenses_by_category = {}
-            monthly_income = 0
-            monthly_expenses = 0
-            
-            for op in monthly_ops:
-                if op['type'] == 'income':
-                    monthly_income += op['amount']
-                else:
-                    monthly_expenses += op['amount']
-                    category = op.get('category', 'другое')
-                    if category not in expenses_by_category:
-                        expenses_by_category[category] = 0
-                    expenses_by_category[category] += op['amount']
-            
-            now = datetime.now()
-            month_name = now.strftime("%B %Y")
-            
-            stats_text = f"📅 <b>Статистика за {month_name}:</b>\n\n"
-            stats_text += f"📈 Доходы: <b>+{monthly_income:,} руб.</b>\n"
-            stats_text += f"📉 Расходы: <b>-{monthly_expenses:,} руб.</b>\n"
-            stats_text += f"💵 Баланс: <b>{monthly_income - monthly_expenses:,} руб.</b>\n\n"
-            
-            if expenses_by_category:
-                stats_text += "<b>Расходы по категориям:</b>\n"
-                sorted_categories = sorted(expenses_by_category.items(), key=lambda x: x[1], reverse=True)
-                
-                for category, amount in sorted_categories:
-                    percentage = (amount / monthly_expenses) * 100 if monthly_expenses > 0 else 0
-                    stats_text += f"• {category}: <b>{amount:,} руб.</b> ({percentage:.1f}%)\n"
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=stats_text,
-                parse_mode='HTML',
-                reply_markup=create_stats_keyboard()
-            )
-            bot.answer_callback_query(call.id)
+        for category_name, keywords in categories.items():
+            response += f"• <b>{category_name}</b>: {', '.join(keywords)}\n"
         
-        elif call.data == "show_categories":
-            categories_text = "📂 <b>Управление категориями</b>\n\n"
-            categories_text += "Здесь вы можете настроить свои персональные категории для автоматического определения трат."
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=categories_text,
-                parse_mode='HTML',
-                reply_markup=create_categories_keyboard()
-            )
+        response += f"\n📊 Всего категорий: {len(categories)}"
+        response += "\n\n⚙️ Управление: /add_category /delete_category"
+    
+    return response, create_categories_keyboard()
+
+def standard_categories_view():
+    """Список стандартных категорий"""
+    categories_text = "📖 <b>Стандартные категории:</b>\n\n"
+    
+    for category, keywords in CATEGORIES.items():
+        categories_text += f"• <b>{category}</b>: {', '.join(keywords[:3])}...\n"
+    
+    categories_text += "\nℹ️ Эти категории используются, если не найдено совпадение в ваших персональных категориях."
+    return categories_text, create_categories_keyboard()
+
+def reply_view(message, view):
+    """Отвечает экраном на команду"""
+    text, keyboard = view
+    outbox.reply_to(message, text, parse_mode='HTML', reply_markup=keyboard)
+
+def send_view(call, view):
+    """Отправляет экран в ответ на нажатие кнопки"""
+    text, keyboard = view
+    outbox.send_message(
+        chat_id=call.message.chat.id,
+        text=text,
+        parse_mode='HTML',
+        reply_markup=keyboard
+    )
+    bot.answer_callback_query(call.id)
+
+# Обработчик нажатий на кнопки: обработчик выбирается по callback_data в callbacks
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    try:
+        if not callbacks.dispatch(call):
+            print(f"⚠️ Неизвестная кнопка: {call.data}")
             bot.answer_callback_query(call.id)
-        
-        elif call.data == "add_category":
-            help_text = """
-<b>Добавление категории</b>
+    
+    except CallbackPayloadError as e:
+        print(f"⚠️ Неверные данные кнопки: {e}")
+        bot.answer_callback_query(call.id, "❌ Кнопка устарела, откройте меню заново")
+    
+    except Exception as e:
+        print(f"Ошибка в callback: {e}")
+        import traceback
+        traceback.print_exc()
+        bot.answer_callback_query(call.id, "❌ Произошла ошибка")
 
-Используйте команду:
-<code>/add_category Название ключевые,слова,через,запятую</code>
+@callbacks.route("list_operations")
+def list_operations_button(call):
+    view = operations_view(call.from_user.id)
+    if view is None:
+        bot.answer_callback_query(call.id, "У вас пока нет операций.")
+        return
+    send_view(call, view)
 
-<b>Пример:</b>
-<code>/add_category Фриланс заказ,проект,удаленка</code>
-<code>/add_category Еда продукты,магазин,молоко,хлеб</code>
+def show_operations_page(call, before=None, after=None):
+    """Листает список операций в том же сообщении"""
+    user_id = call.from_user.id
+    page = db.get_operations_page(user_id, OPERATIONS_PER_PAGE, before=before, after=after)
+    
+    # Если операции с краю страницы удалили, возвращаемся к началу списка
+    if not page['operations']:
+        page = db.get_operations_page(user_id, OPERATIONS_PER_PAGE)
+    
+    outbox.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=OPERATIONS_LIST_TEXT,
+        parse_mode='HTML',
+        reply_markup=create_operations_keyboard(page)
+    )
+    bot.answer_callback_query(call.id)
+
+# Пагинация: страница выбирается по курсору (ts, id), а не по номеру
+@callbacks.prefix(LIST_OLDER_PREFIX, int, int)
+def list_older_button(call, ts, operation_id):
+    show_operations_page(call, before=(ts, operation_id))
+
+@callbacks.prefix(LIST_NEWER_PREFIX, int, int)
+def list_newer_button(call, ts, operation_id):
+    show_operations_page(call, after=(ts, operation_id))
+
+@callbacks.prefix("list_page_")
+def legacy_list_page_button(call, payload=''):
+    # Кнопки старого формата (list_page_N) открывают первую страницу
+    show_operations_page(call)
+
+# Поиск и список с фильтрами запоминают запрос пользователя, а кнопки листают
+# только последнее сообщение с результатами
+def page_session(call, sessions, expired_text):
+    """Запрос, к сообщению которого относится кнопка, или None (ответ уже отправлен)"""
+    session = sessions.get(call.from_user.id)
+    if session is None or session.get('message_id') != call.message.message_id:
+        bot.answer_callback_query(call.id, expired_text)
+        return None
+    sessions.set(call.from_user.id, session)  # Продлеваем, пока пользователь листает
+    return session
+
+def remember_page_message(sent, session):
+    """Запоминает в session id отправленного сообщения, когда оно дойдет"""
+    def remember(future):
+        if future.exception() is None and future.result() is not None:
+            session['message_id'] = future.result().message_id
+    sent.add_done_callback(remember)
+
+def show_search_page(call, before=None, after=None):
+    """Листает результаты /search в том же сообщении"""
+    session = page_session(call, search_sessions, "Поиск устарел, повторите /search")
+    if session is None:
+        return
+    
+    page = db.search_operations(call.from_user.id, session['text'], session['start'], session['end'],
+                                OPERATIONS_PER_PAGE, before=before, after=after)
+    if not page['operations']:
+        page = db.search_operations(call.from_user.id, session['text'], session['start'], session['end'],
+                                    OPERATIONS_PER_PAGE)
+    
+    outbox.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=search_results_text(session),
+        parse_mode='HTML',
+        reply_markup=create_operations_keyboard(page, SEARCH_OLDER_PREFIX, SEARCH_NEWER_PREFIX)
+    )
+    bot.answer_callback_query(call.id)
 
-После добавления категории, при вводе траты содержащей ключевые слова, будет автоматически определяться ваша категория.
-            """
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=help_text,
-                parse_mode='HTML',
-                reply_markup=create_categories_keyboard()
-            )
-            bot.answer_callback_query(call.id)
-        
-        elif call.data == "my_categories":
-            categories = db.get_user_categories(user_id)
-            
-            if not categories:
-                categories_text = "📂 <b>Ваши персональные категории</b>\n\n"
-                categories_text += "У вас пока нет персональных категорий.\n\n"
-                categories_text += "Добавьте их через меню или командой /add_category"
-            else:
-                categories_text = "📂 <b>Ваши персональные категории:</b>\n\n"
-                
-                for category_name, keywords in categories.items():
-                    categories_text += f"• <b>{category_name}</b>: {', '.join(keywords)}\n"
-                
-                categories_text += f"\n📊 Всего категорий: {len(categories)}"
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=categories_text,
-                parse_mode='HTML',
-                reply_markup=create_categories_keyboard()
-            )
-            bot.answer_callback_query(call.id)
-        
-        elif call.data == "delete_category":
-            help_text = """
-<b>Удаление категории</b>
+@callbacks.prefix(SEARCH_OLDER_PREFIX, int, int)
+def search_older_button(call, ts, operation_id):
+    show_search_page(call, before=(ts, operation_id))
 
-Используйте команду:
-<code>/delete_category Название_категории</code>
+@callbacks.prefix(SEARCH_NEWER_PREFIX, int, int)
+def search_newer_button(call, ts, operation_id):
+    show_search_page(call, after=(ts, operation_id))
 
-<b>Пример:</b>
-<code>/delete_category Фриланс</code>
+def show_filtered_page(call, before=None, after=None):
+    """Листает список с фильтрами в том же сообщении"""
+    session = page_session(call, list_filters, "Список устарел, повторите /list")
+    if session is None:
+        return
+    
+    page = filtered_page(call.from_user.id, session['filter'], before=before, after=after)
+    if not page['operations']:
+        page = filtered_page(call.from_user.id, session['filter'])
+    
+    outbox.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=filtered_list_text(session),
+        parse_mode='HTML',
+        reply_markup=create_operations_keyboard(page, FILTER_OLDER_PREFIX, FILTER_NEWER_PREFIX)
+    )
+    bot.answer_callback_query(call.id)
 
-Чтобы посмотреть список ваших категорий, нажмите «Мои категории».
-            """
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=help_text,
-                parse_mode='HTML',
-                reply_markup=create_categories_keyboard()
-            )
-            bot.answer_callback_query(call.id)
-        
-        elif call.data == "standard_categories":
-            categories_text = "📖 <b>Стандартные категории:</b>\n\n"
-            
-            for category, keywords in CATEGORIES.items():
-                categories_text += f"• <b>{category}</b>: {', '.join(keywords[:3])}...\n"
-            
-            categories_text += "\nℹ️ Эти категории используются, если не найдено совпадение в ваших персональных категориях."
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=categories_text,
-                parse_mode='HTML',
-                reply_markup=create_categories_keyboard()
-            )
-            bot.answer_callback_query(call.id)
+@callbacks.prefix(FILTER_OLDER_PREFIX, int, int)
+def filter_older_button(call, ts, operation_id):
+    show_filtered_page(call, before=(ts, operation_id))
+
+@callbacks.prefix(FILTER_NEWER_PREFIX, int, int)
+def filter_newer_button(call, ts, operation_id):
+    show_filtered_page(call, after=(ts, operation_id))
+
+# === ДОБАВЛЕНО: Обработчики редактирования операций ===
+@callbacks.prefix(EDIT_OPERATION_PREFIX, int)
+def edit_operation_button(call, operation_id):
+    # Редактирование операции - показываем меню действий
+    operation = db.get_operation_by_id(operation_id)
+    
+    if not operation:
+        bot.answer_callback_query(call.id, "❌ Операция не найдена")
+        return
+    
+    show_operation_edit_menu(call, operation)
+
+@callbacks.prefix(EDIT_AMOUNT_PREFIX, int)
+def edit_amount_button(call, operation_id):
+    # Изменение суммы
+    set_edit_state(call.from_user.id, 'edit_amount', operation_id)
+    
+    bot.answer_callback_query(call.id)
+    outbox.send_message(
+        chat_id=call.message.chat.id,
+        text="💵 <b>Введите новую сумму:</b>\n\nПример: <code>1500</code> или <code>+5000</code>",
+        parse_mode='HTML'
+    )
+
+@callbacks.prefix(EDIT_DESC_PREFIX, int)
+def edit_description_button(call, operation_id):
+    # Изменение описания
+    set_edit_state(call.from_user.id, 'edit_desc', operation_id)
+    
+    bot.answer_callback_query(call.id)
+    outbox.send_message(
+        chat_id=call.message.chat.id,
+        text="📝 <b>Введите новое описание:</b>\n\nПример: <code>продукты в Пятерочке</code>",
+        parse_mode='HTML'
+    )
+
+@callbacks.prefix(EDIT_TYPE_PREFIX, int)
+def edit_type_button(call, operation_id):
+    # Изменение типа операции (доход/расход)
+    operation = db.get_operation_by_id(operation_id)
+    
+    if not operation:
+        bot.answer_callback_query(call.id, "❌ Операция не найдена")
+        return
+    
+    new_type = 'income' if operation['type'] == 'expense' else 'expense'
+    if db.update_operation(operation_id, operation_type=new_type):
+        # Обновляем категорию при смене типа
+        new_category = 'доход' if new_type == 'income' else db.detect_category(call.from_user.id, operation['description'])
+        db.update_operation(operation_id, category=new_category)
         
-        elif call.data == "show_chart":
-            bot.answer_callback_query(call.id, "🔄 Создаю диаграмму...")
-            
-            class FakeMessage:
-                def __init__(self, chat_id, user_id):
-                    self.chat = type('Chat', (), {'id': chat_id})()
-                    self.from_user = type('User', (), {'id': user_id})()
-            
-            fake_msg = FakeMessage(call.message.chat.id, user_id)
-            show_chart(fake_msg)
+        bot.answer_callback_query(call.id, "✅ Тип операции изменен!")
         
-        elif call.data == "show_history":
-            bot.answer_callback_query(call.id, "🔄 Создаю график истории...")
-            
-            class FakeMessage:
-                def __init__(self, chat_id, user_id):
-                    self.chat = type('Chat', (), {'id': chat_id})()
-                    self.from_user = type('User', (), {'id': user_id})()
-            
-            fake_msg = FakeMessage(call.message.chat.id, user_id)
-            show_history_chart(fake_msg)
+        # Показываем обновленную операцию
+        updated_op = db.get_operation_by_id(operation_id)
+        show_operation_edit_menu(call, updated_op)
+    else:
+        bot.answer_callback_query(call.id, "❌ Ошибка при изменении типа")
+
+@callbacks.prefix(EDIT_CATEGORY_PREFIX, int)
+def edit_category_button(call, operation_id):
+    # Изменение категории
+    operation = db.get_operation_by_id(operation_id)
+    
+    if not operation or operation['type'] == 'income':
+        bot.answer_callback_query(call.id, "❌ Нельзя изменить категорию для доходов")
+        return
+    
+    # Показываем доступные категории
+    categories = db.get_all_categories(call.from_user.id)
+    categories_text = "📂 <b>Выберите новую категорию:</b>\n\n"
+    
+    keyboard = InlineKeyboardMarkup()
+    for category_name in categories.keys():
+        keyboard.row(InlineKeyboardButton(
+            f"📁 {category_name}", 
+            callback_data=f"{SET_CATEGORY_PREFIX}{operation_id}_{category_name}"
+        ))
+    
+    keyboard.row(InlineKeyboardButton("↩️ Назад", callback_data=f"{EDIT_OPERATION_PREFIX}{operation_id}"))
+    
+    bot.answer_callback_query(call.id)
+    outbox.send_message(
+        chat_id=call.message.chat.id,
+        text=categories_text,
+        parse_mode='HTML',
+        reply_markup=keyboard
+    )
+
+# Название категории - последнее поле, поэтому может содержать "_"
+@callbacks.prefix(SET_CATEGORY_PREFIX, int, str)
+def set_category_button(call, operation_id, category_name):
+    # Установка новой категории
+    if db.update_operation(operation_id, category=category_name):
+        bot.answer_callback_query(call.id, f"✅ Категория изменена на: {category_name}")
         
-        elif call.data == "main_menu":
-            welcome_text = """
-💼 <b>Бот для учета финансов</b>
+        # Возвращаем к редактированию операции
+        operation = db.get_operation_by_id(operation_id)
+        show_operation_edit_menu(call, operation)
+    else:
+        bot.answer_callback_query(call.id, "❌ Ошибка при изменении категории")
 
-<b>Добавить трату:</b>
-<code>500 еда</code>
-<code>1500 бензин</code>
+@callbacks.prefix(DELETE_OPERATION_PREFIX, int)
+def delete_operation_button(call, operation_id):
+    # Подтверждение удаления
+    operation = db.get_operation_by_id(operation_id)
+    
+    if not operation:
+        bot.answer_callback_query(call.id, "❌ Операция не найдена")
+        return
+    
+    confirm_keyboard = InlineKeyboardMarkup()
+    confirm_keyboard.row(
+        InlineKeyboardButton("✅ Да, удалить", callback_data=f"{CONFIRM_DELETE_PREFIX}{operation_id}"),
+        InlineKeyboardButton("❌ Отмена", callback_data=f"{EDIT_OPERATION_PREFIX}{operation_id}")
+    )
+    
+    outbox.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=f"🗑 <b>Подтвердите удаление:</b>\n\n{operation['amount']} руб. - {operation['description']}",
+        parse_mode='HTML',
+        reply_markup=confirm_keyboard
+    )
+    bot.answer_callback_query(call.id)
 
-<b>Добавить доход:</b>
-<code>+50000 зарплата</code>
+@callbacks.prefix(CONFIRM_DELETE_PREFIX, int)
+def confirm_delete_button(call, operation_id):
+    # Удаление операции
+    if db.delete_operation(operation_id):
+        outbox.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="✅ Операция удалена!",
+            reply_markup=create_main_keyboard()
+        )
+    else:
+        bot.answer_callback_query(call.id, "❌ Ошибка при удалении")
 
-<b>📂 Персональные категории:</b>
-<code>/add_category Еда продукты,магазин</code>
-<code>/my_categories</code>
-<code>/delete_category Еда</code>
+# === КОНЕЦ ДОБАВЛЕННЫХ ОБРАБОТЧИКОВ ===
 
-<b>📊 Визуальная статистика:</b>
-<code>/chart</code> - диаграмма расходов
-<code>/history</code> - история по месяцам
+@callbacks.route("show_stats")
+def stats_button(call):
+    view = stats_view(call.from_user.id)
+    if view is None:
+        bot.answer_callback_query(call.id, "У вас пока нет расходов для статистики.")
+        return
+    send_view(call, view)
 
-<b>📈 Команды:</b>
-/list - все операции
-/balance - баланс  
-/stats - статистика
-/month - за месяц
-/categories - все категории
-/clear - очистить историю
-            """
-            
-            bot.send_message(
-                chat_id=call.message.chat.id,
-                text=welcome_text,
-                parse_mode='HTML',
-                reply_markup=create_main_keyboard()
-            )
-            bot.answer_callback_query(call.id)
-    
-    except Exception as e:
-        print(f"Ошибка в callback: {e}")
-        import traceback
-        traceback.print_exc()
-        bot.answer_callback_query(call.id, "❌ Произошла ошибка")
+@callbacks.route("show_balance")
+def balance_button(call):
+    send_view(call, balance_view(call.from_user.id))
+
+@callbacks.route("show_month")
+def month_button(call):
+    view = month_view(call.from_user.id)
+    if view is None:
+        bot.answer_callback_query(call.id, "За текущий месяц операций нет.")
+        return
+    send_view(call, view)
+
+@callbacks.route(RECATEGORIZE_CALLBACK)
+def recategorize_button(call):
+    if start_recategorization(call.message.chat.id, call.from_user.id):
+        bot.answer_callback_query(call.id, "🔄 Пересчитываю категории...")
+    else:
+        bot.answer_callback_query(call.id, "⏳ Пересчет уже идет")
+
+@callbacks.route("show_categories")
+def categories_button(call):
+    send_view(call, categories_menu_view())
+
+@callbacks.route("add_category")
+def add_category_button(call):
+    send_view(call, (ADD_CATEGORY_HELP, create_categories_keyboard()))
+
+@callbacks.route("my_categories")
+def my_categories_button(call):
+    send_view(call, my_categories_view(call.from_user.id))
+
+@callbacks.route("delete_category")
+def delete_category_button(call):
+    send_view(call, (DELETE_CATEGORY_HELP, create_categories_keyboard()))
+
+@callbacks.route("standard_categories")
+def standard_categories_button(call):
+    send_view(call, standard_categories_view())
+
+@callbacks.route("show_chart")
+def chart_button(call):
+    bot.answer_callback_query(call.id, "🔄 Создаю диаграмму...")
+    send_expenses_chart(call.message.chat.id, call.from_user.id)
+
+@callbacks.route("show_history")
+def history_button(call):
+    bot.answer_callback_query(call.id, "🔄 Создаю график истории...")
+    send_history_chart(call.message.chat.id, call.from_user.id, HISTORY_DEFAULT_MONTHS)
+
+@callbacks.route("main_menu")
+def main_menu_button(call):
+    send_view(call, (WELCOME_TEXT, create_main_keyboard()))
 
 # === ДОБАВЛЕНО: Вспомогательные функции для редактирования ===
 def show_operation_edit_menu(call, operation):
     """Показывает меню редактирования операции"""
+    tz = user_timezone(call.from_user.id)
     op_type_icon = "✅" if operation['type'] == 'income' else "🔴"
     category_info = f" [{operation['category']}]" if operation['type'] == 'expense' else ""
     
@@ -674,13 +917,13 @@ def show_operation_edit_menu(call, operation):
 
 {op_type_icon} <b>{operation['amount']} руб.</b> - {operation['description']}{category_info}
 
-📅 <i>{operation['created_at']}</i>
+📅 <i>{format_operation_time(operation, tz)}</i>
 
 Выберите действие:
     """
     
     if hasattr(call.message, 'message_id'):
-        bot.edit_message_text(
+        outbox.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             text=operation_text,
@@ -688,7 +931,7 @@ def show_operation_edit_menu(call, operation):
             reply_markup=create_edit_operation_keyboard(operation['id'])
         )
     else:
-        bot.send_message(
+        outbox.send_message(
             chat_id=call.message.chat.id,
             text=operation_text,
             parse_mode='HTML',
@@ -697,6 +940,7 @@ def show_operation_edit_menu(call, operation):
 
 def show_updated_operation(chat_id, operation):
     """Показывает обновленную операцию с кнопками редактирования"""
+    tz = user_timezone(operation['user_id'])
     op_type_icon = "✅" if operation['type'] == 'income' else "🔴"
     category_info = f" [{operation['category']}]" if operation['type'] == 'expense' else ""
     
@@ -705,12 +949,12 @@ def show_updated_operation(chat_id, operation):
 
 {op_type_icon} <b>{operation['amount']} руб.</b> - {operation['description']}{category_info}
 
-📅 <i>{operation['created_at']}</i>
+📅 <i>{format_operation_time(operation, tz)}</i>
 
 Выберите действие:
     """
     
-    bot.send_message(
+    outbox.send_message(
         chat_id=chat_id,
         text=operation_text,
         parse_mode='HTML',
@@ -718,7 +962,8 @@ def show_updated_operation(chat_id, operation):
     )
 
 # === ДОБАВЛЕНО: Обработчик всех сообщений с поддержкой редактирования ===
-@bot.message_handler(func=lambda message: True)
+# Команды пропускаем: их обрабатывают собственные хендлеры, объявленные ниже
+@bot.message_handler(func=lambda message: not (message.text or '').startswith('/'))
 def handle_all_messages(message):
     user_id = message.from_user.id
     text = message.text.strip()
@@ -750,13 +995,13 @@ def handle_edit_input(message, edit_state):
                 operation_type = 'expense'
             
             if new_amount <= 0:
-                bot.reply_to(message, "❌ Сумма должна быть положительной")
+                outbox.reply_to(message, "❌ Сумма должна быть положительной")
                 return
             
             # Получаем текущую операцию для сохранения описания
             operation = db.get_operation_by_id(operation_id)
             if not operation:
-                bot.reply_to(message, "❌ Операция не найдена")
+                outbox.reply_to(message, "❌ Операция не найдена")
                 clear_edit_state(user_id)
                 return
             
@@ -768,24 +1013,24 @@ def handle_edit_input(message, edit_state):
                     db.update_operation(operation_id, category=new_category)
                 
                 clear_edit_state(user_id)
-                bot.reply_to(message, f"✅ Сумма изменена на: {new_amount} руб.")
+                outbox.reply_to(message, f"✅ Сумма изменена на: {new_amount} руб.")
                 
                 # Показываем обновленную операцию
                 updated_op = db.get_operation_by_id(operation_id)
                 show_updated_operation(message.chat.id, updated_op)
             else:
-                bot.reply_to(message, "❌ Ошибка при изменении суммы")
+                outbox.reply_to(message, "❌ Ошибка при изменении суммы")
         
         elif action == 'edit_desc':
             # Обрабатываем ввод описания
             if len(text) == 0:
-                bot.reply_to(message, "❌ Описание не может быть пустым")
+                outbox.reply_to(message, "❌ Описание не может быть пустым")
                 return
             
             # Получаем текущую операцию
             operation = db.get_operation_by_id(operation_id)
             if not operation:
-                bot.reply_to(message, "❌ Операция не найдена")
+                outbox.reply_to(message, "❌ Операция не найдена")
                 clear_edit_state(user_id)
                 return
             
@@ -797,55 +1042,108 @@ def handle_edit_input(message, edit_state):
             
             if db.update_operation(operation_id, **updates):
                 clear_edit_state(user_id)
-                bot.reply_to(message, f"✅ Описание изменено на: {text}")
+                outbox.reply_to(message, f"✅ Описание изменено на: {text}")
                 
                 # Показываем обновленную операцию
                 updated_op = db.get_operation_by_id(operation_id)
                 show_updated_operation(message.chat.id, updated_op)
             else:
-                bot.reply_to(message, "❌ Ошибка при изменении описания")
+                outbox.reply_to(message, "❌ Ошибка при изменении описания")
     
     except ValueError:
         if action == 'edit_amount':
-            bot.reply_to(message, "❌ Неверный формат суммы. Используйте: <code>500</code> или <code>+5000</code>", parse_mode='HTML')
+            outbox.reply_to(message, "❌ Неверный формат суммы. Используйте: <code>500</code> или <code>+5000</code>", parse_mode='HTML')
         else:
-            bot.reply_to(message, "❌ Произошла ошибка. Попробуйте еще раз.")
+            outbox.reply_to(message, "❌ Произошла ошибка. Попробуйте еще раз.")
     except Exception as e:
         print(f"Ошибка при редактировании: {e}")
-        bot.reply_to(message, "❌ Произошла ошибка при обработке запроса")
+        outbox.reply_to(message, "❌ Произошла ошибка при обработке запроса")
 
-def add_operation_cmd(message):
-    """Добавляет новую операцию (оригинальная функция)"""
-    user_id = message.from_user.id
-    text = message.text.strip()
+def parse_operation(entry):
+    """Разбирает запись "500 еда" или "+50000 зарплата" в (сумма, описание, тип)
 
-    try:
-        if text.startswith('+'):
-            operation_type = 'income'
-            parts = text[1:].strip().split(' ', 1)
-        else:
-            operation_type = 'expense'
-            parts = text.split(' ', 1)
-        
-        amount = int(parts[0])
-        description = parts[1] if len(parts) > 1 else "без категории"
+    Бросает ValueError, если запись не начинается с суммы.
+    """
+    if entry.startswith('+'):
+        operation_type = 'income'
+        parts = entry[1:].strip().split(' ', 1)
+    else:
+        operation_type = 'expense'
+        parts = entry.split(' ', 1)
+    
+    amount = int(parts[0])
+    description = parts[1].strip() if len(parts) > 1 and parts[1].strip() else "без категории"
+    return amount, description, operation_type
 
-        db.add_operation(user_id, amount, description, operation_type)
-        
+def split_entries(text):
+    """Делит сообщение на записи: по одной на строку или через ";" """
+    return [entry.strip() for line in text.splitlines() for entry in line.split(';') if entry.strip()]
+
+def add_operation_cmd(message):
+    """Добавляет операции из сообщения: одну или несколько (по строкам или через ";")"""
+    user_id = message.from_user.id
+    entries = split_entries(message.text)
+    
+    # Сначала проверяем все записи, ошибочные не мешают сохранить остальные
+    operations = []
+    invalid = []
+    for number, entry in enumerate(entries, 1):
+        try:
+            operations.append(parse_operation(entry))
+        except (ValueError, IndexError):
+            invalid.append((number, entry))
+    
+    if not operations or len(entries) > BATCH_MAX_ENTRIES:
+        response = OPERATION_FORMAT_HELP
+        if len(entries) > BATCH_MAX_ENTRIES:
+            response = f"❌ Слишком много записей в одном сообщении (максимум {BATCH_MAX_ENTRIES})"
+        elif len(entries) > 1:
+            response += "\n\n" + format_invalid_entries(invalid)
+        outbox.reply_to(message, response, parse_mode='HTML', reply_markup=create_main_keyboard())
+        return
+    
+    categories = db.add_operations(user_id, operations)
+    
+    if len(entries) == 1:
+        amount, description, operation_type = operations[0]
         if operation_type == 'income':
             response = f"✅ Записал доход: {description} - +{amount} руб."
         else:
-            # Используем новую функцию определения категории
-            category = db.detect_category(user_id, description)
-            response = f"🔴 Записал расход: {description} - {amount} руб. [{category}]"
-        
-        bot.reply_to(message, response, reply_markup=create_quick_actions_keyboard())
+            response = f"🔴 Записал расход: {description} - {amount} руб. [{categories[0]}]"
+        outbox.reply_to(message, response, reply_markup=create_quick_actions_keyboard())
+        return
+    
+    # Одна сводка на все сообщение
+    lines = []
+    for (amount, description, operation_type), category in zip(operations, categories):
+        if operation_type == 'income':
+            lines.append(f"🟢 +{amount:,} руб. - {html.escape(description)}")
+        else:
+            lines.append(f"🔴 {amount:,} руб. - {html.escape(description)} [{category}]")
+    if len(lines) > BATCH_SUMMARY_LINES:
+        hidden = len(lines) - BATCH_SUMMARY_LINES
+        lines = lines[:BATCH_SUMMARY_LINES] + [f"... и еще {hidden}"]
+    
+    income = sum(amount for amount, _, operation_type in operations if operation_type == 'income')
+    expenses = sum(amount for amount, _, operation_type in operations if operation_type == 'expense')
+    response = f"✅ <b>Записано операций: {len(operations)}</b>\n\n" + "\n".join(lines) + "\n"
+    if expenses:
+        response += f"\n💸 Расходы: {expenses:,} руб."
+    if income:
+        response += f"\n💰 Доходы: +{income:,} руб."
+    if invalid:
+        response += "\n\n" + format_invalid_entries(invalid)
+    
+    outbox.reply_to(message, response, parse_mode='HTML', reply_markup=create_quick_actions_keyboard())
 
-    except (ValueError, IndexError):
-        bot.reply_to(message, '''Не понимаю формат. Используйте:
-        
-<b>Для расходов:</b> <code>500 еда</code>
-<b>Для доходов:</b> <code>+50000 зарплата</code>''', parse_mode='HTML', reply_markup=create_main_keyboard())
+def format_invalid_entries(invalid):
+    """Список нераспознанных записей для ответа"""
+    text = f"⚠️ <b>Не распознано записей: {len(invalid)}</b>\n"
+    for number, entry in invalid[:BATCH_SUMMARY_LINES]:
+        text += f"• {number}: <code>{html.escape(entry[:50])}</code>\n"
+    if len(invalid) > BATCH_SUMMARY_LINES:
+        text += f"... и еще {len(invalid) - BATCH_SUMMARY_LINES}\n"
+    return text
 
 # Остальные функции (команды) остаются без изменений...
 # [Здесь должен быть остальной твой код: add_category_cmd, show_my_categories_cmd, и т.д.]
@@ -868,14 +1166,15 @@ def add_category_cmd(message):
         if db.add_user_category(user_id, category_name, keywords):
             response = f"✅ Категория '{category_name}' добавлена!\n\n"
             response += f"Ключевые слова: {keywords}\n\n"
-            response += "Теперь при добавлении трат с этими словами будет автоматически определяться ваша категория."
+            response += "Теперь при добавлении трат с этими словами будет автоматически определяться ваша категория.\n\n"
+            response += "Чтобы обновить категории уже записанных расходов, нажмите кнопку ниже или используйте /recategorize"
+            outbox.reply_to(message, response, reply_markup=create_recategorize_keyboard())
         else:
             response = f"❌ Категория '{category_name}' уже существует"
-            
-        bot.reply_to(message, response, reply_markup=create_categories_keyboard())
+            outbox.reply_to(message, response, reply_markup=create_categories_keyboard())
             
     except ValueError:
-        bot.reply_to(message, '''<b>Неверный формат</b>
+        outbox.reply_to(message, '''<b>Неверный формат</b>
 
 Используйте:
 <code>/add_category Название ключевые,слова,через,запятую</code>
@@ -887,24 +1186,7 @@ def add_category_cmd(message):
 @bot.message_handler(commands=['my_categories'])
 def show_my_categories_cmd(message):
     """Показывает персональные категории пользователя"""
-    user_id = message.from_user.id
-    categories = db.get_user_categories(user_id)
-    
-    if not categories:
-        response = "📂 <b>Ваши персональные категории</b>\n\n"
-        response += "У вас пока нет персональных категорий.\n\n"
-        response += "Добавьте их через меню или командой:\n"
-        response += "<code>/add_category Название ключевые,слова</code>"
-    else:
-        response = "📂 <b>Ваши персональные категории:</b>\n\n"
-        
-        for category_name, keywords in categories.items():
-            response += f"• <b>{category_name}</b>: {', '.join(keywords)}\n"
-        
-        response += f"\n📊 Всего категорий: {len(categories)}"
-        response += "\n\n⚙️ Управление: /add_category /delete_category"
-    
-    bot.reply_to(message, response, parse_mode='HTML', reply_markup=create_categories_keyboard())
+    reply_view(message, my_categories_view(message.from_user.id))
 
 @bot.message_handler(commands=['delete_category'])
 def delete_category_cmd(message):
@@ -923,16 +1205,17 @@ def delete_category_cmd(message):
         # Проверяем, существует ли категория
         user_categories = db.get_user_categories(user_id)
         if category_name not in user_categories:
-            bot.reply_to(message, f"❌ Категория '{category_name}' не найдена.\n\nИспользуйте /my_categories чтобы посмотреть ваши категории.")
+            outbox.reply_to(message, f"❌ Категория '{category_name}' не найдена.\n\nИспользуйте /my_categories чтобы посмотреть ваши категории.")
             return
             
         db.delete_user_category(user_id, category_name)
-        response = f"🗑 Категория '{category_name}' удалена!"
+        response = f"🗑 Категория '{category_name}' удалена!\n\n"
+        response += "Прошлые расходы этой категории можно распределить заново кнопкой ниже или командой /recategorize"
         
-        bot.reply_to(message, response, reply_markup=create_categories_keyboard())
+        outbox.reply_to(message, response, reply_markup=create_recategorize_keyboard())
             
     except ValueError:
-        bot.reply_to(message, '''<b>Неверный формат</b>
+        outbox.reply_to(message, '''<b>Неверный формат</b>
 
 Используйте:
 <code>/delete_category Название_категории</code>
@@ -942,319 +1225,835 @@ def delete_category_cmd(message):
 
 Посмотреть ваши категории: /my_categories''', parse_mode='HTML', reply_markup=create_categories_keyboard())
 
-# Существующие команды
-@bot.message_handler(commands=['categories'])
-def show_categories_cmd(message):
-    """Показывает меню управления категориями"""
-    categories_text = "📂 <b>Управление категориями</b>\n\n"
-    categories_text += "Здесь вы можете настроить свои персональные категории для автоматического определения трат."
+@bot.message_handler(commands=['recategorize'])
+def recategorize_cmd(message):
+    """Пересчитывает категории всех прошлых расходов по текущим правилам"""
+    if not start_recategorization(message.chat.id, message.from_user.id):
+        outbox.reply_to(message, "⏳ Пересчет категорий уже идет, дождитесь его завершения.")
+
+def start_recategorization(chat_id, user_id):
+    """Запускает пересчет категорий в фоне; False, если он уже идет"""
+    with recategorize_jobs_lock:
+        if user_id in recategorize_jobs:
+            return False
+        recategorize_jobs.add(user_id)
     
-    bot.reply_to(message, categories_text, parse_mode='HTML', reply_markup=create_categories_keyboard())
+    threading.Thread(
+        target=run_recategorization,
+        args=(chat_id, user_id),
+        name=f"recategorize-{user_id}",
+        daemon=True
+    ).start()
+    return True
+
+def run_recategorization(chat_id, user_id):
+    """Пересчет категорий с отчетом о прогрессе (выполняется в отдельном потоке)"""
+    try:
+        # message_id нужен для правок с прогрессом - ждем отправки (это отдельный поток)
+        status = outbox.send_message(chat_id=chat_id, text="🔄 Пересчитываю категории прошлых расходов...").result()
+        last_update = time.monotonic()
+        
+        def report_progress(processed, total, changed):
+            nonlocal last_update
+            now = time.monotonic()
+            if now - last_update < PROGRESS_UPDATE_INTERVAL:
+                return
+            last_update = now
+            
+            # Правка уходит в фоне: ошибка отображения прогресса не прерывает пересчет,
+            # а неотправленный прогресс заменяется более свежим
+            outbox.edit_message_text(
+                chat_id=chat_id,
+                message_id=status.message_id,
+                text=f"🔄 Пересчитываю категории: {processed * 100 // total}% "
+                     f"({processed:,} из {total:,}), изменено: {changed:,}"
+            )
+        
+        result = db.recategorize_operations(user_id, progress=report_progress)
+        
+        outbox.edit_message_text(
+            chat_id=chat_id,
+            message_id=status.message_id,
+            text=f"✅ Категории пересчитаны\n\n"
+                 f"Проверено расходов: {result['processed']:,}\n"
+                 f"Изменена категория: {result['changed']:,}",
+            reply_markup=create_stats_keyboard()
+        )
+    except Exception as e:
+        print(f"Ошибка при пересчете категорий: {e}")
+        traceback.print_exc()
+        outbox.send_message(chat_id=chat_id, text="❌ Не удалось пересчитать категории")
+    finally:
+        with recategorize_jobs_lock:
+            recategorize_jobs.discard(user_id)
+
+# Импорт операций из CSV: файл читается потоком и записывается порциями
+import_requests = TTLStateStore(EDIT_STATE_TIMEOUT)  # /import без файла: ждем файл
+
+@bot.message_handler(commands=['import'])
+def import_cmd(message):
+    """Объясняет формат импорта и ждет файл"""
+    parts = message.text.split(maxsplit=1)
+    try:
+        options = parse_import_options(parts[1] if len(parts) > 1 else '')
+    except CsvImportError as e:
+        outbox.reply_to(message, f"❌ {e}")
+        return
+    import_requests.set(message.from_user.id, {'options': options})
+    outbox.reply_to(message, IMPORT_HELP, parse_mode='HTML')
 
-@bot.message_handler(commands=['stats'])
-def show_stats_cmd(message):
-    """Показывает статистику по категориям"""
+@bot.message_handler(content_types=['document'])
+def import_document(message):
+    """Импортирует CSV-файл, отправленный с подписью /import или после команды"""
     user_id = message.from_user.id
-    operations = db.get_operations(user_id)
+    parts = (message.caption or '').split(maxsplit=1)
     
-    expenses_by_category = {}
+    try:
+        if parts and parts[0].split('@')[0] == '/import':
+            options = parse_import_options(parts[1] if len(parts) > 1 else '')
+        else:
+            pending = import_requests.get(user_id)
+            if pending is None:
+                outbox.reply_to(message, "📎 Чтобы загрузить операции из файла, отправьте его с подписью /import")
+                return
+            options = pending['options']
+    except CsvImportError as e:
+        outbox.reply_to(message, f"❌ {e}")
+        return
     
-    for op in operations:
-        if op['type'] == 'expense':
-            category = op['category']
-            amount = op['amount']
-            
-            if category not in expenses_by_category:
-                expenses_by_category[category] = 0
-            expenses_by_category[category] += amount
+    import_requests.clear(user_id)
+    run_import(message, options)
+
+def run_import(message, options):
+    """Скачивает файл потоком и загружает операции с отчетом о прогрессе (медленная полоса)"""
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    document = message.document
     
-    if not expenses_by_category:
-        bot.reply_to(message, "📊 У вас пока нет расходов для статистики.", reply_markup=create_main_keyboard())
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        outbox.reply_to(message, f"❌ Файл больше {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ, Telegram не отдаст его боту")
         return
     
-    sorted_categories = sorted(expenses_by_category.items(), key=lambda x: x[1], reverse=True)
+    # message_id нужен для правок с прогрессом
+    status = outbox.reply_to(message, "📥 Загружаю операции из файла...").result()
+    importer = CsvImporter(options, tz=user_timezone(user_id))
+    imported = 0
+    last_update = time.monotonic()
     
-    stats_text = "📊 <b>Статистика по категориям:</b>\n\n"
-    total_expenses = sum(expenses_by_category.values())
+    def report_progress(count):
+        nonlocal imported, last_update
+        imported = count
+        now = time.monotonic()
+        if now - last_update < PROGRESS_UPDATE_INTERVAL:
+            return
+        last_update = now
+        outbox.edit_message_text(
+            chat_id=chat_id,
+            message_id=status.message_id,
+            text=f"📥 Загружено операций: {count:,}"
+        )
     
-    for category, amount in sorted_categories:
-        percentage = (amount / total_expenses) * 100
-        stats_text += f"• {category}: <b>{amount:,} руб.</b> ({percentage:.1f}%)\n"
+    def finish(text, keyboard=None):
+        outbox.edit_message_text(chat_id=chat_id, message_id=status.message_id, text=text,
+                                 parse_mode='HTML', reply_markup=keyboard)
     
-    stats_text += f"\n💵 <b>Всего расходов: {total_expenses:,} руб.</b>"
+    started = time.perf_counter()
+    try:
+        with requests.get(bot.get_file_url(document.file_id), stream=True, timeout=IMPORT_DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            # Иначе urllib3 закроет поток, дочитав ответ, раньше TextIOWrapper
+            response.raw.auto_close = False
+            stream = open_text(response.raw, options.get('encoding'))
+            db.import_operations(user_id, importer.read(stream), progress=report_progress)
+    except CsvImportError as e:
+        finish(f"❌ {html.escape(str(e))}")
+        return
+    except Exception as e:
+        print(f"❌ Ошибка импорта: {e}")
+        traceback.print_exc()
+        finish(f"❌ Не удалось загрузить файл. Загружено операций до ошибки: {imported:,}")
+        return
     
-    bot.reply_to(message, stats_text, parse_mode='HTML', reply_markup=create_stats_keyboard())
-
-@bot.message_handler(commands=['list'])
-def list_operations_cmd(message):
+    print(f"📥 Импорт для {user_id}: {imported} операций за {time.perf_counter() - started:.2f} с")
+    text = f"✅ <b>Импорт завершен</b>\n\nЗагружено операций: {imported:,}"
+    if importer.errors:
+        text += f"\nПропущено строк с ошибками: {importer.errors:,}\n"
+        for line_number, error in importer.error_samples:
+            text += f"\n• строка {line_number}: {html.escape(error)}"
+    finish(text, create_stats_keyboard())
+
+# Поиск по описаниям операций через полнотекстовый индекс (FTS5)
+search_sessions = TTLStateStore(EDIT_STATE_TIMEOUT)  # user_id -> последний поиск для кнопок
+
+SEARCH_HELP = (
+    "🔍 <b>Поиск по описаниям:</b> <code>/search текст [период]</code>\n"
+    "Например: <code>/search пятерочка год</code>, <code>/search такси 2024-03</code>\n"
+    "Слова ищутся по началу: «бенз» найдет «бензин»."
+)
+
+def search_results_text(session):
+    totals = session['totals']
+    text = (f"🔍 <b>{html.escape(session['text'])}</b> за {session['label']}\n"
+            f"Найдено: {totals['count']}")
+    if totals['expenses']:
+        text += f"\n🔴 Расходы: {totals['expenses']:,} руб."
+    if totals['income']:
+        text += f"\n✅ Доходы: {totals['income']:,} руб."
+    return text
+
+@bot.message_handler(commands=['search'])
+def search_cmd(message):
+    """Ищет операции по словам из описания: /search текст [период]"""
     user_id = message.from_user.id
-    operations = db.get_operations(user_id)
+    words = message.text.split()[1:]
+    tz = user_timezone(user_id)
+    period = parse_period('', tz=tz)
+    # Последнее слово - период, если распознается ("/search такси 2024")
+    if len(words) > 1:
+        try:
+            period = parse_period(words[-1], tz=tz)
+            words = words[:-1]
+        except PeriodError:
+            pass
     
-    if not operations:
-        bot.reply_to(message, "У вас пока нет операций.", reply_markup=create_main_keyboard())
+    text = ' '.join(words)
+    if not search_words(text):
+        outbox.reply_to(message, f"{SEARCH_HELP}\n\n{PERIOD_HELP}", parse_mode='HTML')
         return
-        
-    operations_list = "📊 <b>Ваши операции:</b>\n\n"
     
-    for op in operations:
-        op_type = op.get('type', 'expense')
-        category = op.get('category', 'другое')
-        
-        if op_type == 'income':
-            operations_list += f"✅ +{op['amount']} руб. - {op['description']}\n"
-        else:
-            operations_list += f"🔴 {op['amount']} руб. - {op['description']} [{category}]\n"
+    totals = db.search_totals(user_id, text, period.start, period.end)
+    if totals['count'] == 0:
+        outbox.reply_to(message, f"🔍 По запросу «{text}» за {period.label} ничего не найдено")
+        return
+    
+    session = {'text': text, 'start': period.start, 'end': period.end,
+               'label': period.label, 'totals': totals}
+    search_sessions.set(user_id, session)
+    page = db.search_operations(user_id, text, period.start, period.end, OPERATIONS_PER_PAGE)
+    sent = outbox.reply_to(
+        message,
+        search_results_text(session),
+        parse_mode='HTML',
+        reply_markup=create_operations_keyboard(page, SEARCH_OLDER_PREFIX, SEARCH_NEWER_PREFIX)
+    )
+    remember_page_message(sent, session)
+
+# Список и статистика с фильтрами: /list cat:транспорт >5000 2025-Q3
+list_filters = TTLStateStore(EDIT_STATE_TIMEOUT)  # user_id -> последний список с фильтром для кнопок
+
+def filtered_page(user_id, operation_filter, before=None, after=None):
+    period = operation_filter.period
+    return db.get_operations_page(user_id, OPERATIONS_PER_PAGE, before=before, after=after,
+                                  start=period.start, end=period.end, filters=operation_filter.conditions)
+
+def filtered_list_text(session):
+    stats = session['stats']
+    text = (f"📊 <b>Операции: {html.escape(session['filter'].label)}</b>\n"
+            f"Найдено: {stats['total_operations']}")
+    if stats['total_expenses']:
+        text += f"\n🔴 Расходы: {stats['total_expenses']:,} руб."
+    if stats['total_income']:
+        text += f"\n✅ Доходы: {stats['total_income']:,} руб."
+    return text + "\n\nНажмите на операцию для редактирования:"
+
+def command_filter(message):
+    """OperationFilter из аргументов команды или None, если фильтра нет; бросает FilterError"""
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        return None
+    operation_filter = parse_filter(args[1], tz=user_timezone(message.from_user.id))
+    return None if operation_filter.empty else operation_filter
+
+def reply_filter_error(message, error):
+    outbox.reply_to(message, f"❌ {html.escape(str(error))}\n\n{FILTER_HELP}\n{PERIOD_HELP}", parse_mode='HTML')
+
+def filtered_list_cmd(message, operation_filter):
+    """Первая страница /list с фильтром; фильтр запоминается для кнопок"""
+    user_id = message.from_user.id
+    period = operation_filter.period
+    stats = db.get_user_statistics(user_id, period.start, period.end, operation_filter.conditions)
+    if not stats['total_operations']:
+        outbox.reply_to(message, f"📭 Нет операций: {operation_filter.label}")
+        return
     
-    bot.reply_to(message, operations_list, parse_mode='HTML', reply_markup=create_main_keyboard())
+    session = {'filter': operation_filter, 'stats': stats}
+    list_filters.set(user_id, session)
+    sent = outbox.reply_to(
+        message,
+        filtered_list_text(session),
+        parse_mode='HTML',
+        reply_markup=create_operations_keyboard(filtered_page(user_id, operation_filter),
+                                                FILTER_OLDER_PREFIX, FILTER_NEWER_PREFIX)
+    )
+    remember_page_message(sent, session)
 
-@bot.message_handler(commands=['balance'])
-def show_balance_cmd(message):
+# Выгрузка операций: строки идут из курсора прямо во временный файл
+@bot.message_handler(commands=['export'])
+def export_cmd(message):
+    """Выгружает операции за период в CSV или XLSX: /export [период] [csv|xlsx]"""
     user_id = message.from_user.id
-    operations = db.get_operations(user_id)
+    export_format = 'csv'
+    period_words = []
+    for word in message.text.split()[1:]:
+        if word.lower() in EXPORT_FORMATS:
+            export_format = word.lower()
+        else:
+            period_words.append(word)
     
-    total_income = sum(op['amount'] for op in operations if op['type'] == 'income')
-    total_expenses = sum(op['amount'] for op in operations if op['type'] == 'expense')
-    balance = total_income - total_expenses
+    try:
+        tz = user_timezone(user_id)
+        period = parse_period(' '.join(period_words), tz=tz)
+        document, extension, count = export_operations(
+            db.iter_operations(user_id, period.start, period.end), export_format, tz
+        )
+    except (PeriodError, ExportError) as e:
+        formats = ' или '.join(f"<code>{name}</code>" for name in EXPORT_FORMATS if name != 'xlsx' or xlsx_available())
+        outbox.reply_to(message, f"❌ {html.escape(str(e))}\n\n{PERIOD_HELP}\nФормат: {formats}", parse_mode='HTML')
+        return
     
-    balance_text = f"""
-💰 <b>Ваш финансовый баланс</b>
+    if count == 0:
+        document.close()
+        outbox.reply_to(message, f"📭 За {period.label} операций нет")
+        return
+    
+    if period.start is None:
+        file_name = f"operations.{extension}"
+    else:
+        last_day = period.end - timedelta(days=1)
+        file_name = f"operations_{period.start:%Y-%m-%d}_{last_day:%Y-%m-%d}.{extension}"
+    
+    sent = outbox.send_document(
+        message.chat.id,
+        document,
+        visible_file_name=file_name,
+        caption=f"📤 Операции за {period.label}: {count:,}"
+    )
+    # Временный файл закрываем, когда Telegram его получил (или отправка не удалась)
+    sent.add_done_callback(lambda future: document.close())
 
-📈 Доходы: <b>+{total_income:,} руб.</b>
-📉 Расходы: <b>-{total_expenses:,} руб.</b>
-———————————————
-💵 Баланс: <b>{balance:,} руб.</b>
-    """
-    bot.reply_to(message, balance_text, parse_mode='HTML', reply_markup=create_main_keyboard())
+# Существующие команды
+@bot.message_handler(commands=['categories'])
+def show_categories_cmd(message):
+    """Показывает меню управления категориями"""
+    reply_view(message, categories_menu_view())
+
+@bot.message_handler(commands=['stats'])
+def show_stats_cmd(message):
+    """Показывает статистику: /stats [период и фильтры] [vs [период]]"""
+    try:
+        operation_filter = command_filter(message)
+    except FilterError as e:
+        reply_filter_error(message, e)
+        return
+    
+    view = stats_view(message.from_user.id, operation_filter)
+    if view is None:
+        text = "📊 У вас пока нет расходов для статистики." if operation_filter is None \
+            else f"📊 Нет операций: {operation_filter.label}"
+        outbox.reply_to(message, text, reply_markup=create_main_keyboard())
+        return
+    reply_view(message, view)
+
+@bot.message_handler(commands=['list'])
+def list_operations_cmd(message):
+    """Список операций: /list [фильтры]"""
+    try:
+        operation_filter = command_filter(message)
+        if operation_filter is not None and operation_filter.compare is not None:
+            raise FilterError("Сравнение периодов доступно в /stats и /chart")
+    except FilterError as e:
+        reply_filter_error(message, e)
+        return
+    if operation_filter is not None:
+        filtered_list_cmd(message, operation_filter)
+        return
+    
+    view = operations_view(message.from_user.id)
+    if view is None:
+        outbox.reply_to(message, "У вас пока нет операций.", reply_markup=create_main_keyboard())
+        return
+    reply_view(message, view)
+
+@bot.message_handler(commands=['balance'])
+def show_balance_cmd(message):
+    reply_view(message, balance_view(message.from_user.id))
 
 @bot.message_handler(commands=['clear'])
 def clear_operations_cmd(message):
     user_id = message.from_user.id
     db.clear_operations(user_id)
-    bot.reply_to(message, "🗑 История операций очищена.", reply_markup=create_main_keyboard())
+    outbox.reply_to(message, "🗑 История операций очищена.", reply_markup=create_main_keyboard())
 
 @bot.message_handler(commands=['myid'])
 def show_my_id_cmd(message):
     user_id = message.from_user.id
     first_name = message.from_user.first_name
-    bot.reply_to(message, f"🆔 Ваш user_id: {user_id}\n👤 Имя: {first_name}")
+    outbox.reply_to(message, f"🆔 Ваш user_id: {user_id}\n👤 Имя: {first_name}")
 
 @bot.message_handler(commands=['debug'])
 def debug_info_cmd(message):
     user_id = message.from_user.id
-    operations = db.get_operations(user_id)
+    stats = db.get_user_statistics(user_id)
     
     debug_text = f"""
 🔍 <b>Отладочная информация</b>
 
 🆔 Ваш user_id: <code>{user_id}</code>
-📊 Ваших операций: {len(operations)}
+📊 Ваших операций: {stats['total_operations']}
 📂 Персональных категорий: {len(db.get_user_categories(user_id))}
     
 Данные хранятся отдельно для каждого user_id.
 Другие пользователи не видят ваши операции.
     """
-    bot.reply_to(message, debug_text, parse_mode='HTML')
+    
+    # Самые медленные кнопки с момента запуска бота
+    route_stats = callbacks.stats()[:5]
+    if route_stats:
+        debug_text += "\n⏱ <b>Время обработки кнопок:</b>\n"
+        for row in route_stats:
+            debug_text += (f"• <code>{row['route']}</code>: {row['average'] * 1000:.0f} мс в среднем, "
+                           f"макс. {row['max'] * 1000:.0f} мс, нажатий: {row['count']}\n")
+    
+    # Очереди диспетчера обновлений
+    debug_text += "\n📬 <b>Очереди обработки:</b>\n"
+    for lane, metrics in dispatcher.metrics().items():
+        debug_text += (f"• {lane}: в очереди {metrics['pending']} (макс. {metrics['max_pending']}), "
+                       f"ожидание {metrics['wait_avg'] * 1000:.0f} мс в среднем, "
+                       f"p95 {metrics['wait_p95'] * 1000:.0f} мс, обработано: {metrics['processed']}\n")
+    if webhook is not None:
+        metrics = webhook.metrics()
+        debug_text += f"• webhook: в очереди {metrics['queued']}, отклонено: {metrics['rejected']}\n"
+    metrics = outbox.metrics()
+    debug_text += (f"• отправка: в очереди {metrics['pending']}, отправлено {metrics['sent']}, "
+                   f"правок слито {metrics['merged']}, повторов после 429 {metrics['retried']}, "
+                   f"ошибок {metrics['failed']}\n")
+    
+    outbox.reply_to(message, debug_text, parse_mode='HTML')
 
-@bot.message_handler(commands=['month'])
-def show_month_stats_cmd(message):
-    """Показывает статистику за текущий месяц"""
+@bot.message_handler(commands=['timezone'])
+def timezone_cmd(message):
+    """Показывает или меняет часовой пояс: /timezone Europe/Moscow, /timezone +3"""
     user_id = message.from_user.id
-    monthly_ops = db.get_monthly_operations(user_id)
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        name = db.get_user_timezone(user_id) or DEFAULT_TIMEZONE
+        local = datetime.now(user_timezone(user_id))
+        outbox.reply_to(
+            message,
+            f"🕐 Часовой пояс: <b>{html.escape(name)}</b>, сейчас {local:%d.%m.%Y %H:%M}\n\n"
+            f"{TIMEZONE_HELP}",
+            parse_mode='HTML'
+        )
+        return
     
-    if not monthly_ops:
-        bot.reply_to(message, "📅 За текущий месяц операций нет.", reply_markup=create_main_keyboard())
+    try:
+        name = parse_timezone(parts[1])
+    except TimezoneError as e:
+        outbox.reply_to(message, f"❌ {html.escape(str(e))}\n\n{TIMEZONE_HELP}", parse_mode='HTML')
         return
     
-    expenses_by_category = {}
-    monthly_income = 0
-    monthly_expenses = 0
+    db.set_user_timezone(user_id, name)
+    local = datetime.now(get_timezone(name))
+    outbox.reply_to(message, f"✅ Часовой пояс: {name}, сейчас {local:%d.%m.%Y %H:%M}. "
+                             f"Дни и месяцы в статистике считаются по нему.")
+
+@bot.message_handler(commands=['month'])
+def show_month_stats_cmd(message):
+    """Показывает статистику за текущий месяц"""
+    view = month_view(message.from_user.id)
+    if view is None:
+        outbox.reply_to(message, "📅 За текущий месяц операций нет.", reply_markup=create_main_keyboard())
+        return
+    reply_view(message, view)
+
+def deliver_chart(kind, data, send, on_error):
+    """Отправляет график, по возможности не рисуя и не загружая его заново
+
+    send(photo) ставит фото (file_id или PNG) в очередь отправки и возвращает Future
+    с сообщением Telegram, on_error(error) вызывается, если график получить не удалось.
+    Ошибки постановки в очередь (ChartServiceError) пробрасываются вызывающему.
+    """
+    key = chart_key(kind, data)
     
-    for op in monthly_ops:
-        if op['type'] == 'income':
-            monthly_income += op['amount']
-        else:
-            monthly_expenses += op['amount']
-            category = op['category']
-            if category not in expenses_by_category:
-                expenses_by_category[category] = 0
-            expenses_by_category[category] += op['amount']
+    def remember_file_id(future):
+        sent = future.result() if future.exception() is None else None
+        if sent is not None and sent.photo:
+            # Самый крупный размер фото идет последним
+            chart_cache.set_file_id(key, sent.photo[-1].file_id)
     
-    now = datetime.now()
-    month_name = now.strftime("%B %Y")
+    def on_done(chart_png, error):
+        if not chart_png:
+            on_error(error)
+            return
+        send(chart_png).add_done_callback(remember_file_id)
     
-    stats_text = f"📅 <b>Статистика за {month_name}:</b>\n\n"
-    stats_text += f"📈 Доходы: <b>+{monthly_income:,} руб.</b>\n"
-    stats_text += f"📉 Расходы: <b>-{monthly_expenses:,} руб.</b>\n"
-    stats_text += f"💵 Баланс: <b>{monthly_income - monthly_expenses:,} руб.</b>\n\n"
+    # Такой же график уже отправлялся - Telegram хранит его по file_id
+    file_id = chart_cache.get_file_id(key)
+    if not file_id:
+        # Диаграмма рисуется в пуле процессов (или берется из кеша), обработчик не ждет ее
+        chart_service.render(kind, data, on_done)
+        return
     
-    if expenses_by_category:
-        stats_text += "<b>Расходы по категориям:</b>\n"
-        sorted_categories = sorted(expenses_by_category.items(), key=lambda x: x[1], reverse=True)
-        
-        for category, amount in sorted_categories:
-            percentage = (amount / monthly_expenses) * 100 if monthly_expenses > 0 else 0
-            stats_text += f"• {category}: <b>{amount:,} руб.</b> ({percentage:.1f}%)\n"
+    def resent(future):
+        error = future.exception()
+        if error is None:
+            print("✅ График отправлен повторно по file_id")
+            return
+        if not isinstance(error, telebot.apihelper.ApiTelegramException):
+            on_error(error)
+            return
+        print(f"⚠️ file_id больше не действителен: {error}")
+        chart_cache.forget_file_id(key)
+        try:
+            chart_service.render(kind, data, on_done)
+        except ChartServiceError as e:
+            on_error(e)
     
-    bot.reply_to(message, stats_text, parse_mode='HTML', reply_markup=create_stats_keyboard())
+    send(file_id).add_done_callback(resent)
 
 # Визуальная статистика
 @bot.message_handler(commands=['chart'])
 def show_chart(message):
-    """Показывает круговую диаграмму расходов"""
-    user_id = message.from_user.id
+    """Показывает круговую диаграмму расходов: /chart [период и фильтры] [vs [период]]"""
+    try:
+        operation_filter = command_filter(message)
+    except FilterError as e:
+        reply_filter_error(message, e)
+        return
+    
+    if operation_filter is not None and operation_filter.compare is not None:
+        send_comparison_chart(message.chat.id, message.from_user.id, operation_filter)
+    else:
+        send_expenses_chart(message.chat.id, message.from_user.id, operation_filter)
+
+def send_stats(chat_id, user_id, operation_filter=None):
+    """Отправляет текстовую статистику (запасной вариант, если график не получился)"""
+    view = stats_view(user_id, operation_filter)
+    if view is None:
+        outbox.send_message(chat_id=chat_id, text="📊 У вас пока нет расходов для статистики.")
+        return
+    text, keyboard = view
+    outbox.send_message(chat_id=chat_id, text=text, parse_mode='HTML', reply_markup=keyboard)
+
+def send_expenses_chart(chat_id, user_id, operation_filter=None):
+    """Отправляет диаграмму расходов с текстовой статистикой (для /chart и кнопки)"""
     
     print(f"🔍 ДИАГНОСТИКА ДИАГРАММЫ:")
     print(f"👤 User ID: {user_id}")
     
-    # Используем ТОЧНО ТОТ ЖЕ метод, что и в show_stats
-    operations = db.get_operations(user_id)
-    print(f"📊 Операций из db.get_operations(): {len(operations)}")
-    
-    # Собираем данные по категориям ТАК ЖЕ, как в show_stats
-    expenses_by_category = {}
-    
-    for op in operations:
-        print(f"  Операция: {op}")
-        if op['type'] == 'expense':
-            category = op.get('category', 'другое')
-            amount = op['amount']
-            
-            if category not in expenses_by_category:
-                expenses_by_category[category] = 0
-            expenses_by_category[category] += amount
+    # Используем ТОТ ЖЕ агрегирующий запрос, что и в show_stats
+    if operation_filter is None:
+        category_totals = db.get_expenses_by_category(user_id)
+        title = "📊 <b>Статистика расходов:</b>\n\n"
+    else:
+        period = operation_filter.period
+        category_totals = db.get_expenses_by_category(user_id, period.start, period.end, operation_filter.conditions)
+        title = f"📊 <b>Расходы за {html.escape(operation_filter.label)}:</b>\n\n"
+    expenses_by_category = {category: total for category, (total, count) in category_totals.items()}
     
-    print(f"💸 Найдено расходных операций: {len([op for op in operations if op['type'] == 'expense'])}")
+    print(f"💸 Найдено расходных операций: {sum(count for total, count in category_totals.values())}")
     print(f"📂 Категории расходов: {expenses_by_category}")
     
     if not expenses_by_category:
-        # Детальная диагностика почему нет расходов
-        income_ops = [op for op in operations if op['type'] == 'income']
-        expense_ops = [op for op in operations if op['type'] == 'expense']
-        
-        print(f"📈 Доходных операций: {len(income_ops)}")
-        print(f"📉 Расходных операций: {len(expense_ops)}")
-        
-        if expense_ops:
-            print("⚠️ Есть расходные операции, но категории пустые!")
-            for op in expense_ops:
-                print(f"  Расход: {op['amount']} - '{op['description']}' - категория: '{op.get('category', 'НЕТ КАТЕГОРИИ')}'")
-        
-        bot.reply_to(message, "📊 У вас пока нет расходов для построения диаграммы.")
+        text = "📊 У вас пока нет расходов для построения диаграммы." if operation_filter is None \
+            else f"📊 Нет расходов: {operation_filter.label}"
+        outbox.send_message(chat_id=chat_id, text=text)
         return
     
-    # Создаем диаграмму
+    # Формируем текстовую статистику
+    total_expenses = sum(expenses_by_category.values())
+    stats_text = title
+    
+    sorted_categories = sorted(expenses_by_category.items(), key=lambda x: x[1], reverse=True)
+    for category, amount in sorted_categories:
+        percentage = (amount / total_expenses) * 100
+        stats_text += f"• {category}: <b>{amount:,} руб.</b> ({percentage:.1f}%)\n"
+    
+    stats_text += f"\n💵 <b>Всего расходов: {total_expenses:,} руб.</b>"
+    
+    def send_chart(photo):
+        """Отправляет диаграмму с текстовой статистикой"""
+        sent = outbox.send_photo(
+            chat_id=chat_id,
+            photo=photo,
+            caption=stats_text,
+            parse_mode='HTML',
+            reply_markup=create_stats_keyboard()
+        )
+        print("✅ Диаграмма передана на отправку")
+        return sent
+    
+    def chart_failed(error):
+        print(f"❌ Диаграмма не создана: {error}")
+        # Показываем обычную статистику как fallback
+        send_stats(chat_id, user_id, operation_filter)
+    
     try:
-        print("🔄 Вызываем charts.create_expenses_chart...")
-        chart_buffer = charts.create_expenses_chart(expenses_by_category, user_id)
+        deliver_chart('expenses', expenses_by_category, send_chart, chart_failed)
+    except ChartServiceError as e:
+        print(f"❌ Ошибка при создании диаграммы: {e}")
+        send_stats(chat_id, user_id, operation_filter)
+
+def send_comparison_chart(chat_id, user_id, operation_filter):
+    """Отправляет график расходов по категориям за два периода (/chart ... vs ...)"""
+    period, compare = operation_filter.period, operation_filter.compare
+    current = expenses_by_category(user_id, period, operation_filter.conditions)
+    previous = expenses_by_category(user_id, compare, operation_filter.conditions)
+    if not current and not previous:
+        outbox.send_message(chat_id=chat_id, text=f"📊 Нет расходов: {operation_filter.label}, {compare.label}")
+        return
+    
+    comparison_data = {
+        'periods': [period.label, compare.label],
+        'categories': [list(item) for item in compared_categories(current, previous)],
+    }
+    text, keyboard = period_view(user_id, period, operation_filter.conditions, compare, operation_filter.label)
+    
+    def send_chart(photo):
+        """Отправляет график с итогами за оба периода"""
+        if len(text) <= CAPTION_LIMIT:
+            return outbox.send_photo(chat_id=chat_id, photo=photo, caption=text,
+                                     parse_mode='HTML', reply_markup=keyboard)
         
-        if chart_buffer:
-            print("✅ Диаграмма создана успешно, отправляем...")
-            # Формируем текстовую статистику
-            total_expenses = sum(expenses_by_category.values())
-            stats_text = "📊 <b>Статистика расходов:</b>\n\n"
-            
-            sorted_categories = sorted(expenses_by_category.items(), key=lambda x: x[1], reverse=True)
-            for category, amount in sorted_categories:
-                percentage = (amount / total_expenses) * 100
-                stats_text += f"• {category}: <b>{amount:,} руб.</b> ({percentage:.1f}%)\n"
-            
-            stats_text += f"\n💵 <b>Всего расходов: {total_expenses:,} руб.</b>"
-            
-            # Отправляем изображение и текст
-            bot.send_photo(
-                chat_id=message.chat.id,
-                photo=chart_buffer,
-                caption=stats_text,
-                parse_mode='HTML',
-                reply_markup=create_stats_keyboard()
-            )
-            print("✅ Диаграмма отправлена пользователю")
-        else:
-            print("❌ charts.create_expenses_chart вернул None")
-            # Показываем ту же статистику что и в show_stats
-            show_stats_cmd(message)
+        # Длинная разбивка не помещается в подпись - отправляем ее после фото
+        sent = outbox.send_photo(chat_id=chat_id, photo=photo)
+        
+        def send_breakdown(future):
+            if future.exception() is None:
+                outbox.send_message(chat_id=chat_id, text=text, parse_mode='HTML', reply_markup=keyboard)
+        
+        sent.add_done_callback(send_breakdown)
+        return sent
     
-    except Exception as e:
-        print(f"❌ Ошибка при создании диаграммы: {e}")
-        import traceback
-        traceback.print_exc()
-        # Показываем обычную статистику как fallback
-        show_stats_cmd(message)
+    def chart_failed(error):
+        print(f"❌ График сравнения не создан: {error}")
+        send_stats(chat_id, user_id, operation_filter)
+    
+    try:
+        deliver_chart('comparison', comparison_data, send_chart, chart_failed)
+    except ChartServiceError as e:
+        print(f"❌ Ошибка при создании графика сравнения: {e}")
+        send_stats(chat_id, user_id, operation_filter)
 
 @bot.message_handler(commands=['history'])
 def show_history_chart(message):
     """Показывает историю доходов/расходов за несколько месяцев"""
-    user_id = message.from_user.id
+    # Период можно указать аргументом: /history 24
+    months = HISTORY_DEFAULT_MONTHS
+    parts = message.text.split()
+    if len(parts) > 1:
+        try:
+            months = int(parts[1])
+        except ValueError:
+            outbox.reply_to(message, "❌ Укажите количество месяцев числом, например: <code>/history 12</code>", parse_mode='HTML')
+            return
+        if not 1 <= months <= HISTORY_MAX_MONTHS:
+            outbox.reply_to(message, f"❌ Период должен быть от 1 до {HISTORY_MAX_MONTHS} месяцев")
+            return
     
-    # Собираем данные за последние 6 месяцев
+    send_history_chart(message.chat.id, message.from_user.id, months)
+
+def send_history_chart(chat_id, user_id, months):
+    """Отправляет график доходов/расходов за последние months месяцев (для /history и кнопки)"""
+    # Собираем данные за последние N месяцев одним запросом
     monthly_data = {}
-    now = datetime.now()
-    
-    for i in range(6):
-        year = now.year
-        month = now.month - i
-        if month <= 0:
-            month += 12
-            year -= 1
-        
-        monthly_ops = db.get_monthly_operations(user_id, year, month)
-        
-        monthly_income = sum(op['amount'] for op in monthly_ops if op['type'] == 'income')
-        monthly_expenses = sum(op['amount'] for op in monthly_ops if op['type'] == 'expense')
-        
+    for (year, month), totals in db.get_monthly_totals(user_id, months, user_timezone(user_id)).items():
         month_name = datetime(year, month, 1).strftime("%b %Y")
-        monthly_data[month_name] = {
-            'income': monthly_income,
-            'expenses': monthly_expenses
-        }
+        monthly_data[month_name] = totals
     
     # Проверяем, есть ли данные
     total_income = sum(data['income'] for data in monthly_data.values())
     total_expenses = sum(data['expenses'] for data in monthly_data.values())
     
     if total_income == 0 and total_expenses == 0:
-        bot.reply_to(message, "📅 Недостаточно данных для построения графика истории.")
+        outbox.send_message(chat_id=chat_id, text="📅 Недостаточно данных для построения графика истории.")
         return
     
-    # Создаем график
-    try:
-        chart_buffer = charts.create_monthly_stats_chart(monthly_data, user_id)
-        
-        if chart_buffer:
-            # Текстовая информация
-            history_text = "📈 <b>Динамика за 6 месяцев:</b>\n\n"
-            
-            for month_name, data in monthly_data.items():
-                if data['income'] > 0 or data['expenses'] > 0:
-                    balance = data['income'] - data['expenses']
-                    history_text += f"• {month_name}: +{data['income']:,} / -{data['expenses']:,} руб. "
-                    history_text += f"(баланс: {balance:,} руб.)\n"
-            
-            history_text += f"\n💰 <b>Итого за период:</b>"
-            history_text += f"\nДоходы: +{total_income:,} руб."
-            history_text += f"\nРасходы: -{total_expenses:,} руб."
-            history_text += f"\nБаланс: {total_income - total_expenses:,} руб."
-            
-            bot.send_photo(
-                chat_id=message.chat.id,
-                photo=chart_buffer,
-                caption=history_text,
-                parse_mode='HTML',
-                reply_markup=create_stats_keyboard()
+    # Текстовая информация
+    months_text = ""
+    for month_name, data in monthly_data.items():
+        if data['income'] > 0 or data['expenses'] > 0:
+            balance = data['income'] - data['expenses']
+            months_text += f"• {month_name}: +{data['income']:,} / -{data['expenses']:,} руб. "
+            months_text += f"(баланс: {balance:,} руб.)\n"
+    
+    summary_text = f"\n💰 <b>Итого за период:</b>"
+    summary_text += f"\nДоходы: +{total_income:,} руб."
+    summary_text += f"\nРасходы: -{total_expenses:,} руб."
+    summary_text += f"\nБаланс: {total_income - total_expenses:,} руб."
+    
+    header = f"📈 <b>Динамика за {months} мес.:</b>\n\n"
+    history_text = header + months_text + summary_text
+    
+    def send_history(photo):
+        """Отправляет график истории с разбивкой по месяцам"""
+        # Подпись к фото ограничена Telegram, длинную разбивку отправляем отдельно
+        if len(history_text) > CAPTION_LIMIT:
+            sent = outbox.send_photo(
+                chat_id=chat_id,
+                photo=photo,
+                caption=header + summary_text.lstrip("\n"),
+                parse_mode='HTML'
             )
+            
+            def send_breakdown(future):
+                # Разбивку отправляем только после фото: если file_id устарел,
+                # фото отправится заново вместе с ней
+                if future.exception() is None:
+                    outbox.send_message(
+                        chat_id=chat_id,
+                        text=header + months_text,
+                        parse_mode='HTML',
+                        reply_markup=create_stats_keyboard()
+                    )
+            
+            sent.add_done_callback(send_breakdown)
+            return sent
+        return outbox.send_photo(
+            chat_id=chat_id,
+            photo=photo,
+            caption=history_text,
+            parse_mode='HTML',
+            reply_markup=create_stats_keyboard()
+        )
+    
+    def history_failed(error):
+        print(f"❌ График истории не создан: {error}")
+        if isinstance(error, ChartServiceError):
+            # Например, график не успел отрисоваться за CHART_TIMEOUT
+            outbox.send_message(chat_id=chat_id, text=f"❌ Ошибка при создании графика: {error}")
         else:
-            bot.reply_to(message, "❌ Не удалось создать график.")
+            outbox.send_message(chat_id=chat_id, text="❌ Не удалось создать график.")
     
-    except Exception as e:
-        bot.reply_to(message, f"❌ Ошибка при создании графика: {e}")
+    try:
+        deliver_chart('monthly', monthly_data, send_history, history_failed)
+    except ChartServiceError as e:
+        outbox.send_message(chat_id=chat_id, text=f"❌ Ошибка при создании графика: {e}")
+
+def report_startup(timings):
+    """Печатает длительность этапов запуска, чтобы замедление старта было заметно"""
+    parts = ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in timings)
+    print(f"⏱ Время запуска: {parts}")
+
+def time_first_get_updates(on_first_request):
+    """Вызывает on_first_request() в момент отправки первого getUpdates"""
+    original = bot.get_updates
+    
+    def get_updates(*args, **kwargs):
+        bot.get_updates = original
+        on_first_request()
+        return original(*args, **kwargs)
+    
+    bot.get_updates = get_updates
 
-# Простой запуск для локальной разработки
-if __name__ == "__main__":
-    print("💰 Бот запущен! Для остановки нажмите Ctrl+C")
+def startup():
+    """Этап запуска: схема базы и прогрев графиков
+
+    Возвращает report_ready(stage) - печатает отчет о времени запуска,
+    когда бот готов получать обновления.
+    """
+    imported = time.perf_counter()
+    db.init_database()
+    db_ready = time.perf_counter()
+    
+    # matplotlib загружается только в процессах пула графиков: при первом
+    # графике или заранее в фоне, если включен CHART_WARMUP=1
+    if CHART_WARMUP:
+        chart_service.warm_up()
+    
+    def report_ready(stage):
+        now = time.perf_counter()
+        report_startup([
+            ("импорт", imported - STARTUP_BEGAN),
+            ("база", db_ready - imported),
+            (stage, now - db_ready),
+            ("всего", now - STARTUP_BEGAN),
+        ])
+    
+    return report_ready
+
+# Выставляется по SIGTERM/SIGINT, чтобы polling не переподключался после остановки
+stop_requested = threading.Event()
+webhook = None
+
+def request_stop(signum, frame):
+    """SIGTERM (остановка контейнера) и Ctrl+C: прерываем главный поток и завершаемся"""
+    stop_requested.set()
+    raise KeyboardInterrupt
+
+def run_polling(report_ready):
+    """Long polling с переподключением: паузы растут экспоненциально, пока Telegram недоступен"""
+    time_first_get_updates(lambda: report_ready("до первого getUpdates"))
+    delay = POLLING_BACKOFF_MIN
+    while not stop_requested.is_set():
+        started = time.monotonic()
+        try:
+            # getUpdates не работает, пока у бота установлен webhook
+            bot.remove_webhook()
+            # non_stop=False: при ошибке API polling возвращает управление сюда
+            bot.polling(non_stop=False, interval=0, timeout=60)
+            if stop_requested.is_set():
+                break
+            print("⚠️ Polling остановлен ошибкой Telegram API")
+        except Exception as e:
+            print(f"⚠️ Нет связи с Telegram: {e}")
+        
+        # Если до сбоя все работало долго, начинаем паузы заново
+        if time.monotonic() - started > POLLING_BACKOFF_MAX:
+            delay = POLLING_BACKOFF_MIN
+        pause = delay * random.uniform(0.5, 1.0)
+        print(f"🔄 Переподключение через {pause:.1f} с")
+        stop_requested.wait(pause)
+        delay = min(delay * 2, POLLING_BACKOFF_MAX)
+
+def run_webhook(report_ready):
+    """Регистрирует webhook в Telegram и принимает обновления до остановки"""
+    global webhook
+    if not WEBHOOK_URL:
+        raise ValueError("Для RUN_MODE=webhook нужен WEBHOOK_URL - публичный адрес бота")
+    
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    webhook = WebhookServer(bot.process_new_updates, secret_token, backlog=dispatcher.pending)
+    try:
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=secret_token,
+                        max_connections=WEBHOOK_MAX_CONNECTIONS)
+        report_ready("до приема webhook")
+        webhook.serve_forever()
+    finally:
+        # Webhook в Telegram не удаляем: пока бот перезапускается, обновления ждут на стороне Telegram
+        webhook.close()
+
+def main():
+    """Запуск бота. Импорт модуля ничего не запускает: потоки отправки и диспетчера
+    создаются при первом обновлении, база - в startup()"""
+    if not API_TOKEN:
+        raise ValueError("BOT_TOKEN не найден! Проверьте .env файл или переменные окружения на Railway")
+    
+    print(f"💰 Бот запущен ({RUN_MODE})! Для остановки нажмите Ctrl+C")
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
     
     try:
-        bot.polling(none_stop=True, interval=0, timeout=60)
+        report_ready = startup()
+        if RUN_MODE == 'webhook':
+            run_webhook(report_ready)
+        else:
+            run_polling(report_ready)
+    except KeyboardInterrupt:
+        print("\n🛑 Остановка...")
     except Exception as e:
         print(f"\n❌ Ошибка: {e}")
         # На Railway бот должен перезапускаться при ошибках
         time.sleep(10)
+    finally:
+        # Дорабатываем уже принятые обновления
+        dispatcher.shutdown()
+        chart_service.shutdown()
+        outbox.shutdown()
+        # Переносим WAL в основной файл базы и закрываем соединения
+        db.close()
+
+# Простой запуск для локальной разработки
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# tests/test_categories.py
+# Автомат Ахо-Корасик в CategoryMatcher дает ту же категорию, что и поиск
+# подстрок по правилам в порядке приоритета.
+import random
+
+import pytest
+
+from categories import CATEGORIES, DEFAULT_CATEGORY, AUTOMATON_MIN_RULES, CategoryMatcher
+
+ALPHABET = 'абвгдеёжкмнорст '
+
+
+def loop_match(rules, description):
+    """Эталон: первое по порядку правило, слово которого есть в описании"""
+    description = description.lower()
+    for keyword, category in rules:
+        if keyword in description:
+            return category
+    return DEFAULT_CATEGORY
+
+
+def random_word(rng, length):
+    return ''.join(rng.choice(ALPHABET.strip()) for _ in range(length))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_automaton_matches_loop(seed):
+    rng = random.Random(seed)
+    # Короткие слова из маленького алфавита: много вложенных и пересекающихся совпадений
+    user_categories = {
+        f'Категория {index}': [random_word(rng, rng.randint(1, 4)) for _ in range(rng.randint(1, 20))]
+        for index in range(30)
+    }
+    matcher = CategoryMatcher(user_categories)
+    assert matcher.use_automaton
+
+    for _ in range(300):
+        description = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+        if rng.random() < 0.3:
+            description = description.upper()
+        assert matcher.match(description) == loop_match(matcher.rules, description), description
+
+
+def test_small_rule_set_uses_loop():
+    matcher = CategoryMatcher({'Еда': 'хлеб,молоко'.split(',')})
+    assert len(matcher.rules) < AUTOMATON_MIN_RULES
+    assert not matcher.use_automaton
+    assert matcher.match('Купил ХЛЕБ') == 'Еда'
+
+
+def test_personal_categories_win_over_standard():
+    keywords = [f'слово{index}' for index in range(AUTOMATON_MIN_RULES)] + ['такси']
+    matcher = CategoryMatcher({'Работа': keywords})
+    assert matcher.use_automaton
+    assert matcher.match('Такси до офиса') == 'Работа'
+    assert matcher.match('бензин') == 'транспорт'
+    assert matcher.match('что-то непонятное') == DEFAULT_CATEGORY
+
+
+def test_rule_order_beats_position_in_text():
+    # "кино" из развлечений стоит в CATEGORIES после "такси" из транспорта
+    assert list(CATEGORIES).index('транспорт') < list(CATEGORIES).index('развлечения')
+    keywords = [f'слово{index}' for index in range(AUTOMATON_MIN_RULES)]
+    matcher = CategoryMatcher({'Прочее': keywords})
+    assert matcher.match('кино, потом такси') == 'транспорт'
+
+
+def test_empty_keywords_are_ignored():
+    matcher = CategoryMatcher({'Пусто': ['', '  ']})
+    assert matcher.match('что угодно') == DEFAULT_CATEGORY
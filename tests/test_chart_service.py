@@ -0,0 +1,42 @@
+# tests/test_chart_service.py
+# Таймаут отрисовки доходит до вызывающего, даже если рендерер ловит все исключения
+import signal
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import chart_service
+from chart_service import ChartTimeoutError, _render_chart
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, 'setitimer'), reason="нет SIGALRM")
+
+
+def slow_renderer(data, user_id):
+    # Как функции charts.py: любое исключение превращается в None
+    try:
+        time.sleep(5)
+    except Exception:
+        return None
+
+
+def use_renderer(monkeypatch, renderer):
+    backend = SimpleNamespace(create_expenses_chart=renderer)
+    monkeypatch.setattr(chart_service.importlib, 'import_module', lambda name: backend)
+
+
+def test_timeout_is_raised_when_renderer_swallows_it(monkeypatch):
+    use_renderer(monkeypatch, slow_renderer)
+    started = time.perf_counter()
+    with pytest.raises(ChartTimeoutError):
+        _render_chart('expenses', {'еда': 100}, 0.05)
+    assert time.perf_counter() - started < 1
+
+
+def test_next_job_is_not_marked_as_timed_out(monkeypatch):
+    use_renderer(monkeypatch, slow_renderer)
+    with pytest.raises(ChartTimeoutError):
+        _render_chart('expenses', {'еда': 100}, 0.05)
+
+    use_renderer(monkeypatch, lambda data, user_id: None)
+    assert _render_chart('expenses', {}, 0.05) is None
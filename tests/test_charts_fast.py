@@ -0,0 +1,27 @@
+# tests/test_charts_fast.py
+# Быстрый рендерер рисует кириллицу шрифтами DejaVu, а без них не загружается
+import importlib
+
+import pytest
+from PIL import Image
+
+import charts_fast
+
+
+def test_renders_cyrillic_labels():
+    buffer = charts_fast.create_expenses_chart({'Продукты': 1500, 'Такси': 700, 'Кафе': 300}, None)
+    assert buffer is not None
+    assert Image.open(buffer).size == (900, 680)
+
+    buffer = charts_fast.create_monthly_stats_chart({'01.2025': {'income': 5000, 'expenses': 3200}}, None)
+    assert buffer is not None
+
+
+def test_missing_fonts_fail_the_import(tmp_path, monkeypatch):
+    monkeypatch.setenv('CHART_FONT_DIR', str(tmp_path))
+    monkeypatch.setenv('XDG_DATA_DIRS', str(tmp_path))  # Системные каталоги шрифтов Pillow
+    monkeypatch.setattr(charts_fast, '_fonts', {})
+    with pytest.raises(ImportError, match='DejaVuSans.ttf'):
+        importlib.reload(charts_fast)
+    monkeypatch.undo()
+    importlib.reload(charts_fast)
@@ -0,0 +1,124 @@
+# tests/test_dispatcher.py
+# Порядок обновлений внутри пользователя и параллельность между пользователями
+import threading
+import time
+from types import SimpleNamespace
+
+import dispatcher
+from dispatcher import KeyedLane, UpdateDispatcher, update_user_id
+
+
+def make_update(user_id, number, field='message'):
+    event = SimpleNamespace(from_user=SimpleNamespace(id=user_id), number=number)
+    return SimpleNamespace(**{field: event})
+
+
+def test_update_user_id():
+    assert update_user_id(make_update(7, 0)) == 7
+    assert update_user_id(make_update(8, 0, 'callback_query')) == 8
+    channel_post = SimpleNamespace(channel_post=SimpleNamespace(from_user=None, chat=SimpleNamespace(id=-100)))
+    assert update_user_id(channel_post) == -100
+    assert update_user_id(SimpleNamespace()) is None
+
+
+def test_updates_of_one_user_keep_order(monkeypatch):
+    # Маленький пакет - очередь пользователя много раз переходит между потоками
+    monkeypatch.setattr(dispatcher, 'DISPATCH_BATCH', 3)
+    handled = {}
+    lock = threading.Lock()
+
+    def handle(update):
+        time.sleep(0.0001)
+        with lock:
+            handled.setdefault(update.message.from_user.id, []).append(update.message.number)
+
+    updates = UpdateDispatcher(handle, workers=4, slow_workers=1)
+    for number in range(200):
+        for user_id in range(5):
+            updates.submit(make_update(user_id, number))
+    updates.shutdown()
+
+    assert handled == {user_id: list(range(200)) for user_id in range(5)}
+    assert updates.pending() == 0
+    assert updates.metrics()['fast']['processed'] == 1000
+
+
+def test_users_are_handled_in_parallel():
+    # Пока первый пользователь ждет, второй должен обработаться
+    release = threading.Event()
+    done = threading.Event()
+    lane = KeyedLane('test', 2)
+    lane.submit(1, release.wait)
+    lane.submit(2, done.set)
+    assert done.wait(5)
+    release.set()
+    lane.shutdown()
+
+
+def test_slow_lane_does_not_block_fast_lane():
+    # График одного пользователя не задерживает текстовые ответы другим
+    release = threading.Event()
+    done = threading.Event()
+
+    def handle(update):
+        if update.message.number == 'chart':
+            release.wait(5)
+        else:
+            done.set()
+
+    updates = UpdateDispatcher(handle, is_slow=lambda update: update.message.number == 'chart',
+                               workers=1, slow_workers=1)
+    updates.submit(make_update(1, 'chart'))
+    updates.submit(make_update(2, 'text'))
+    assert done.wait(5)
+    release.set()
+    updates.shutdown()
+
+
+def test_updates_of_one_user_keep_order_across_lanes():
+    # "500 еда" после /chart того же пользователя ждет график, а не обгоняет его
+    release = threading.Event()
+    handled = []
+
+    def handle(update):
+        if update.message.number == 'chart':
+            release.wait(5)
+        handled.append((update.message.from_user.id, update.message.number))
+
+    updates = UpdateDispatcher(handle, is_slow=lambda update: update.message.number == 'chart',
+                               workers=2, slow_workers=1)
+    updates.submit(make_update(1, 'chart'))
+    updates.submit(make_update(1, 'text'))
+    updates.submit(make_update(2, 'text'))
+    deadline = time.monotonic() + 5
+    while (2, 'text') not in handled and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert handled == [(2, 'text')]
+    release.set()
+    while len(handled) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert handled == [(2, 'text'), (1, 'chart'), (1, 'text')]
+    assert updates.metrics()['slow']['processed'] == 2
+
+    # Очередь пользователя опустела - полоса снова выбирается по is_slow
+    updates.submit(make_update(1, 'text'))
+    updates.shutdown()
+    assert updates.metrics()['fast']['processed'] == 2
+    assert updates.pending() == 0
+
+
+def test_errors_do_not_stop_the_queue():
+    handled = []
+
+    def handle(update):
+        if update.message.number == 1:
+            raise ValueError("сбой обработчика")
+        handled.append(update.message.number)
+
+    updates = UpdateDispatcher(handle, workers=2, slow_workers=1)
+    for number in range(3):
+        updates.submit(make_update(1, number))
+    updates.shutdown()
+
+    assert handled == [0, 2]
+    assert updates.metrics()['fast']['errors'] == 1
@@ -0,0 +1,96 @@
+# tests/test_export_import.py
+# Выгрузка /export читается обратно импортом /import без потерь
+import gzip
+import random
+from datetime import datetime
+
+import pytest
+
+import exporter
+from csv_import import CsvImporter, open_text
+from exporter import export_operations, xlsx_available
+from periods import get_timezone
+from sqlite_database import Database
+
+DESCRIPTIONS = (
+    'такси домой', 'Пятёрочка; продукты', 'кафе "Ромашка"', 'перевод, сдача', 'аптека\nРигла',
+    'зарплата', '  пробелы  ', 'ёлка',
+)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+def fill(database, user_id=1, count=500):
+    rng = random.Random(1)
+    database.import_operations(user_id, (
+        (rng.randint(1, 100000), rng.choice(DESCRIPTIONS), rng.choice(('expense', 'income')),
+         1700000000 + rng.randint(0, 400 * 86400))
+        for _ in range(count)
+    ))
+
+
+def snapshot(database, user_id):
+    return sorted(
+        (row['ts'], row['type'], row['amount'], row['category'], row['description'])
+        for row in database.iter_operations(user_id)
+    )
+
+
+def import_file(database, user_id, binary_stream, tz=None):
+    importer = CsvImporter({}, tz=tz)
+    database.import_operations(user_id, importer.read(open_text(binary_stream)))
+    return importer
+
+
+@pytest.mark.parametrize('tz_name', (None, 'Asia/Vladivostok', 'America/New_York', 'UTC-05:30'))
+def test_csv_round_trip(database, tz_name):
+    tz = get_timezone(tz_name) if tz_name else None
+    fill(database)
+    exported, suffix, count = export_operations(database.iter_operations(1), 'csv', tz)
+    assert (suffix, count) == ('csv', 500)
+
+    with exported:
+        importer = import_file(database, 2, exported, tz)
+    assert (importer.rows, importer.errors) == (500, 0)
+    # Описания читаются без крайних пробелов, как и при вводе в боте
+    expected = [(ts, kind, amount, category, description.strip())
+                for ts, kind, amount, category, description in snapshot(database, 1)]
+    assert snapshot(database, 2) == expected
+
+
+def test_gzipped_csv_round_trip(database, monkeypatch):
+    monkeypatch.setattr(exporter, 'EXPORT_GZIP_THRESHOLD', 0)
+    fill(database, count=100)
+    exported, suffix, count = export_operations(database.iter_operations(1), 'csv')
+    assert (suffix, count) == ('csv.gz', 100)
+
+    with exported, gzip.GzipFile(fileobj=exported, mode='rb') as archive:
+        import_file(database, 2, archive)
+    assert len(snapshot(database, 2)) == 100
+    assert sum(row[2] for row in snapshot(database, 2)) == sum(row[2] for row in snapshot(database, 1))
+
+
+@pytest.mark.skipif(not xlsx_available(), reason="нет openpyxl")
+def test_xlsx_matches_csv(database):
+    import openpyxl
+
+    tz = get_timezone('Asia/Vladivostok')
+    fill(database, count=50)
+    exported, suffix, count = export_operations(database.iter_operations(1), 'xlsx', tz)
+    assert (suffix, count) == ('xlsx', 50)
+
+    with exported:
+        sheet = openpyxl.load_workbook(exported, read_only=True).active
+        rows = list(sheet.iter_rows(values_only=True))
+    assert rows[0] == exporter.EXPORT_COLUMNS
+    expected = [
+        (datetime.fromtimestamp(row['ts'], tz).replace(tzinfo=None), exporter.TYPE_NAMES[row['type']],
+         row['amount'], row['category'], row['description'])
+        for row in database.iter_operations(1)
+    ]
+    assert rows[1:] == expected
@@ -0,0 +1,92 @@
+# tests/test_filters.py
+# Грамматика фильтров /list, /stats и /chart (filters.parse_filter)
+from datetime import datetime
+
+import pytest
+
+from filters import parse_filter, FilterError
+
+NOW = datetime(2025, 3, 10, 12)
+
+
+def test_empty_filter():
+    operation_filter = parse_filter('', NOW)
+    assert operation_filter.empty
+    assert operation_filter.period.start is None and operation_filter.period.end is None
+    assert operation_filter.label == 'все время'
+
+
+def test_all_conditions_together():
+    operation_filter = parse_filter('Расходы cat:такси >5000 2025-Q3', NOW)
+    assert operation_filter.conditions == {
+        'operation_type': 'expense', 'category': 'такси', 'min_amount': 5001, 'max_amount': None,
+    }
+    assert operation_filter.period.start == datetime(2025, 7, 1)
+    assert operation_filter.period.end == datetime(2025, 10, 1)
+    assert operation_filter.label == 'расходы, такси, от 5001 руб., 3 кв. 2025'
+
+
+@pytest.mark.parametrize('text, category', [
+    ('cat:транспорт', 'транспорт'),
+    ('cat:Еда', 'Еда'),                      # Регистр значения сохраняется
+    ('CAT:Фриланс', 'Фриланс'),              # Ключ - без учета регистра
+    ('категория:Еда', 'Еда'),
+    ('cat:"Дом и быт"', 'Дом и быт'),
+])
+def test_category(text, category):
+    assert parse_filter(text, NOW).category == category
+
+
+@pytest.mark.parametrize('text, bounds', [
+    ('>5000', (5001, None)),
+    ('>=5000', (5000, None)),
+    ('<100', (None, 99)),
+    ('<=100', (None, 100)),
+    ('1000..5000', (1000, 5000)),
+    ('>=10 <=10', (10, 10)),
+])
+def test_amount_bounds(text, bounds):
+    operation_filter = parse_filter(text, NOW)
+    assert (operation_filter.min_amount, operation_filter.max_amount) == bounds
+
+
+@pytest.mark.parametrize('text, operation_type', [
+    ('расходы', 'expense'), ('доход', 'income'), ('INCOME', 'income'),
+    ('расходы доходы', 'income'),  # Последнее слово побеждает
+])
+def test_operation_type(text, operation_type):
+    assert parse_filter(text, NOW).operation_type == operation_type
+
+
+@pytest.mark.parametrize('text', [
+    'cat:',                 # Пустая категория
+    '5000..1000',           # Границы перепутаны
+    '>10 <5',
+    '>abc', '>',            # Не число
+    'abc',                  # Не период
+    'cat:"Дом',             # Незакрытая кавычка
+    'vs',                   # Сравнивать не с чем
+    'месяц vs vs',
+    'месяц vs abc',
+    '9999', '0000', 'cat:еда 9999-12',  # Год вне datetime
+    '0001 vs',                          # Раньше первого года периода нет
+])
+def test_errors(text):
+    with pytest.raises(FilterError):
+        parse_filter(text, NOW)
+
+
+def test_compare_with_previous_period():
+    operation_filter = parse_filter('месяц vs', NOW)
+    assert operation_filter.period.start == datetime(2025, 3, 1)
+    # Месяц еще идет: сравниваем с тем же числом дней прошлого месяца
+    assert operation_filter.compare.start == datetime(2025, 2, 1)
+    assert operation_filter.compare.end == datetime(2025, 2, 10, 12)
+    assert not operation_filter.empty
+
+
+def test_compare_with_explicit_period():
+    operation_filter = parse_filter('2025-03 vs 2024-03 cat:Еда', NOW)
+    assert operation_filter.category == 'Еда'
+    assert (operation_filter.compare.start, operation_filter.compare.end) == (datetime(2024, 3, 1), datetime(2024, 4, 1))
+    assert operation_filter.compare.label == '03.2024'
@@ -0,0 +1,115 @@
+# tests/test_outbound.py
+# Очередь исходящих: порядок внутри чата, слияние правок, повтор после 429
+import threading
+from types import SimpleNamespace
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from outbound import Outbox, TokenBucket
+
+
+class FakeBot:
+    """Записывает вызовы вместо запросов к Telegram"""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.failures = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.gate.wait(5)
+        with self.lock:
+            if self.failures:
+                raise self.failures.pop(0)
+            self.calls.append(('send', chat_id, text))
+        return SimpleNamespace(chat_id=chat_id, text=text)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        with self.lock:
+            self.calls.append(('edit', chat_id, text))
+        return text
+
+
+def api_error(code, description, retry_after=None):
+    result_json = {'ok': False, 'error_code': code, 'description': description}
+    if retry_after is not None:
+        result_json['parameters'] = {'retry_after': retry_after}
+    return ApiTelegramException('sendMessage', None, result_json)
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def outbox(bot):
+    # Лимиты с запасом, чтобы тесты не ждали корзину токенов
+    outbox = Outbox(bot, workers=4, global_rate=10000, chat_rate=10000, chat_burst=10000)
+    yield outbox
+    outbox.shutdown()
+
+
+def test_threads_start_on_first_request(bot):
+    outbox = Outbox(bot, workers=2)
+    assert outbox._threads == []
+    outbox.send_message(1, 'привет').result(5)
+    assert len(outbox._threads) == 2
+    outbox.shutdown()
+
+
+def test_messages_of_one_chat_keep_order(bot, outbox):
+    futures = [outbox.send_message(chat_id, str(number)) for number in range(50) for chat_id in range(4)]
+    for future in futures:
+        future.result(5)
+    for chat_id in range(4):
+        texts = [text for _, chat, text in bot.calls if chat == chat_id]
+        assert texts == [str(number) for number in range(50)]
+    assert outbox.metrics()['sent'] == 200
+
+
+def test_pending_edits_are_merged(bot, outbox):
+    # Пока первое сообщение чата отправляется, правки копятся и сливаются в одну
+    bot.gate.clear()
+    first = outbox.send_message(1, 'первое')
+    edits = [outbox.edit_message_text(f'правка {number}', 1, 42) for number in range(5)]
+    bot.gate.set()
+    first.result(5)
+    assert {future.result(5) for future in edits} == {'правка 4'}
+    assert [call for call in bot.calls if call[0] == 'edit'] == [('edit', 1, 'правка 4')]
+    assert outbox.metrics()['merged'] == 4
+
+
+def test_retry_after_429(bot, outbox):
+    bot.failures.append(api_error(429, 'Too Many Requests', retry_after=0))
+    assert outbox.send_message(1, 'после паузы').result(5).text == 'после паузы'
+    assert outbox.metrics()['retried'] == 1
+
+
+def test_other_errors_reach_the_future(bot, outbox):
+    bot.failures.append(api_error(400, 'Bad Request: chat not found'))
+    with pytest.raises(ApiTelegramException):
+        outbox.send_message(1, 'никому').result(5)
+    assert outbox.send_message(1, 'дальше').result(5).text == 'дальше'
+    assert outbox.metrics()['failed'] == 1
+
+
+def test_submit_after_shutdown(bot):
+    outbox = Outbox(bot, workers=1)
+    outbox.shutdown()
+    with pytest.raises(RuntimeError):
+        outbox.send_message(1, 'поздно')
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+    assert bucket.take() == 0.0
+    assert bucket.take() == 0.0
+    assert bucket.delay() == 0.5
+    assert bucket.take() == 0.5   # Токен в долг
+    now[0] += 1.5
+    assert bucket.full()
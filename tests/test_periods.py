@@ -0,0 +1,91 @@
+# tests/test_periods.py
+# Разбор периодов (periods.parse_period) и предыдущий период для сравнения
+from datetime import datetime
+
+import pytest
+
+from periods import parse_period, previous_period, PeriodError
+
+NOW = datetime(2025, 3, 10, 12)
+
+
+@pytest.mark.parametrize('text, start, end, label', [
+    ('', None, None, 'все время'),
+    ('все', None, None, 'все время'),
+    ('неделя', datetime(2025, 3, 10), datetime(2025, 3, 17), 'неделя с 10.03.2025'),
+    ('месяц', datetime(2025, 3, 1), datetime(2025, 4, 1), '03.2025'),
+    ('год', datetime(2025, 1, 1), datetime(2026, 1, 1), '2025'),
+    ('2024', datetime(2024, 1, 1), datetime(2025, 1, 1), '2024'),
+    ('2024-02', datetime(2024, 2, 1), datetime(2024, 3, 1), '02.2024'),
+    ('02.2024', datetime(2024, 2, 1), datetime(2024, 3, 1), '02.2024'),
+    ('2024-12', datetime(2024, 12, 1), datetime(2025, 1, 1), '12.2024'),
+    ('2024-Q4', datetime(2024, 10, 1), datetime(2025, 1, 1), '4 кв. 2024'),
+    ('q1-2024', datetime(2024, 1, 1), datetime(2024, 4, 1), '1 кв. 2024'),
+    ('2024-к2', datetime(2024, 4, 1), datetime(2024, 7, 1), '2 кв. 2024'),
+    ('2024-W01', datetime(2024, 1, 1), datetime(2024, 1, 8), 'неделя с 01.01.2024'),
+    ('2020-W53', datetime(2020, 12, 28), datetime(2021, 1, 4), 'неделя с 28.12.2020'),
+    ('29.02.2024', datetime(2024, 2, 29), datetime(2024, 3, 1), '29.02.2024'),
+    ('01.01.2024-31.03.2024', datetime(2024, 1, 1), datetime(2024, 4, 1), '01.01.2024 - 31.03.2024'),
+    ('2024-01-01..2024-03-31', datetime(2024, 1, 1), datetime(2024, 4, 1), '01.01.2024 - 31.03.2024'),
+    ('2024-01-01-2024-03-31', datetime(2024, 1, 1), datetime(2024, 4, 1), '01.01.2024 - 31.03.2024'),
+])
+def test_parse_period(text, start, end, label):
+    assert tuple(parse_period(text, NOW)) == (start, end, label)
+
+
+@pytest.mark.parametrize('text', [
+    'x', '2024-13', '2024-00', '2024-Q5', '2021-W53', '2024-W00', '30.02.2024', '31.03.2024-01.01.2024',
+    # Годы вне datetime: конец периода или сам год не помещаются в datetime
+    '0000', '9999', '0000-01', '9999-12', '12.9999', '9999-Q4', 'Q1-0000', '9999-W52', '0000-W01',
+    '31.12.9999', '01.01.2024-31.12.9999', '9999-12-31',
+])
+def test_parse_period_errors(text):
+    with pytest.raises(PeriodError):
+        parse_period(text, NOW)
+
+
+@pytest.mark.parametrize('text, start, end, label', [
+    ('2024-03', datetime(2024, 2, 1), datetime(2024, 3, 1), '02.2024'),
+    ('2024-01', datetime(2023, 12, 1), datetime(2024, 1, 1), '12.2023'),
+    ('2024-Q1', datetime(2023, 10, 1), datetime(2024, 1, 1), '4 кв. 2023'),
+    ('2024', datetime(2023, 1, 1), datetime(2024, 1, 1), '2023'),
+    ('2024-W10', datetime(2024, 2, 26), datetime(2024, 3, 4), 'неделя с 26.02.2024'),
+    ('29.02.2024', datetime(2024, 2, 28), datetime(2024, 2, 29), '28.02.2024'),
+    ('01.01.2024-10.01.2024', datetime(2023, 12, 22), datetime(2024, 1, 1), '22.12.2023 - 31.12.2023'),
+])
+def test_previous_of_finished_period(text, start, end, label):
+    assert tuple(previous_period(parse_period(text, NOW), NOW)) == (start, end, label)
+
+
+def test_previous_of_running_period_is_cut_to_same_length():
+    previous = previous_period(parse_period('месяц', NOW), NOW)
+    assert (previous.start, previous.end) == (datetime(2025, 2, 1), datetime(2025, 2, 10, 12))
+    assert previous.label == '02.2025 по 10.02'
+
+    previous = previous_period(parse_period('неделя', NOW), NOW)
+    assert (previous.start, previous.end) == (datetime(2025, 3, 3), datetime(2025, 3, 3, 12))
+    assert previous.label == 'неделя с 03.03.2025 до 12:00'
+
+
+@pytest.mark.parametrize('now, text, start, end', [
+    # 30 дней марта длиннее всего февраля: сравниваем с целым февралем
+    (datetime(2025, 3, 31, 10), 'месяц', datetime(2025, 2, 1), datetime(2025, 3, 1)),
+    (datetime(2024, 3, 30, 10), 'месяц', datetime(2024, 2, 1), datetime(2024, 3, 1)),
+    (datetime(2025, 5, 31, 23), 'месяц', datetime(2025, 4, 1), datetime(2025, 5, 1)),
+])
+def test_previous_never_overlaps_current(now, text, start, end):
+    period = parse_period(text, now)
+    previous = previous_period(period, now)
+    assert (previous.start, previous.end) == (start, end)
+    assert previous.end <= period.start
+
+
+def test_previous_of_all_time_is_an_error():
+    with pytest.raises(PeriodError):
+        previous_period(parse_period('', NOW), NOW)
+
+
+@pytest.mark.parametrize('text', ['0001', '0001-01', '01.01.0001'])
+def test_previous_of_first_year_is_an_error(text):
+    with pytest.raises(PeriodError):
+        previous_period(parse_period(text, NOW), NOW)
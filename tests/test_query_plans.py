@@ -0,0 +1,97 @@
+# tests/test_query_plans.py
+# EXPLAIN QUERY PLAN запросов /list, /stats и /search: при любых сочетаниях
+# фильтров, периодов и курсоров таблицы читаются по индексам, без полного просмотра.
+import itertools
+import re
+import zoneinfo
+from datetime import datetime
+
+import pytest
+
+from sqlite_database import Database
+
+FILTER_OPTIONS = {
+    'operation_type': (None, 'expense'),
+    'category': (None, 'транспорт'),
+    'min_amount': (None, 5001),
+    'max_amount': (None, 100000),
+}
+FILTERS = [dict(zip(FILTER_OPTIONS, values)) for values in itertools.product(*FILTER_OPTIONS.values())]
+PERIODS = (
+    (None, None),
+    (datetime(2025, 7, 1), datetime(2025, 10, 1)),         # Целые сутки
+    (datetime(2025, 7, 1, 12), datetime(2025, 10, 1, 6)),  # Неполные сутки на краях
+    (datetime(2025, 7, 1), None),
+)
+CURSORS = ((None, None), ((1751328000, 10), None), (None, (1751328000, 10)))
+
+
+@pytest.fixture(scope='module')
+def database():
+    # У :memory: одно соединение - все запросы пройдут через него
+    database = Database(':memory:')
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def statements(database):
+    """Тексты SELECT-запросов, выполненных в тесте (с подставленными параметрами)"""
+    executed = []
+    with database.connection() as conn:
+        conn.set_trace_callback(executed.append)
+    yield executed
+    with database.connection() as conn:
+        conn.set_trace_callback(None)
+
+
+def full_scans(database, statements):
+    """Шаги планов, в которых таблица просматривается целиком"""
+    scans = []
+    with database.connection() as conn:
+        for statement in statements:
+            if not statement.lstrip().upper().startswith('SELECT'):
+                continue
+            for row in conn.execute(f'EXPLAIN QUERY PLAN {statement}'):
+                detail = row['detail']
+                # SCAN (subquery-N) - проход по уже отобранным строкам, VIRTUAL TABLE - индекс FTS5
+                if re.match(r'SCAN \w', detail) and 'VIRTUAL TABLE' not in detail \
+                        and 'CONSTANT ROW' not in detail:
+                    scans.append((' '.join(statement.split()), detail))
+    return scans
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('start, end', PERIODS)
+def test_list_uses_indexes(database, statements, filters, start, end):
+    for before, after in CURSORS:
+        database.get_operations_page(1, before=before, after=after, start=start, end=end, filters=filters)
+    assert statements
+    assert full_scans(database, statements) == []
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('start, end', PERIODS)
+def test_stats_use_indexes(database, statements, filters, start, end):
+    database.get_user_statistics(1, start, end, filters)
+    database.get_expenses_by_category(1, start, end, filters)
+    assert statements
+    assert full_scans(database, statements) == []
+
+
+@pytest.mark.parametrize('start, end', PERIODS)
+def test_search_uses_indexes(database, statements, start, end):
+    for before, after in CURSORS:
+        database.search_operations(1, 'кофе такси', start, end, before=before, after=after)
+    database.search_totals(1, 'кофе', start, end)
+    assert statements
+    assert full_scans(database, statements) == []
+
+
+@pytest.mark.parametrize('tz', (None, zoneinfo.ZoneInfo('Asia/Vladivostok')))
+def test_history_is_one_indexed_query(database, statements, tz):
+    # /history до 120 месяцев; со смещением от UTC у каждого месяца три диапазона
+    database.get_monthly_totals(1, 120, tz)
+    selects = [statement for statement in statements if statement.lstrip().upper().startswith('SELECT')]
+    assert len(selects) == 1
+    assert full_scans(database, statements) == []
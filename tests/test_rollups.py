@@ -0,0 +1,162 @@
+# tests/test_rollups.py
+# daily_rollups, которые ведут триггеры, совпадают с итогами по самим операциям
+# после любых изменений: добавления, импорта, правки, удаления, очистки и пересчета категорий.
+import random
+import sqlite3
+import threading
+
+import pytest
+
+from sqlite_database import Database, SECONDS_PER_DAY
+
+DESCRIPTIONS = ('такси домой', 'продукты', 'кино', 'аптека', 'зарплата', 'кофе')
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+def raw_totals(database):
+    with database.connection() as conn:
+        rows = conn.execute(f'''
+        SELECT user_id, ts / {SECONDS_PER_DAY}, type, category, SUM(amount), COUNT(*)
+        FROM operations
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ''').fetchall()
+    return [tuple(row) for row in rows]
+
+
+def rollup_totals(database):
+    with database.connection() as conn:
+        rows = conn.execute('''
+        SELECT user_id, day, type, category, total, count
+        FROM daily_rollups
+        ORDER BY 1, 2, 3, 4
+        ''').fetchall()
+    return [tuple(row) for row in rows]
+
+
+def operation_ids(database, user_id):
+    with database.connection() as conn:
+        return [row[0] for row in conn.execute('SELECT id FROM operations WHERE user_id = ?', (user_id,))]
+
+
+def fill(database, rng):
+    for user_id in (1, 2, 3):
+        for _ in range(100):
+            database.add_operation(user_id, rng.randint(1, 5000), rng.choice(DESCRIPTIONS),
+                                   rng.choice(('expense', 'income')))
+    with database.connection() as conn:
+        # Раскидываем операции по дням: перенос ts тоже должен обновлять итоги
+        conn.executemany('UPDATE operations SET ts = ? WHERE id = ?', [
+            (1700000000 + rng.randint(0, 90) * SECONDS_PER_DAY + rng.randint(0, SECONDS_PER_DAY - 1), row[0])
+            for row in conn.execute('SELECT id FROM operations').fetchall()
+        ])
+
+
+def test_rollups_after_insert(database):
+    fill(database, random.Random(1))
+    assert rollup_totals(database) == raw_totals(database)
+
+
+def test_rollups_after_updates(database):
+    rng = random.Random(2)
+    fill(database, rng)
+    for operation_id in rng.sample(operation_ids(database, 1), 60):
+        change = rng.choice(('amount', 'description', 'type', 'category'))
+        if change == 'amount':
+            database.update_operation(operation_id, amount=rng.randint(1, 5000))
+        elif change == 'description':
+            database.update_operation(operation_id, description=rng.choice(DESCRIPTIONS))
+        elif change == 'type':
+            database.update_operation(operation_id, operation_type=rng.choice(('expense', 'income')))
+        else:
+            database.update_operation(operation_id, category=rng.choice(('еда', 'транспорт', 'новая')))
+    with database.connection() as conn:
+        # Перенос операции на другой день
+        conn.execute('UPDATE operations SET ts = ts + ? WHERE user_id = 2 AND id % 3 = 0', (5 * SECONDS_PER_DAY,))
+    assert rollup_totals(database) == raw_totals(database)
+
+
+def test_rollups_after_recategorize(database):
+    fill(database, random.Random(3))
+    database.add_user_category(1, 'Кофейни', 'кофе')
+    result = database.recategorize_operations(1, chunk_size=50)
+    assert result['changed']
+    assert rollup_totals(database) == raw_totals(database)
+
+
+def test_rollups_after_delete_and_clear(database):
+    rng = random.Random(4)
+    fill(database, rng)
+    for operation_id in rng.sample(operation_ids(database, 1), 60):
+        database.delete_operation(operation_id)
+    assert rollup_totals(database) == raw_totals(database)
+
+    database.clear_operations(2)
+    assert rollup_totals(database) == raw_totals(database)
+    assert not any(row[0] == 2 for row in rollup_totals(database))
+
+    # Пустые дни удаляются, а не остаются с нулевыми итогами
+    for operation_id in operation_ids(database, 1):
+        database.delete_operation(operation_id)
+    assert not any(row[0] == 1 for row in rollup_totals(database))
+
+
+def test_rebuild_rollups_matches_triggers(database):
+    fill(database, random.Random(5))
+    expected = rollup_totals(database)
+    database.rebuild_rollups()
+    assert rollup_totals(database) == expected
+
+
+def test_rollups_after_import(database):
+    rng = random.Random(6)
+    fill(database, rng)
+    for user_id in (1, 4):
+        database.import_operations(user_id, (
+            (rng.randint(1, 5000), rng.choice(DESCRIPTIONS), rng.choice(('expense', 'income')),
+             1700000000 + rng.randint(0, 90) * SECONDS_PER_DAY + rng.randint(0, SECONDS_PER_DAY - 1))
+            for _ in range(300)
+        ), chunk_size=64)
+    assert rollup_totals(database) == raw_totals(database)
+
+
+def test_rollups_with_writes_during_import(database):
+    # Флаг массовой загрузки виден только транзакции импорта: операции, добавленные
+    # в это время из других потоков, по-прежнему учитываются триггерами
+    rng = random.Random(7)
+    rows = [
+        (rng.randint(1, 5000), rng.choice(DESCRIPTIONS), rng.choice(('expense', 'income')),
+         1700000000 + rng.randint(0, 90) * SECONDS_PER_DAY)
+        for _ in range(3000)
+    ]
+    importer = threading.Thread(target=database.import_operations, args=(1, rows), kwargs={'chunk_size': 50})
+    importer.start()
+    for _ in range(200):
+        database.add_operation(2, rng.randint(1, 5000), rng.choice(DESCRIPTIONS))
+    importer.join()
+    assert rollup_totals(database) == raw_totals(database)
+    with database.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM bulk_load').fetchone()[0] == 0
+
+
+def test_rollups_after_external_writes(database, tmp_path):
+    # Соединение без функций бота: триггеры схемы не должны их вызывать
+    fill(database, random.Random(8))
+    conn = sqlite3.connect(str(tmp_path / 'test.db'))
+    with conn:
+        conn.execute("INSERT INTO operations (user_id, amount, description, type, category, ts) "
+                     "VALUES (1, 700, 'кофе', 'expense', 'другое', 1700000000)")
+        conn.execute("INSERT INTO operations (user_id, amount, description, type, category, created_at) "
+                     "VALUES (4, 300, 'такси', 'expense', 'транспорт', '2024-01-02 10:00:00')")
+        conn.execute('UPDATE operations SET amount = amount + 1, description = ? WHERE user_id = 1 AND id % 4 = 0',
+                     ('аптека',))
+        conn.execute('UPDATE operations SET ts = ts + ? WHERE user_id = 2 AND id % 3 = 0', (SECONDS_PER_DAY,))
+        conn.execute('DELETE FROM operations WHERE user_id = 3 AND id % 2 = 0')
+    conn.close()
+    assert rollup_totals(database) == raw_totals(database)
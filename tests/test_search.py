@@ -0,0 +1,87 @@
+# tests/test_search.py
+# Поисковый индекс operations_fts, который ведут методы записи Database, совпадает
+# с описаниями операций после добавления, импорта, правки, удаления и очистки.
+import random
+
+import pytest
+
+from sqlite_database import Database, SECONDS_PER_DAY, search_words
+
+DESCRIPTIONS = ('такси домой', 'Пятёрочка продукты', 'кино', 'аптека Ригла', 'зарплата', 'кофе с собой')
+WORDS = ('такси', 'пятерочка', 'продукты', 'аптека', 'кофе', 'кино', 'зарплата')
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+def found(database, user_id, word):
+    """id операций пользователя, найденных по индексу"""
+    return {row['id'] for row in database.search_operations(user_id, word, limit=100000)['operations']}
+
+
+def expected(database, user_id, word):
+    """id операций пользователя, в описании которых есть слово, начинающееся с word"""
+    with database.connection() as conn:
+        rows = conn.execute('SELECT id, description FROM operations WHERE user_id = ?', (user_id,)).fetchall()
+    return {row['id'] for row in rows if any(w.startswith(word) for w in search_words(row['description']))}
+
+
+def assert_index_matches(database):
+    for user_id in (1, 2, 3):
+        for word in WORDS:
+            assert found(database, user_id, word) == expected(database, user_id, word), (user_id, word)
+
+
+def fill(database, rng):
+    for user_id in (1, 2, 3):
+        database.add_operations(user_id, [
+            (rng.randint(1, 5000), rng.choice(DESCRIPTIONS), 'expense')
+            for _ in range(20)
+        ])
+        database.import_operations(user_id, (
+            (rng.randint(1, 5000), rng.choice(DESCRIPTIONS), 'expense',
+             1700000000 + rng.randint(0, 90) * SECONDS_PER_DAY)
+            for _ in range(100)
+        ), chunk_size=32)
+
+
+def test_index_after_insert_and_import(database):
+    fill(database, random.Random(1))
+    assert_index_matches(database)
+
+
+def test_index_after_updates_deletes_and_clear(database):
+    rng = random.Random(2)
+    fill(database, rng)
+    with database.connection() as conn:
+        ids = [row[0] for row in conn.execute('SELECT id FROM operations WHERE user_id = 1')]
+    for operation_id in rng.sample(ids, 40):
+        database.update_operation(operation_id, description=rng.choice(DESCRIPTIONS))
+    for operation_id in rng.sample(ids, 20):
+        database.update_operation(operation_id, amount=rng.randint(1, 5000))
+    for operation_id in rng.sample(ids, 30):
+        database.delete_operation(operation_id)
+    database.clear_operations(2)
+    assert_index_matches(database)
+    assert not found(database, 2, 'такси')
+
+
+def test_rebuild_search_index_after_external_writes(database, tmp_path):
+    import sqlite3
+
+    fill(database, random.Random(3))
+    # Запись без функций бота: триггеры - чистый SQL, поэтому она проходит,
+    # но поисковый индекс отстает до rebuild_search_index()
+    conn = sqlite3.connect(str(tmp_path / 'test.db'))
+    with conn:
+        conn.execute("UPDATE operations SET description = 'такси в аэропорт' WHERE user_id = 1 AND id % 2 = 0")
+        conn.execute("INSERT INTO operations (user_id, amount, description, type, category, ts) "
+                     "VALUES (1, 100, 'кофе навынос', 'expense', 'другое', 1700000000)")
+    conn.close()
+
+    database.rebuild_search_index()
+    assert_index_matches(database)
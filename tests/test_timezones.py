@@ -0,0 +1,92 @@
+# tests/test_timezones.py
+# Часовой пояс пользователя: разбор /timezone, границы периодов в местном
+# времени и попадание операций в местные сутки и месяцы
+import calendar
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from periods import parse_timezone, get_timezone, parse_period, previous_period, TimezoneError
+from sqlite_database import Database, to_timestamp, month_range
+
+NEW_YORK = get_timezone('America/New_York')
+VLADIVOSTOK = get_timezone('Asia/Vladivostok')
+
+
+@pytest.mark.parametrize('text, name', [
+    ('Europe/Moscow', 'Europe/Moscow'),
+    ('europe/moscow', 'Europe/Moscow'),
+    ('мск', 'Europe/Moscow'),
+    ('UTC', 'UTC'),
+    ('+3', 'UTC+03:00'),
+    ('-05:30', 'UTC-05:30'),
+    ('UTC+5', 'UTC+05:00'),
+    ('gmt-3', 'UTC-03:00'),
+    ('+0', 'UTC'),
+])
+def test_parse_timezone(text, name):
+    assert parse_timezone(text) == name
+    get_timezone(name)  # Каждое сохраненное имя снова превращается в tzinfo
+
+
+@pytest.mark.parametrize('text', ['', 'Mars/Base', '+15', '+3:75'])
+def test_parse_timezone_errors(text):
+    with pytest.raises(TimezoneError):
+        parse_timezone(text)
+
+
+def test_fixed_offsets():
+    assert get_timezone('UTC+03:00').utcoffset(None) == timedelta(hours=3)
+    assert get_timezone('UTC-05:30').utcoffset(None) == -timedelta(hours=5, minutes=30)
+
+
+def test_month_bounds_follow_daylight_saving():
+    period = parse_period('2025-03', tz=NEW_YORK)
+    # 1 марта - еще зимнее время (UTC-5), 1 апреля - уже летнее (UTC-4)
+    assert to_timestamp(period.start) == calendar.timegm((2025, 3, 1, 5, 0, 0))
+    assert to_timestamp(period.end) == calendar.timegm((2025, 4, 1, 4, 0, 0))
+    assert (period.start, period.end) == month_range(2025, 3, NEW_YORK)
+
+
+def test_current_month_is_taken_in_local_time():
+    # В UTC уже 1 марта, в Нью-Йорке еще 28 февраля
+    now = datetime(2025, 3, 1, 2, tzinfo=timezone.utc)
+    period = parse_period('месяц', now, NEW_YORK)
+    assert period.label == '02.2025'
+    previous = previous_period(period, now)
+    assert previous.start == datetime(2025, 1, 1, tzinfo=NEW_YORK)
+    assert previous.end.tzinfo is NEW_YORK
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+def test_operations_fall_into_local_months(database):
+    # 28 февраля 20:00 UTC - это уже 1 марта 06:00 во Владивостоке
+    evening = calendar.timegm((2025, 2, 28, 20, 0, 0))
+    database.import_operations(1, [(100, 'такси', 'expense', evening),
+                                   (7, 'кофе', 'expense', evening - 12 * 3600)])
+
+    march = parse_period('2025-03', tz=VLADIVOSTOK)
+    february = parse_period('2025-02', tz=VLADIVOSTOK)
+    assert database.get_user_statistics(1, march.start, march.end)['total_expenses'] == 100
+    assert database.get_user_statistics(1, february.start, february.end)['total_expenses'] == 7
+
+    utc_march = parse_period('2025-03')
+    assert database.get_user_statistics(1, utc_march.start, utc_march.end)['total_expenses'] == 0
+
+
+def test_monthly_totals_use_local_months(database):
+    now = datetime.now(VLADIVOSTOK)
+    local_month_start = datetime(now.year, now.month, 1, tzinfo=VLADIVOSTOK)
+    # За час до местной полуночи 1-го числа и через час после
+    before = to_timestamp(local_month_start) - 3600
+    after = to_timestamp(local_month_start) + 3600
+    database.import_operations(1, [(10, 'до', 'expense', before), (1000, 'после', 'expense', after)])
+
+    totals = list(database.get_monthly_totals(1, 2, VLADIVOSTOK).values())
+    assert [month['expenses'] for month in totals] == [1000, 10]
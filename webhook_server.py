@@ -0,0 +1,163 @@
+# webhook_server.py
+# Прием обновлений Telegram по webhook: небольшой HTTP-сервер проверяет секретный
+# токен и складывает обновления в ограниченную очередь, откуда их забирает бот.
+# Если очередь или бот перегружены, сервер отвечает 503 - Telegram повторит доставку позже.
+import hmac
+import json
+import os
+import queue
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot.types import Update
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес бота, например https://bot.example.com
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or os.getenv('PORT') or '8443')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Если не задан, генерируется при каждом запуске
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+WEBHOOK_MAX_BODY = 1024 * 1024  # Обновление Telegram намного меньше; больше - не от Telegram
+WEBHOOK_BATCH = 100             # Сколько обновлений передать боту за раз
+WEBHOOK_REQUEST_TIMEOUT = 10    # Таймаут чтения запроса, с
+HEALTH_PATH = '/health'
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+_STOP = object()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    timeout = WEBHOOK_REQUEST_TIMEOUT
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        if self.path != webhook.path:
+            return self._reply(404)
+        if not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), webhook.secret_token):
+            return self._reply(403)
+
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            return self._reply(411)
+        if length > WEBHOOK_MAX_BODY:
+            return self._reply(413)
+
+        try:
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self._reply(400)
+        if not isinstance(update, dict) or 'update_id' not in update:
+            return self._reply(400)
+
+        self._reply(200 if webhook.offer(update) else 503)
+
+    def do_GET(self):
+        if self.path == HEALTH_PATH:
+            return self._reply(200, b'ok')
+        self._reply(404)
+
+    def _reply(self, status, body=b''):
+        self.send_response(status)
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Каждый запрос не логируем, ошибки видны по кодам ответа у Telegram (getWebhookInfo)
+        pass
+
+
+class WebhookServer:
+    """HTTP-сервер для webhook Telegram с ограниченной очередью обновлений
+
+    on_updates(updates) получает пачки telebot.types.Update в порядке приема.
+    backlog() (если передан) возвращает, сколько обновлений бот еще не обработал:
+    пока сумма с очередью не меньше queue_size, новые обновления получают 503.
+    """
+
+    def __init__(self, on_updates, secret_token, backlog=None, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                 path=WEBHOOK_PATH, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.on_updates = on_updates
+        self.secret_token = secret_token
+        self.backlog = backlog
+        self.path = path
+        self.queue_size = queue_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = False
+        self._rejected = 0
+
+        self._server = ThreadingHTTPServer((host, port), WebhookHandler)
+        # server_close() дожидается запросов, которые уже принимаются
+        self._server.daemon_threads = False
+        self._server.webhook = self
+        self._consumer = threading.Thread(target=self._consume, name='webhook-consumer', daemon=True)
+        self._consumer.start()
+        print(f"🌐 Webhook слушает {host}:{self._server.server_address[1]}{path}")
+
+    def offer(self, update):
+        """Ставит обновление в очередь; False, если его нужно отклонить (перегрузка или остановка)"""
+        if self._stopping:
+            return False
+        if self.backlog is not None and self.backlog() + self._queue.qsize() >= self.queue_size:
+            self._reject()
+            return False
+        try:
+            self._queue.put_nowait(update)
+        except queue.Full:
+            self._reject()
+            return False
+        return True
+
+    def _reject(self):
+        self._rejected += 1
+        # Не засоряем лог при затяжной перегрузке
+        if self._rejected & (self._rejected - 1) == 0:
+            print(f"⚠️ Webhook перегружен, отклонено обновлений: {self._rejected}")
+
+    def _consume(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            while item is not _STOP:
+                batch.append(item)
+                if len(batch) >= WEBHOOK_BATCH:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    self.on_updates([Update.de_json(update) for update in batch])
+                except Exception as e:
+                    print(f"❌ Ошибка при передаче обновлений из webhook: {e}")
+                    traceback.print_exc()
+            if item is _STOP:
+                return
+
+    def serve_forever(self):
+        """Обрабатывает запросы до вызова shutdown() или KeyboardInterrupt"""
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """Останавливает serve_forever() (вызывать из другого потока)"""
+        self._server.shutdown()
+
+    def close(self):
+        """Перестает принимать запросы и передает боту все, что уже в очереди"""
+        self._stopping = True
+        self._server.server_close()
+        self._queue.put(_STOP)
+        self._consumer.join()
+        print("✅ Webhook остановлен")
+
+    def metrics(self):
+        return {'queued': self._queue.qsize(), 'rejected': self._rejected}